@@ -1,31 +1,116 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
+import asyncio
+import contextvars
+import hashlib
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import re
+import socket
 import time
-from collections import Counter
+from collections import Counter, deque
 import json
-
-# Inicializar NLTK de manera segura
+import math
 try:
-    import nltk
-    from nltk.corpus import stopwords
-    from nltk.tokenize import word_tokenize, sent_tokenize
-    
-    # Descargar recursos de NLTK si no están disponibles
-    try:
-        nltk.data.find('tokenizers/punkt')
-        nltk.data.find('corpora/stopwords')
-    except LookupError:
-        print("Descargando recursos de NLTK...")
-        nltk.download('punkt', quiet=True)
-        nltk.download('stopwords', quiet=True)
+    import fcntl
+except ImportError:
+    fcntl = None
+import sqlite3
+import struct
+import tempfile
+import threading
+import unicodedata
+import uuid
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturoTimeout
+from concurrent.futures import wait as esperar_futuros
+from contextlib import contextmanager
+from functools import lru_cache
+
+from formatos_ncbi import MESH_INDICE, PUBMED_ESPEJO, IndiceMesh, LectorEfetch, iterar_registros_efetch
+
+# NLTK se carga de forma perezosa en el primer uso y nunca descarga recursos al arrancar.
+# TOKENIZADOR=regex evita NLTK por completo; los recursos se preinstalan en NLTK_DATA_DIR
+# durante el build (ver render.yaml).
+TOKENIZADOR = os.getenv("TOKENIZADOR", "nltk").lower()
+NLTK_DATA_DIR = os.getenv("NLTK_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nltk_data"))
+NLTK_DESCARGAR = os.getenv("NLTK_DESCARGAR", "0") == "1"
+
+_nltk_estado = {"cargado": False, "modulos": None}
+_nltk_lock = threading.Lock()
+
+def cargar_nltk():
+    """Inicializa NLTK la primera vez que se necesita; devuelve sus funciones o None si no se puede usar"""
+    if _nltk_estado["cargado"]:
+        return _nltk_estado["modulos"]
     
-    NLTK_AVAILABLE = True
+    with _nltk_lock:
+        if _nltk_estado["cargado"]:
+            return _nltk_estado["modulos"]
+        
+        modulos = None
+        if TOKENIZADOR == "nltk":
+            try:
+                import nltk
+                from nltk.corpus import stopwords
+                from nltk.tokenize import word_tokenize, sent_tokenize
+                
+                if os.path.isdir(NLTK_DATA_DIR) and NLTK_DATA_DIR not in nltk.data.path:
+                    nltk.data.path.insert(0, NLTK_DATA_DIR)
+                
+                try:
+                    # Verificar que los recursos estén instalados usándolos una vez
+                    word_tokenize("prueba de carga.", language='spanish')
+                    stopwords.words('spanish')
+                except LookupError:
+                    if not NLTK_DESCARGAR:
+                        raise
+                    print("Descargando recursos de NLTK...")
+                    for recurso in ('punkt', 'punkt_tab', 'stopwords'):
+                        nltk.download(recurso, quiet=True)
+                    word_tokenize("prueba de carga.", language='spanish')
+                
+                modulos = {
+                    "word_tokenize": word_tokenize,
+                    "sent_tokenize": sent_tokenize,
+                    "stopwords": stopwords
+                }
+            except ImportError:
+                print("NLTK no disponible, usando tokenización básica")
+            except LookupError:
+                print("Recursos de NLTK no instalados, usando tokenización básica")
+        
+        _nltk_estado["modulos"] = modulos
+        _nltk_estado["cargado"] = True
+        return modulos
+
+# NumPy opcional para el scoring vectorizado por lotes
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Cliente HTTP asíncrono opcional para el pipeline async
+try:
+    import httpx
+    import asgiref  # Flask lo necesita para las vistas async
+    ASYNC_DISPONIBLE = True
+except ImportError:
+    ASYNC_DISPONIBLE = False
+
+# Métricas Prometheus opcionales. Con varios workers de gunicorn, PROMETHEUS_MULTIPROC_DIR debe
+# apuntar a un directorio vacío antes de arrancar para que /metrics agregue todos los procesos.
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+    PROMETHEUS_DISPONIBLE = True
 except ImportError:
-    print("NLTK no disponible, usando tokenización básica")
-    NLTK_AVAILABLE = False
+    PROMETHEUS_DISPONIBLE = False
 
 app = Flask(__name__)
 CORS(app)
@@ -34,6 +119,92 @@ CORS(app)
 PUBMED_API_KEY = os.getenv("PUBMED_API_KEY", "d65daf8493357bd078d3abe98d1860dd9608")
 SERPAPI_KEY = os.getenv("SERPAPI_KEY", "4656512120f4468e4bbc0ea857a2db17af9b68eb301e50f940529c3a3073674a")
 
+# Cliente HTTP compartido para las E-utilities de NCBI
+EUTILS_BASE_URL = os.getenv("EUTILS_BASE_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils").rstrip("/")
+EUTILS_POOL_MAXSIZE = int(os.getenv("EUTILS_POOL_MAXSIZE", "10"))
+EUTILS_REINTENTOS = int(os.getenv("EUTILS_REINTENTOS", "3"))
+EUTILS_BACKOFF = float(os.getenv("EUTILS_BACKOFF", "0.5"))
+EUTILS_TIMEOUT_CONEXION = float(os.getenv("EUTILS_TIMEOUT_CONEXION", "5"))
+
+# Limitador de tasa compartido por todos los workers del host (NCBI: 10 req/s con API key, 3 sin ella)
+NCBI_TASA_MAX = float(os.getenv("NCBI_TASA_MAX", "10" if PUBMED_API_KEY else "3"))
+NCBI_RAFAGA_MAX = float(os.getenv("NCBI_RAFAGA_MAX", str(NCBI_TASA_MAX)))
+NCBI_LIMITADOR_ARCHIVO = os.getenv("NCBI_LIMITADOR_ARCHIVO", os.path.join(tempfile.gettempdir(), "citas_apa_ncbi_bucket"))
+
+# Pipeline asíncrono para /citar_texto y /buscar
+PIPELINE_ASYNC = os.getenv("PIPELINE_ASYNC", "0") == "1"
+ASYNC_CONCURRENCIA = int(os.getenv("ASYNC_CONCURRENCIA", "4"))
+
+# Tamaño de lote de efetch en modo streaming (lotes pequeños = primeros resultados antes)
+TAMANO_LOTE_STREAMING = int(os.getenv("TAMANO_LOTE_STREAMING", "5"))
+
+# Modo job: cola durable en SQLite procesada por un pool de hilos en segundo plano
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(tempfile.gettempdir(), "citas_apa_jobs.sqlite3"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_LEASE = int(os.getenv("JOBS_LEASE", "300"))  # segundos antes de reintentar un job abandonado
+JOBS_MAX_INTENTOS = int(os.getenv("JOBS_MAX_INTENTOS", "3"))
+JOBS_RETENCION = int(os.getenv("JOBS_RETENCION", str(24 * 3600)))
+# Arrancar los hilos al importar para retomar los jobs pendientes sin esperar a una petición
+# (flask run, otros servidores WSGI); gunicorn.conf.py lo desactiva y los arranca en post_fork
+JOBS_INICIAR_AL_IMPORTAR = os.getenv("JOBS_INICIAR_AL_IMPORTAR", "1") == "1"
+
+# Documentos largos (/citar_documento): límite total y tamaño máximo de cada sección
+DOCUMENTO_MAX_CARACTERES = int(os.getenv("DOCUMENTO_MAX_CARACTERES", "250000"))
+SECCION_MAX_CARACTERES = int(os.getenv("SECCION_MAX_CARACTERES", "3000"))
+
+# Máximo de textos aceptados por /citar_lote
+CITAR_LOTE_MAX_TEXTOS = int(os.getenv("CITAR_LOTE_MAX_TEXTOS", "500"))
+
+# Máximo de artículos que se pueden pedir con max_results en /buscar y /citar_texto
+MAX_RESULTADOS_MAX = int(os.getenv("MAX_RESULTADOS_MAX", "100"))
+
+# Presupuesto de tiempo por petición de /citar_texto y /buscar (segundos, 0 = sin límite); el cliente
+# puede pedir otro con la cabecera X-Presupuesto-Ms, acotado a PRESUPUESTO_PETICION_MAX
+PRESUPUESTO_PETICION = float(os.getenv("PRESUPUESTO_PETICION", "25"))
+PRESUPUESTO_PETICION_MAX = float(os.getenv("PRESUPUESTO_PETICION_MAX", "60"))
+
+# Resiliencia frente a NCBI: circuit breaker por endpoint, peticiones duplicadas (hedging) tras el p95
+# de latencia en los endpoints indicados (vacío las desactiva) y datos caducados si NCBI falla
+CIRCUITO_FALLOS = int(os.getenv("CIRCUITO_FALLOS", "5"))  # fallos seguidos que abren el circuito
+CIRCUITO_ESPERA = float(os.getenv("CIRCUITO_ESPERA", "30"))  # segundos abierto antes de dejar pasar una prueba
+HEDGE_ENDPOINTS = frozenset(e.strip() for e in os.getenv("HEDGE_ENDPOINTS", "esearch.fcgi,efetch.fcgi").split(",") if e.strip())
+HEDGE_MIN_MS = float(os.getenv("HEDGE_MIN_MS", "50"))
+HEDGE_MIN_MUESTRAS = int(os.getenv("HEDGE_MIN_MUESTRAS", "20"))
+HEDGE_MAX_FRACCION = float(os.getenv("HEDGE_MAX_FRACCION", "0.05"))  # duplicadas como máximo por petición
+CACHE_GRACIA_OBSOLETOS = int(os.getenv("CACHE_GRACIA_OBSOLETOS", str(7 * 24 * 3600)))  # tras el TTL
+
+# Cribado en dos fases: preselección con esummary y descarga completa solo de los mejores candidatos
+CRIBADO_DOS_FASES = os.getenv("CRIBADO_DOS_FASES", "1") == "1"
+
+# Número máximo de PMIDs por llamada a efetch
+TAMANO_LOTE_PUBMED = int(os.getenv("TAMANO_LOTE_PUBMED", "200"))
+
+# Caché de artículos: LRU en memoria + SQLite compartido entre workers
+CACHE_ARTICULOS_MEMORIA = int(os.getenv("CACHE_ARTICULOS_MEMORIA", "2000"))
+CACHE_ARTICULOS_DB = os.getenv("CACHE_ARTICULOS_DB", os.path.join(tempfile.gettempdir(), "citas_apa_articulos.sqlite3"))
+CACHE_ARTICULOS_TTL = int(os.getenv("CACHE_ARTICULOS_TTL", str(30 * 24 * 3600)))
+CACHE_ARTICULOS_MAX_MB = float(os.getenv("CACHE_ARTICULOS_MAX_MB", "200"))
+
+# Caché de resultados de esearch (listas de PMIDs por query)
+CACHE_BUSQUEDAS_MAX = int(os.getenv("CACHE_BUSQUEDAS_MAX", "1000"))
+CACHE_BUSQUEDAS_TTL = int(os.getenv("CACHE_BUSQUEDAS_TTL", str(6 * 3600)))
+
+# Caché de respuestas de /citar_texto y /buscar por contenido de la entrada: LRU en memoria + SQLite
+CACHE_RESPUESTAS_MEMORIA = int(os.getenv("CACHE_RESPUESTAS_MEMORIA", "500"))
+CACHE_RESPUESTAS_DB = os.getenv("CACHE_RESPUESTAS_DB", os.path.join(tempfile.gettempdir(), "citas_apa_respuestas.sqlite3"))
+CACHE_RESPUESTAS_TTL = int(os.getenv("CACHE_RESPUESTAS_TTL", str(24 * 3600)))  # 0 desactiva la caché
+CACHE_RESPUESTAS_MAX_MB = float(os.getenv("CACHE_RESPUESTAS_MAX_MB", "100"))
+CACHE_RESPUESTAS_MAX_AGE = int(os.getenv("CACHE_RESPUESTAS_MAX_AGE", "3600"))  # Cache-Control de /buscar
+
+# Forma parte de la clave de la caché de respuestas: subirla cuando cambie el resultado del pipeline
+VERSION_PIPELINE = "2.1.0"
+
+# Índice MeSH local (MESH_INDICE en formatos_ncbi, generado con construir_indice_mesh.py) y respaldo con la API en vivo
+MESH_FALLBACK_API = os.getenv("MESH_FALLBACK_API", "1") == "1"
+
+# Espejo local de PubMed (PUBMED_ESPEJO en formatos_ncbi, generado con construir_espejo_pubmed.py); la API solo como respaldo
+PUBMED_ESPEJO_FALLBACK_API = os.getenv("PUBMED_ESPEJO_FALLBACK_API", "1") == "1"
+
 # Términos MeSH y DeCS para fisioterapia y ciencias de la salud
 MESH_DECS_MAPPING = {
     'fisioterapia': {
@@ -68,27 +239,1539 @@ MESH_DECS_MAPPING = {
     }
 }
 
+# =========================
+# MÉTRICAS
+# =========================
+
+class _MetricaNula:
+    """Sustituto sin efecto de una métrica cuando prometheus_client no está instalado"""
+    
+    def labels(self, *args, **kwargs):
+        return self
+    
+    def inc(self, cantidad=1):
+        pass
+    
+    def dec(self, cantidad=1):
+        pass
+    
+    def observe(self, valor):
+        pass
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+if PROMETHEUS_DISPONIBLE:
+    metrica_etapa_segundos = prometheus_client.Histogram(
+        "citas_etapa_duracion_segundos", "Duración de cada etapa del pipeline de citación",
+        ["etapa"], buckets=BUCKETS_SEGUNDOS
+    )
+    metrica_ncbi_peticiones = prometheus_client.Counter(
+        "citas_ncbi_peticiones", "Llamadas a E-utilities por endpoint y resultado (ok, http_<código>, error_red)",
+        ["endpoint", "resultado"]
+    )
+    metrica_ncbi_segundos = prometheus_client.Histogram(
+        "citas_ncbi_duracion_segundos", "Duración de las llamadas a E-utilities, reintentos incluidos",
+        ["endpoint"], buckets=BUCKETS_SEGUNDOS
+    )
+    metrica_articulos_descartados = prometheus_client.Counter(
+        "citas_articulos_descartados", "Artículos descargados y descartados por no llegar al umbral de relevancia"
+    )
+    metrica_articulos_cribados = prometheus_client.Counter(
+        "citas_articulos_cribados", "Candidatos que no se llegaron a descargar gracias al cribado en dos fases"
+    )
+    metrica_peticiones_en_curso = prometheus_client.Gauge(
+        "citas_peticiones_en_curso", "Peticiones HTTP en curso por endpoint",
+        ["endpoint"], multiprocess_mode="livesum"
+    )
+    metrica_circuito_transiciones = prometheus_client.Counter(
+        "citas_ncbi_circuito_transiciones", "Cambios de estado del circuit breaker por endpoint (abierto, semiabierto, cerrado)",
+        ["endpoint", "estado"]
+    )
+    metrica_hedges = prometheus_client.Counter(
+        "citas_ncbi_hedges", "Peticiones duplicadas por endpoint y resultado (gana, pierde, error, omitido)",
+        ["endpoint", "resultado"]
+    )
+    metrica_obsoletos_servidos = prometheus_client.Counter(
+        "citas_cache_obsoletos_servidos", "Resultados caducados servidos porque NCBI falló",
+        ["cache"]
+    )
+else:
+    metrica_etapa_segundos = _MetricaNula()
+    metrica_ncbi_peticiones = _MetricaNula()
+    metrica_ncbi_segundos = _MetricaNula()
+    metrica_articulos_descartados = _MetricaNula()
+    metrica_articulos_cribados = _MetricaNula()
+    metrica_peticiones_en_curso = _MetricaNula()
+    metrica_circuito_transiciones = _MetricaNula()
+    metrica_hedges = _MetricaNula()
+    metrica_obsoletos_servidos = _MetricaNula()
+
+@contextmanager
+def medir_etapa(etapa):
+    """Registra la duración de una etapa del pipeline; sirve como bloque with o como decorador"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrica_etapa_segundos.labels(etapa=etapa).observe(time.perf_counter() - inicio)
+
+def registrar_llamada_ncbi(endpoint, inicio, status_code=None):
+    """Cuenta una llamada a E-utilities y su duración; status_code None indica error de red"""
+    nombre = endpoint.split(".", 1)[0]
+    if status_code is None:
+        resultado = "error_red"
+    elif status_code == 200:
+        resultado = "ok"
+    else:
+        resultado = f"http_{status_code}"
+    metrica_ncbi_peticiones.labels(endpoint=nombre, resultado=resultado).inc()
+    metrica_ncbi_segundos.labels(endpoint=nombre).observe(time.perf_counter() - inicio)
+
+# =========================
+# PLAZO POR PETICIÓN
+# =========================
+
+class PlazoAgotado(Exception):
+    """No queda tiempo en el presupuesto de la petición para otra llamada a NCBI"""
+
+class Plazo:
+    """Instante límite de la petición (None sin límite), si alguna etapa se quedó sin tiempo (resultado
+    parcial), si se sirvieron datos caducados y si falló alguna llamada a NCBI (resultado degradado)"""
+    
+    __slots__ = ("limite", "agotado", "obsoletos", "degradado")
+    
+    def __init__(self, segundos):
+        self.limite = time.monotonic() + segundos if segundos else None
+        self.agotado = False
+        self.obsoletos = False
+        self.degradado = False
+    
+    def restante(self):
+        return self.limite - time.monotonic() if self.limite is not None else None
+
+# Por debajo de este margen (segundos) no merece la pena empezar otra llamada
+MARGEN_PLAZO = 0.05
+
+# Se hereda en las tareas asyncio, así que llega también al pipeline asíncrono
+plazo_actual = contextvars.ContextVar("plazo_actual", default=None)
+
+@contextmanager
+def plazo_peticion(segundos):
+    """Aplica un plazo a todas las llamadas a NCBI hechas dentro del bloque (sin límite si segundos es 0/None)"""
+    plazo = Plazo(segundos)
+    token = plazo_actual.set(plazo)
+    try:
+        yield plazo
+    finally:
+        plazo_actual.reset(token)
+
+def tiempo_restante():
+    """Segundos que le quedan a la petición en curso; None si no tiene plazo"""
+    plazo = plazo_actual.get()
+    return plazo.restante() if plazo is not None else None
+
+def plazo_vencido():
+    """True si la petición ya no tiene tiempo; la marca como parcial"""
+    restante = tiempo_restante()
+    if restante is not None and restante <= MARGEN_PLAZO:
+        plazo_actual.get().agotado = True
+        return True
+    return False
+
+def agotar_plazo():
+    """Marca la petición como parcial y devuelve la excepción para lanzarla"""
+    plazo = plazo_actual.get()
+    if plazo is not None:
+        plazo.agotado = True
+    return PlazoAgotado("Presupuesto de tiempo de la petición agotado")
+
+def limitar_timeout(timeout):
+    """Recorta el timeout de una llamada al tiempo que le queda a la petición"""
+    restante = tiempo_restante()
+    if restante is None:
+        return timeout
+    if restante <= MARGEN_PLAZO:
+        raise agotar_plazo()
+    return min(timeout, restante)
+
+def resultado_parcial():
+    plazo = plazo_actual.get()
+    return plazo is not None and plazo.agotado
+
+def marcar_obsoletos():
+    """Anota que la petición en curso usa datos caducados (su respuesta no se guarda en caché)"""
+    plazo = plazo_actual.get()
+    if plazo is not None:
+        plazo.obsoletos = True
+
+def marcar_degradado():
+    """Anota que falló una llamada a NCBI y la respuesta puede estar incompleta (no se guarda en caché)"""
+    plazo = plazo_actual.get()
+    if plazo is not None:
+        plazo.degradado = True
+
+def respuesta_degradada():
+    """True si la petición usó datos caducados o perdió resultados por un fallo de NCBI"""
+    plazo = plazo_actual.get()
+    return plazo is not None and (plazo.obsoletos or plazo.degradado)
+
+# =========================
+# RESILIENCIA NCBI
+# =========================
+
+# Respuestas de NCBI que cuentan como fallo (y que se reintentan)
+ESTADOS_REINTENTO_NCBI = (429, 500, 502, 503, 504)
+
+class CircuitoAbierto(Exception):
+    """El endpoint de NCBI está fallando: se responde al instante sin llamar"""
+
+class InterruptorCircuito:
+    """Circuit breaker de un endpoint: se abre tras N fallos seguidos y, pasada la espera, deja pasar una
+    sola petición de prueba (semiabierto) que lo cierra o lo vuelve a abrir"""
+    
+    def __init__(self, endpoint, umbral, espera):
+        self.endpoint = endpoint
+        self.umbral = umbral
+        self.espera = espera
+        self.estado = "cerrado"
+        self.fallos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+    
+    def _cambiar(self, estado):
+        self.estado = estado
+        metrica_circuito_transiciones.labels(endpoint=self.endpoint.split(".", 1)[0], estado=estado).inc()
+        print(f"Circuito de {self.endpoint}: {estado}")
+    
+    def permitir(self):
+        """Lanza CircuitoAbierto si la petición no debe salir"""
+        with self._lock:
+            if self.estado == "cerrado":
+                return
+            if self.estado == "abierto":
+                if time.monotonic() - self._abierto_desde < self.espera:
+                    raise CircuitoAbierto(f"Circuito abierto para {self.endpoint}")
+                self._cambiar("semiabierto")
+            if self._prueba_en_curso:
+                raise CircuitoAbierto(f"Circuito semiabierto para {self.endpoint}: prueba en curso")
+            self._prueba_en_curso = True
+    
+    def registrar(self, exito):
+        with self._lock:
+            self._prueba_en_curso = False
+            if exito:
+                self.fallos = 0
+                if self.estado != "cerrado":
+                    self._cambiar("cerrado")
+                return
+            self.fallos += 1
+            if self.estado == "semiabierto" or (self.estado == "cerrado" and self.fallos >= self.umbral):
+                self._abierto_desde = time.monotonic()
+                self._cambiar("abierto")
+    
+    def liberar(self):
+        """La petición no llegó a completarse por causas propias (plazo, cancelación): no cuenta"""
+        with self._lock:
+            self._prueba_en_curso = False
+
+class LatenciasNcbi:
+    """Ventana de latencias recientes por endpoint para calcular el retraso de las peticiones duplicadas"""
+    
+    def __init__(self, ventana=200):
+        self.ventana = ventana
+        self._muestras = {}
+        self._p95 = {}
+        self._lock = threading.Lock()
+    
+    def registrar(self, endpoint, segundos):
+        with self._lock:
+            muestras = self._muestras.get(endpoint)
+            if muestras is None:
+                muestras = self._muestras[endpoint] = deque(maxlen=self.ventana)
+            muestras.append(segundos)
+            # Recalcular el percentil cada 10 muestras basta y evita ordenar en cada llamada
+            if len(muestras) >= HEDGE_MIN_MUESTRAS and len(muestras) % 10 == 0:
+                ordenadas = sorted(muestras)
+                self._p95[endpoint] = ordenadas[int(len(ordenadas) * 0.95) - 1]
+    
+    def p95(self, endpoint):
+        return self._p95.get(endpoint)
+    
+    def resumen(self):
+        with self._lock:
+            return {endpoint: round(p95 * 1000, 1) for endpoint, p95 in self._p95.items()}
+
+class CircuitosNcbi:
+    """Un InterruptorCircuito por endpoint, creados al primer uso"""
+    
+    def __init__(self, umbral, espera):
+        self.umbral = umbral
+        self.espera = espera
+        self._circuitos = {}
+        self._lock = threading.Lock()
+    
+    def __call__(self, endpoint):
+        circuito = self._circuitos.get(endpoint)
+        if circuito is None:
+            with self._lock:
+                circuito = self._circuitos.setdefault(endpoint, InterruptorCircuito(endpoint, self.umbral, self.espera))
+        return circuito
+    
+    def resumen(self):
+        with self._lock:
+            return {endpoint: {"estado": c.estado, "fallos_seguidos": c.fallos} for endpoint, c in self._circuitos.items()}
+
+class CupoHedges:
+    """Cada petición a un endpoint con hedging suma `fraccion` al saldo y cada duplicada gasta uno: las
+    duplicadas no pasan de esa fracción de las peticiones y la ráfaga queda acotada"""
+    
+    def __init__(self, fraccion, rafaga=2):
+        self.fraccion = fraccion
+        self.rafaga = rafaga
+        self._saldo = 0.0
+        self._lock = threading.Lock()
+    
+    def contar(self):
+        with self._lock:
+            self._saldo = min(self.rafaga, self._saldo + self.fraccion)
+    
+    def tomar(self):
+        with self._lock:
+            if self._saldo < 1:
+                return False
+            self._saldo -= 1
+            return True
+
+class PeticionHedge:
+    """Conexión que usa una de las copias de una petición con hedging, para cortarla si pierde"""
+    
+    __slots__ = ("conexion", "cancelada", "_lock")
+    
+    def __init__(self):
+        self.conexion = None
+        self.cancelada = False
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _cortar(conexion):
+        # Cerrar el socket despierta al hilo bloqueado leyendo la respuesta
+        sock = getattr(conexion, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def usar(self, conexion):
+        with self._lock:
+            self.conexion = conexion
+            if self.cancelada:
+                self._cortar(conexion)
+    
+    def soltar(self, conexion):
+        with self._lock:
+            if self.conexion is conexion:
+                self.conexion = None
+    
+    def cancelar(self):
+        # Con el lock: la conexión no vuelve al pool (ni la coge otra petición) mientras se corta
+        with self._lock:
+            self.cancelada = True
+            if self.conexion is not None:
+                self._cortar(self.conexion)
+
+# La fija cada copia de una petición con hedging en su propio contexto; el pool de conexiones la consulta
+peticion_hedge = contextvars.ContextVar("peticion_hedge", default=None)
+
+def peticion_cancelada():
+    peticion = peticion_hedge.get()
+    return peticion is not None and peticion.cancelada
+
+circuito_ncbi = CircuitosNcbi(CIRCUITO_FALLOS, CIRCUITO_ESPERA)
+latencias_ncbi = LatenciasNcbi()
+cupo_hedges = CupoHedges(HEDGE_MAX_FRACCION)
+
+def retraso_hedge(endpoint):
+    """Segundos tras los que lanzar una petición duplicada; None si no procede (endpoint, pocas muestras o sin tiempo)"""
+    if endpoint not in HEDGE_ENDPOINTS:
+        return None
+    p95 = latencias_ncbi.p95(endpoint)
+    if p95 is None:
+        return None
+    retraso = max(p95, HEDGE_MIN_MS / 1000)
+    restante = tiempo_restante()
+    if restante is not None and restante <= retraso:
+        return None
+    return retraso
+
+def descartar_respuesta(futuro):
+    """Cierra la respuesta de la copia perdedora (con stream=True retiene la conexión hasta cerrarla)"""
+    if futuro.cancelled() or futuro.exception() is not None:
+        return
+    if isinstance(futuro, asyncio.Future):
+        asyncio.ensure_future(futuro.result().aclose())
+    else:
+        futuro.result().close()
+
+def permitir_hedge(endpoint):
+    """Al ir a duplicar: queda tiempo, el limitador no está en déficit (si no, la duplicada solo haría cola
+    y alargaría el p95) y hay cupo"""
+    if retraso_hedge(endpoint) is None or limitador_ncbi.en_deficit():
+        return False
+    return cupo_hedges.tomar()
+
+# =========================
+# CLIENTE HTTP E-UTILITIES
+# =========================
+
+class _ContadorConexiones:
+    """Contadores de conexiones nuevas y reutilizadas compartidos por los pools"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.valores = {"peticiones": 0, "conexiones_nuevas": 0, "conexiones_reutilizadas": 0, "errores": 0}
+    
+    def sumar(self, clave, cantidad=1):
+        with self.lock:
+            self.valores[clave] += cantidad
+
+contador_conexiones = _ContadorConexiones()
+
+class _PoolContadorMixin:
+    """Cuenta si cada conexión entregada por el pool ya estaba abierta o hay que abrirla"""
+    
+    def _get_conn(self, timeout=None):
+        conexion = super()._get_conn(timeout=timeout)
+        if getattr(conexion, "sock", None) is None:
+            contador_conexiones.sumar("conexiones_nuevas")
+        else:
+            contador_conexiones.sumar("conexiones_reutilizadas")
+        peticion = peticion_hedge.get()
+        if peticion is not None:
+            peticion.usar(conexion)
+        return conexion
+    
+    def _put_conn(self, conn):
+        peticion = peticion_hedge.get()
+        if peticion is not None:
+            peticion.soltar(conn)
+        super()._put_conn(conn)
+
+class _PoolHTTPContador(_PoolContadorMixin, HTTPConnectionPool):
+    pass
+
+class _PoolHTTPSContador(_PoolContadorMixin, HTTPSConnectionPool):
+    pass
+
+class _AdaptadorContador(HTTPAdapter):
+    """HTTPAdapter cuyos pools registran la reutilización de conexiones"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _PoolHTTPContador, "https": _PoolHTTPSContador}
+
+class LimitadorTasa:
+    """Token bucket guardado en un archivo con flock para que lo compartan todos los procesos"""
+    
+    _ESTADO = struct.Struct("<dd")  # tokens disponibles, último instante de recarga
+    
+    def __init__(self, ruta, tasa, capacidad):
+        self.ruta = ruta
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.estadisticas = {"permisos": 0, "esperas": 0, "segundos_esperados": 0.0}
+    
+    def _descriptor(self):
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o666)
+            self._pid = os.getpid()
+        return self._fd
+    
+    def reservar(self, max_espera=None):
+        """Consume un token y devuelve cuántos segundos hay que esperar antes de usarlo
+        None (sin consumir el token) si habría que esperar más de max_espera"""
+        with self._lock:
+            fd = self._descriptor()
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                ahora = time.time()
+                datos = os.pread(fd, self._ESTADO.size, 0)
+                if len(datos) == self._ESTADO.size:
+                    tokens, ultimo = self._ESTADO.unpack(datos)
+                    tokens = min(self.capacidad, tokens + max(0.0, ahora - ultimo) * self.tasa)
+                else:
+                    tokens = self.capacidad
+                
+                # Los tokens pueden quedar en negativo: cada proceso espera su turno en la cola
+                tokens -= 1
+                espera = -tokens / self.tasa if tokens < 0 else 0.0
+                if max_espera is not None and espera > max_espera:
+                    return None
+                os.pwrite(fd, self._ESTADO.pack(tokens, ahora), 0)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            
+            self.estadisticas["permisos"] += 1
+            if espera > 0:
+                self.estadisticas["esperas"] += 1
+                self.estadisticas["segundos_esperados"] += espera
+            return espera
+    
+    def en_deficit(self):
+        """True si no queda un token libre: una petición más tendría que esperar"""
+        with self._lock:
+            fd = self._descriptor()
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                datos = os.pread(fd, self._ESTADO.size, 0)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        if len(datos) != self._ESTADO.size:
+            return False
+        tokens, ultimo = self._ESTADO.unpack(datos)
+        return tokens + max(0.0, time.time() - ultimo) * self.tasa < 1
+    
+    def adquirir(self, max_espera=None):
+        """Bloquea solo si no queda presupuesto en el bucket; False (sin esperar) si habría que esperar más de max_espera"""
+        espera = self.reservar(max_espera)
+        if espera is None:
+            return False
+        if espera > 0:
+            time.sleep(espera)
+        return True
+    
+    def resumen(self):
+        with self._lock:
+            return {
+                **self.estadisticas,
+                "segundos_esperados": round(self.estadisticas["segundos_esperados"], 3),
+                "tasa_max": self.tasa
+            }
+
+limitador_ncbi = LimitadorTasa(NCBI_LIMITADOR_ARCHIVO, NCBI_TASA_MAX, NCBI_RAFAGA_MAX)
+
+class ClienteEutils:
+    """Cliente único para las E-utilities con conexiones keep-alive, gzip y reintentos"""
+    
+    def __init__(self, base_url, pool_maxsize, reintentos, backoff, timeout_conexion):
+        self.base_url = base_url
+        self.pool_maxsize = pool_maxsize
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.timeout_conexion = timeout_conexion
+        self._sesion = None
+        self._pid = None
+        self._pool = None
+        self._pid_pool = None
+        self._lock = threading.Lock()
+    
+    def _crear_sesion(self):
+        # Sin reintentos de urllib3: se hacen a mano para que cada intento pase por el limitador
+        adaptador = _AdaptadorContador(pool_connections=4, pool_maxsize=self.pool_maxsize, max_retries=0)
+        sesion = requests.Session()
+        sesion.mount("https://", adaptador)
+        sesion.mount("http://", adaptador)
+        sesion.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        return sesion
+    
+    def sesion(self):
+        """Sesión del proceso actual (se recrea tras un fork para no compartir sockets)"""
+        if self._sesion is None or self._pid != os.getpid():
+            with self._lock:
+                if self._sesion is None or self._pid != os.getpid():
+                    self._sesion = self._crear_sesion()
+                    self._pid = os.getpid()
+        return self._sesion
+    
+    def _solicitar(self, metodo, endpoint, timeout, **kwargs):
+        if endpoint in HEDGE_ENDPOINTS:
+            cupo_hedges.contar()
+        retraso = retraso_hedge(endpoint)
+        if retraso is not None:
+            return self._solicitar_con_hedge(retraso, metodo, endpoint, timeout, **kwargs)
+        return self._solicitar_una(metodo, endpoint, timeout, **kwargs)
+    
+    def _pool_hedge(self):
+        """Hilos del proceso actual para las peticiones con hedging (se recrean tras un fork)"""
+        if self._pool is None or self._pid_pool != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid_pool != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.pool_maxsize * 2, thread_name_prefix="eutils-hedge")
+                    self._pid_pool = os.getpid()
+        return self._pool
+    
+    def _copia_hedge(self, peticion, metodo, endpoint, timeout, **kwargs):
+        # Corre en su propia copia del contexto: hereda el plazo y su conexión se puede cortar
+        peticion_hedge.set(peticion)
+        return self._solicitar_una(metodo, endpoint, timeout, **kwargs)
+    
+    def _solicitar_con_hedge(self, retraso, metodo, endpoint, timeout, **kwargs):
+        """Si la petición tarda más que el p95 del endpoint, lanza otra idéntica, se queda con la primera
+        que llegue y corta la conexión de la otra"""
+        pool = self._pool_hedge()
+        nombre = endpoint.split(".", 1)[0]
+        copias = {}
+        
+        def lanzar():
+            peticion = PeticionHedge()
+            futuro = pool.submit(contextvars.copy_context().run, self._copia_hedge, peticion, metodo, endpoint, timeout, **kwargs)
+            copias[futuro] = peticion
+            return futuro
+        
+        principal = ganador = lanzar()
+        try:
+            try:
+                return principal.result(timeout=retraso)
+            except FuturoTimeout:
+                pass
+            
+            if not permitir_hedge(endpoint):
+                metrica_hedges.labels(endpoint=nombre, resultado="omitido").inc()
+                return principal.result()
+            duplicada = lanzar()
+            pendientes = {principal, duplicada}
+            error = None
+            while pendientes:
+                hechos, pendientes = esperar_futuros(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    if futuro.exception() is None:
+                        metrica_hedges.labels(endpoint=nombre, resultado="gana" if futuro is duplicada else "pierde").inc()
+                        ganador = futuro
+                        return futuro.result()
+                    error = error or futuro.exception()
+            metrica_hedges.labels(endpoint=nombre, resultado="error").inc()
+            raise error
+        finally:
+            for futuro, peticion in copias.items():
+                if futuro is not ganador:
+                    if not futuro.done():
+                        peticion.cancelar()
+                    futuro.add_done_callback(descartar_respuesta)
+    
+    def _solicitar_una(self, metodo, endpoint, timeout, **kwargs):
+        """Una petición con sus reintentos, protegida por el circuit breaker del endpoint"""
+        circuito = circuito_ncbi(endpoint)
+        circuito.permitir()
+        try:
+            response = self._solicitar_con_reintentos(metodo, endpoint, timeout, **kwargs)
+        except PlazoAgotado:
+            circuito.liberar()
+            raise
+        except Exception:
+            if peticion_cancelada():
+                circuito.liberar()
+            else:
+                circuito.registrar(False)
+            raise
+        circuito.registrar(response.status_code not in ESTADOS_REINTENTO_NCBI)
+        return response
+    
+    def _solicitar_con_reintentos(self, metodo, endpoint, timeout, **kwargs):
+        """Petición con los reintentos hechos aquí: cada intento toma un token del limitador, ni las
+        esperas ni los reintentos pasan del plazo de la petición y no se reintenta una copia cortada por hedging"""
+        intento = 0
+        while True:
+            if peticion_cancelada():
+                raise requests.ConnectionError("Petición duplicada cancelada")
+            contador_conexiones.sumar("peticiones")
+            if not limitador_ncbi.adquirir(max_espera=tiempo_restante()):
+                raise agotar_plazo()
+            timeout_intento = limitar_timeout(timeout)
+            inicio = time.perf_counter()
+            try:
+                response = self.sesion().request(
+                    metodo,
+                    f"{self.base_url}/{endpoint}",
+                    timeout=(min(self.timeout_conexion, timeout_intento), timeout_intento),
+                    **kwargs
+                )
+            except requests.RequestException:
+                if peticion_cancelada():
+                    raise
+                contador_conexiones.sumar("errores")
+                registrar_llamada_ncbi(endpoint, inicio)
+                if plazo_vencido():
+                    raise agotar_plazo()
+                if intento >= self.reintentos:
+                    raise
+                pausa = self.backoff * (2 ** intento)
+            else:
+                registrar_llamada_ncbi(endpoint, inicio, response.status_code)
+                if response.status_code == 200:
+                    latencias_ncbi.registrar(endpoint, time.perf_counter() - inicio)
+                if response.status_code not in ESTADOS_REINTENTO_NCBI or intento >= self.reintentos:
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                pausa = float(retry_after) if retry_after.isdigit() else self.backoff * (2 ** intento)
+                response.close()
+            intento += 1
+            restante = tiempo_restante()
+            if restante is not None and pausa >= restante:
+                raise agotar_plazo()
+            time.sleep(pausa)
+    
+    def get(self, endpoint, params, timeout):
+        """GET a un endpoint de E-utilities (p.ej. 'esearch.fcgi')"""
+        return self._solicitar("GET", endpoint, timeout, params=params)
+    
+    def post(self, endpoint, data, timeout, stream=False):
+        """POST a un endpoint de E-utilities, útil para listas largas de IDs; con stream=True el cuerpo
+        se lee después y hay que cerrar la respuesta"""
+        return self._solicitar("POST", endpoint, timeout, data=data, stream=stream)
+    
+    def resumen(self):
+        """Estadísticas de conexiones para verificar la reutilización"""
+        with contador_conexiones.lock:
+            return {**contador_conexiones.valores, "pool_maxsize": self.pool_maxsize}
+
+cliente_eutils = ClienteEutils(
+    EUTILS_BASE_URL,
+    EUTILS_POOL_MAXSIZE,
+    EUTILS_REINTENTOS,
+    EUTILS_BACKOFF,
+    EUTILS_TIMEOUT_CONEXION
+)
+
+# =========================
+# CACHÉ DE ARTÍCULOS
+# =========================
+
+class CacheArticulos:
+    """Caché de metadatos de artículos por PMID con dos niveles (LRU en memoria y SQLite en disco)"""
+    
+    def __init__(self, ruta_db, max_memoria, ttl, max_bytes):
+        self.ruta_db = ruta_db
+        self.max_memoria = max_memoria
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._escrituras = 0
+        self.estadisticas = {"hits_memoria": 0, "hits_disco": 0, "fallos": 0, "evicciones_disco": 0}
+    
+    def _conexion(self):
+        """Devuelve una conexión SQLite propia del hilo y del proceso actual"""
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(self.ruta_db, timeout=5)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS articulos ("
+                "pmid TEXT PRIMARY KEY, datos TEXT NOT NULL, tamano INTEGER NOT NULL, "
+                "creado REAL NOT NULL, accedido REAL NOT NULL)"
+            )
+            conexion.execute("CREATE INDEX IF NOT EXISTS idx_articulos_accedido ON articulos (accedido)")
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+    
+    def _guardar_en_memoria(self, pmid, info):
+        with self._lock:
+            self._memoria[pmid] = info
+            self._memoria.move_to_end(pmid)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+    
+    def obtener_muchos(self, pmids):
+        """Devuelve {pmid: metadatos} para los PMIDs presentes en alguno de los niveles"""
+        encontrados = {}
+        pendientes = []
+        
+        with self._lock:
+            for pmid in pmids:
+                info = self._memoria.get(pmid)
+                if info is not None:
+                    self._memoria.move_to_end(pmid)
+                    encontrados[pmid] = info
+                    self.estadisticas["hits_memoria"] += 1
+                else:
+                    pendientes.append(pmid)
+        
+        if pendientes:
+            try:
+                ahora = time.time()
+                conexion = self._conexion()
+                marcas = ",".join("?" * len(pendientes))
+                filas = conexion.execute(
+                    f"SELECT pmid, datos FROM articulos WHERE pmid IN ({marcas}) AND creado >= ?",
+                    pendientes + [ahora - self.ttl]
+                ).fetchall()
+                if filas:
+                    with conexion:
+                        conexion.execute(
+                            f"UPDATE articulos SET accedido = ? WHERE pmid IN ({marcas})",
+                            [ahora] + [pmid for pmid, _ in filas]
+                        )
+                for pmid, datos in filas:
+                    info = json.loads(datos)
+                    encontrados[pmid] = info
+                    self._guardar_en_memoria(pmid, info)
+                with self._lock:
+                    self.estadisticas["hits_disco"] += len(filas)
+            except sqlite3.Error as e:
+                print(f"Error leyendo caché de artículos: {e}")
+        
+        with self._lock:
+            self.estadisticas["fallos"] += len(pmids) - len(encontrados)
+        return encontrados
+    
+    def obtener_obsoletos(self, pmids, gracia):
+        """Artículos caducados hace menos de `gracia` segundos, para servirlos si efetch falla"""
+        if not pmids:
+            return {}
+        try:
+            marcas = ",".join("?" * len(pmids))
+            filas = self._conexion().execute(
+                f"SELECT pmid, datos FROM articulos WHERE pmid IN ({marcas}) AND creado >= ?",
+                list(pmids) + [time.time() - self.ttl - gracia]
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Error leyendo caché de artículos: {e}")
+            return {}
+        return {pmid: json.loads(datos) for pmid, datos in filas}
+    
+    def precargar(self, limite):
+        """Carga en memoria los artículos usados más recientemente (se llama antes del fork)"""
+        if limite <= 0 or not os.path.exists(self.ruta_db):
+            return 0
+        try:
+            # Conexión de un solo uso: no debe quedar abierta en el proceso que luego hace fork
+            conexion = sqlite3.connect(self.ruta_db, timeout=5)
+            try:
+                filas = conexion.execute(
+                    "SELECT pmid, datos FROM articulos WHERE creado >= ? ORDER BY accedido DESC LIMIT ?",
+                    (time.time() - self.ttl, limite)
+                ).fetchall()
+            finally:
+                conexion.close()
+        except sqlite3.Error as e:
+            print(f"Error precargando caché de artículos: {e}")
+            return 0
+        
+        # Del menos al más reciente para que el LRU conserve el orden de uso
+        for pmid, datos in reversed(filas):
+            self._guardar_en_memoria(pmid, json.loads(datos))
+        return len(filas)
+    
+    def guardar_muchos(self, metadatos):
+        """Guarda {pmid: metadatos} en ambos niveles"""
+        if not metadatos:
+            return
+        
+        for pmid, info in metadatos.items():
+            self._guardar_en_memoria(pmid, info)
+        
+        try:
+            ahora = time.time()
+            filas = []
+            for pmid, info in metadatos.items():
+                datos = json.dumps(info, ensure_ascii=False)
+                filas.append((pmid, datos, len(datos), ahora, ahora))
+            conexion = self._conexion()
+            with conexion:
+                conexion.executemany("INSERT OR REPLACE INTO articulos VALUES (?, ?, ?, ?, ?)", filas)
+            
+            self._escrituras += 1
+            if self._escrituras % 20 == 1:
+                self.purgar()
+        except sqlite3.Error as e:
+            print(f"Error escribiendo caché de artículos: {e}")
+    
+    def purgar(self):
+        """Elimina entradas expiradas y las menos usadas si se supera el tamaño máximo"""
+        conexion = self._conexion()
+        with conexion:
+            # Los caducados se conservan durante la gracia para servirlos si NCBI falla
+            borradas = conexion.execute(
+                "DELETE FROM articulos WHERE creado < ?", (time.time() - self.ttl - CACHE_GRACIA_OBSOLETOS,)
+            ).rowcount
+            total = conexion.execute("SELECT COALESCE(SUM(tamano), 0) FROM articulos").fetchone()[0]
+            if total > self.max_bytes:
+                # Liberar hasta quedar en el 90% del límite, empezando por las menos accedidas
+                exceso = total - int(self.max_bytes * 0.9)
+                liberado = 0
+                victimas = []
+                for pmid, tamano in conexion.execute("SELECT pmid, tamano FROM articulos ORDER BY accedido"):
+                    if liberado >= exceso:
+                        break
+                    victimas.append((pmid,))
+                    liberado += tamano
+                conexion.executemany("DELETE FROM articulos WHERE pmid = ?", victimas)
+                borradas += len(victimas)
+        self.estadisticas["evicciones_disco"] += borradas
+    
+    def resumen(self):
+        """Estadísticas de uso para dimensionar la caché"""
+        consultas = self.estadisticas["hits_memoria"] + self.estadisticas["hits_disco"] + self.estadisticas["fallos"]
+        aciertos = self.estadisticas["hits_memoria"] + self.estadisticas["hits_disco"]
+        with self._lock:
+            en_memoria = len(self._memoria)
+        return {
+            **self.estadisticas,
+            "entradas_memoria": en_memoria,
+            "tasa_aciertos": round(aciertos / consultas, 4) if consultas else 0.0
+        }
+
+cache_articulos = CacheArticulos(
+    CACHE_ARTICULOS_DB,
+    CACHE_ARTICULOS_MEMORIA,
+    CACHE_ARTICULOS_TTL,
+    int(CACHE_ARTICULOS_MAX_MB * 1024 * 1024)
+)
+
+# =========================
+# CACHÉ DE BÚSQUEDAS
+# =========================
+
+class CacheBusquedas:
+    """Caché con TTL que coalesce las consultas concurrentes a una misma clave (single-flight)"""
+    
+    def __init__(self, max_entradas, ttl):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._en_vuelo = {}
+        self._lock = threading.Lock()
+        self.estadisticas = {"hits": 0, "fallos": 0, "coalescidas": 0}
+    
+    def _buscar(self, clave):
+        """Con el lock: (valor cacheado, None, False) si hay hit; si no (None, vuelo, si somos el líder)"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] > time.time():
+                self._entradas.move_to_end(clave)
+                self.estadisticas["hits"] += 1
+                return entrada[1], None, False
+            
+            vuelo = self._en_vuelo.get(clave)
+            if vuelo is None:
+                vuelo = {"evento": threading.Event(), "valor": None, "error": None}
+                self._en_vuelo[clave] = vuelo
+                self.estadisticas["fallos"] += 1
+                return None, vuelo, True
+            self.estadisticas["coalescidas"] += 1
+            return None, vuelo, False
+    
+    @staticmethod
+    def _resultado_vuelo(vuelo, terminado):
+        """Valor del vuelo al que nos unimos; None si hay que reintentar porque al líder se le agotó su plazo"""
+        if not terminado:
+            # Nuestro propio plazo vence antes de que termine el líder
+            raise agotar_plazo()
+        if isinstance(vuelo["error"], PlazoAgotado):
+            # El plazo agotado era el del líder, no el nuestro
+            return None
+        if vuelo["error"] is not None:
+            raise vuelo["error"]
+        return vuelo
+    
+    def obtener(self, clave, calcular):
+        """Devuelve el valor cacheado o lo calcula una sola vez aunque haya peticiones concurrentes"""
+        while True:
+            valor, vuelo, lider = self._buscar(clave)
+            if vuelo is None:
+                return valor
+            if lider:
+                break
+            # Esperar el resultado de la petición que ya está en curso, sin pasar del plazo propio
+            if plazo_vencido():
+                raise agotar_plazo()
+            terminado = self._resultado_vuelo(vuelo, vuelo["evento"].wait(tiempo_restante()))
+            if terminado is not None:
+                return terminado["valor"]
+        
+        try:
+            valor = calcular()
+            vuelo["valor"] = valor
+            with self._lock:
+                self._entradas[clave] = (time.time() + self.ttl, valor)
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+            return valor
+        except Exception as e:
+            vuelo["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+            vuelo["evento"].set()
+    
+    async def obtener_async(self, clave, calcular_async):
+        """Como obtener() pero para corrutinas; comparte la coalescencia con las llamadas síncronas"""
+        while True:
+            valor, vuelo, lider = self._buscar(clave)
+            if vuelo is None:
+                return valor
+            if lider:
+                break
+            if plazo_vencido():
+                raise agotar_plazo()
+            terminado = self._resultado_vuelo(vuelo, await asyncio.to_thread(vuelo["evento"].wait, tiempo_restante()))
+            if terminado is not None:
+                return terminado["valor"]
+        
+        try:
+            valor = await calcular_async()
+            vuelo["valor"] = valor
+            with self._lock:
+                self._entradas[clave] = (time.time() + self.ttl, valor)
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+            return valor
+        except Exception as e:
+            vuelo["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+            vuelo["evento"].set()
+    
+    def obtener_obsoleto(self, clave, gracia):
+        """Valor caducado hace menos de `gracia` segundos, para servirlo si NCBI falla; None si no hay"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+        if entrada is not None and entrada[0] + gracia > time.time():
+            return entrada[1]
+        return None
+    
+    def resumen(self):
+        """Estadísticas de uso"""
+        with self._lock:
+            return {**self.estadisticas, "entradas": len(self._entradas)}
+
+cache_busquedas = CacheBusquedas(CACHE_BUSQUEDAS_MAX, CACHE_BUSQUEDAS_TTL)
+
+# =========================
+# CACHÉ DE RESPUESTAS
+# =========================
+
+class CacheRespuestas:
+    """Cuerpos JSON ya serializados por clave de contenido, con LRU en memoria y SQLite compartido entre workers"""
+    
+    def __init__(self, ruta_db, max_memoria, ttl, max_bytes):
+        self.ruta_db = ruta_db
+        self.max_memoria = max_memoria
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._escrituras = 0
+        self.estadisticas = {"hits_memoria": 0, "hits_disco": 0, "fallos": 0, "evicciones_disco": 0}
+    
+    @property
+    def activa(self):
+        return self.ttl > 0
+    
+    def _conexion(self):
+        """Devuelve una conexión SQLite propia del hilo y del proceso actual"""
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(self.ruta_db, timeout=5)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS respuestas ("
+                "clave TEXT PRIMARY KEY, cuerpo BLOB NOT NULL, etag TEXT NOT NULL, tamano INTEGER NOT NULL, "
+                "creado REAL NOT NULL, accedido REAL NOT NULL)"
+            )
+            conexion.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_accedido ON respuestas (accedido)")
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+    
+    def _guardar_en_memoria(self, clave, entrada):
+        with self._lock:
+            self._memoria[clave] = entrada
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+    
+    def obtener(self, clave):
+        """Devuelve (cuerpo, etag) o None si no está o ha expirado"""
+        if not self.activa:
+            return None
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None and entrada[0] >= ahora - self.ttl:
+                self._memoria.move_to_end(clave)
+                self.estadisticas["hits_memoria"] += 1
+                return entrada[1], entrada[2]
+        
+        try:
+            conexion = self._conexion()
+            fila = conexion.execute(
+                "SELECT creado, cuerpo, etag FROM respuestas WHERE clave = ? AND creado >= ?", (clave, ahora - self.ttl)
+            ).fetchone()
+            if fila is not None:
+                with conexion:
+                    conexion.execute("UPDATE respuestas SET accedido = ? WHERE clave = ?", (ahora, clave))
+                self._guardar_en_memoria(clave, fila)
+                with self._lock:
+                    self.estadisticas["hits_disco"] += 1
+                return fila[1], fila[2]
+        except sqlite3.Error as e:
+            print(f"Error leyendo caché de respuestas: {e}")
+        
+        with self._lock:
+            self.estadisticas["fallos"] += 1
+        return None
+    
+    def obtener_obsoleta(self, clave, gracia):
+        """(cuerpo, etag) caducado hace menos de `gracia` segundos, para servirlo si NCBI falla; None si no hay"""
+        if not self.activa:
+            return None
+        limite = time.time() - self.ttl - gracia
+        with self._lock:
+            entrada = self._memoria.get(clave)
+        if entrada is not None and entrada[0] >= limite:
+            return entrada[1], entrada[2]
+        try:
+            fila = self._conexion().execute(
+                "SELECT cuerpo, etag FROM respuestas WHERE clave = ? AND creado >= ?", (clave, limite)
+            ).fetchone()
+            return tuple(fila) if fila is not None else None
+        except sqlite3.Error as e:
+            print(f"Error leyendo caché de respuestas: {e}")
+            return None
+    
+    def guardar(self, clave, cuerpo):
+        """Guarda el cuerpo en ambos niveles y devuelve su ETag (hash del contenido)"""
+        etag = hashlib.sha256(cuerpo).hexdigest()[:32]
+        if not self.activa:
+            return etag
+        
+        ahora = time.time()
+        self._guardar_en_memoria(clave, (ahora, cuerpo, etag))
+        try:
+            conexion = self._conexion()
+            with conexion:
+                conexion.execute(
+                    "INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?, ?, ?)",
+                    (clave, cuerpo, etag, len(cuerpo), ahora, ahora)
+                )
+            
+            self._escrituras += 1
+            if self._escrituras % 20 == 1:
+                self.purgar()
+        except sqlite3.Error as e:
+            print(f"Error escribiendo caché de respuestas: {e}")
+        return etag
+    
+    def purgar(self):
+        """Elimina entradas expiradas y las menos usadas si se supera el tamaño máximo"""
+        conexion = self._conexion()
+        with conexion:
+            borradas = conexion.execute(
+                "DELETE FROM respuestas WHERE creado < ?", (time.time() - self.ttl - CACHE_GRACIA_OBSOLETOS,)
+            ).rowcount
+            total = conexion.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+            if total > self.max_bytes:
+                # Liberar hasta quedar en el 90% del límite, empezando por las menos accedidas
+                exceso = total - int(self.max_bytes * 0.9)
+                liberado = 0
+                victimas = []
+                for clave, tamano in conexion.execute("SELECT clave, tamano FROM respuestas ORDER BY accedido"):
+                    if liberado >= exceso:
+                        break
+                    victimas.append((clave,))
+                    liberado += tamano
+                conexion.executemany("DELETE FROM respuestas WHERE clave = ?", victimas)
+                borradas += len(victimas)
+        self.estadisticas["evicciones_disco"] += borradas
+    
+    def resumen(self):
+        """Estadísticas de uso"""
+        with self._lock:
+            consultas = self.estadisticas["hits_memoria"] + self.estadisticas["hits_disco"] + self.estadisticas["fallos"]
+            aciertos = self.estadisticas["hits_memoria"] + self.estadisticas["hits_disco"]
+            return {
+                **self.estadisticas,
+                "entradas_memoria": len(self._memoria),
+                "tasa_aciertos": round(aciertos / consultas, 4) if consultas else 0.0
+            }
+
+cache_respuestas = CacheRespuestas(
+    CACHE_RESPUESTAS_DB,
+    CACHE_RESPUESTAS_MEMORIA,
+    CACHE_RESPUESTAS_TTL,
+    int(CACHE_RESPUESTAS_MAX_MB * 1024 * 1024)
+)
+
+def normalizar_entrada(texto):
+    """Misma clave para textos que solo difieren en la forma Unicode o en los espacios"""
+    return " ".join(unicodedata.normalize("NFC", texto).split())
+
+def clave_respuesta(endpoint, entrada, max_results):
+    """Hash de la entrada normalizada, los parámetros y la versión y configuración del pipeline"""
+    material = json.dumps(
+        [VERSION_PIPELINE, endpoint, normalizar_entrada(entrada), max_results, CRIBADO_DOS_FASES, PUBMED_ESPEJO_FALLBACK_API],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+# =========================
+# ÍNDICE MESH LOCAL
+# =========================
+
+# El formato del archivo y su lector (IndiceMesh) están en formatos_ncbi, compartidos con construir_indice_mesh.py
+
+def cargar_indice_mesh(ruta):
+    """Carga el índice MeSH local si existe"""
+    if not ruta or not os.path.exists(ruta):
+        return None
+    try:
+        indice = IndiceMesh(ruta)
+        print(f"Índice MeSH local cargado: {indice.n_descriptores} descriptores")
+        return indice
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Error cargando índice MeSH local: {e}")
+        return None
+
+indice_mesh = cargar_indice_mesh(MESH_INDICE)
+
+# =========================
+# ESPEJO LOCAL DE PUBMED
+# =========================
+
+# El esquema (ESQUEMA_ESPEJO_PUBMED) y el parser de registros están en formatos_ncbi
+
+# Etiquetas de campo de PubMed que el espejo sabe traducir a columnas FTS5
+CAMPOS_ESPEJO = {
+    "mesh terms": "mesh",
+    "mh": "mesh",
+    "title": "titulo",
+    "ti": "titulo",
+    "abstract": "abstract",
+    "ab": "abstract",
+    "title/abstract": "{titulo abstract}",
+    "tiab": "{titulo abstract}",
+    "ptyp": "tipos",
+    "pt": "tipos",
+    "lang": "idiomas",
+    "la": "idiomas"
+}
+
+# Los idiomas se guardan con el código de MEDLINE (eng, spa, fre, ger...)
+IDIOMAS_MEDLINE = {"english": "eng", "spanish": "spa", "french": "fre", "german": "ger", "portuguese": "por", "italian": "ita"}
+
+# Pesos bm25 por columna: titulo, abstract, mesh, tipos, idiomas
+PESOS_BM25_ESPEJO = (10.0, 1.0, 5.0, 0.0, 0.0)
+
+REGEX_RANGO_PDAT = re.compile(
+    r'\s+AND\s+\(\s*"(\d{4})(?:/\d{1,2}){0,2}"\[PDAT\]\s*:\s*"(\d{4})(?:/\d{1,2}){0,2}"\[PDAT\]\s*\)',
+    re.IGNORECASE
+)
+REGEX_TERMINO_PUBMED = re.compile(
+    r'"([^"]*)"\[([^\]]+)\]'
+    r'|\b((?:(?!(?:AND|OR|NOT)\b)[A-Za-z][\w\-]*)(?: (?!(?:AND|OR|NOT)\b)[A-Za-z][\w\-]*)*)\[([^\]]+)\]'
+)
+
+def traducir_query_espejo(query):
+    """Traduce una query de PubMed (la sintaxis que genera construir_query_avanzada) a una consulta
+    FTS5 más un rango de años; None si contiene algo que el espejo no puede reproducir"""
+    anios = None
+    rango = REGEX_RANGO_PDAT.search(query)
+    if rango:
+        anios = (int(rango.group(1)), int(rango.group(2)))
+        query = query[:rango.start()] + query[rango.end():]
+    
+    desconocidos = []
+    
+    def traducir(coincidencia):
+        termino = coincidencia.group(1) if coincidencia.group(1) is not None else coincidencia.group(3)
+        campo = (coincidencia.group(2) or coincidencia.group(4)).strip().lower()
+        columna = CAMPOS_ESPEJO.get(campo)
+        if columna is None:
+            desconocidos.append(campo)
+            return ""
+        if columna == "mesh":
+            # El espejo guarda descriptores sin subencabezados, con sus ancestros (equivale a la explosión)
+            termino = termino.split("/", 1)[0]
+        elif columna == "idiomas":
+            termino = IDIOMAS_MEDLINE.get(termino.lower(), termino.lower()[:3])
+        return f'{columna} : "{termino.replace(chr(34), "")}"'
+    
+    traducida = REGEX_TERMINO_PUBMED.sub(traducir, query)
+    if desconocidos or "[" in traducida:
+        return None
+    return traducida, anios
+
+class EspejoPubmed:
+    """Consultas de solo lectura al espejo SQLite/FTS5 de PubMed"""
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        conexion = self._conexion()
+        self.n_articulos = conexion.execute("SELECT COUNT(*) FROM articulos").fetchone()[0]
+        self.estadisticas = {"busquedas": 0, "busquedas_vacias": 0, "no_traducibles": 0, "articulos_servidos": 0}
+        self._lock = threading.Lock()
+    
+    def _conexion(self):
+        """Conexión de solo lectura propia del hilo y del proceso actual"""
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(f"file:{self.ruta}?mode=ro", uri=True, timeout=5)
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+    
+    def _contar(self, clave, cantidad=1):
+        with self._lock:
+            self.estadisticas[clave] += cantidad
+    
+    def buscar(self, query, sort_order, retmax):
+        """PMIDs que cumplen la query de PubMed; None si no se puede traducir o falla la consulta"""
+        traduccion = traducir_query_espejo(query)
+        if traduccion is None:
+            self._contar("no_traducibles")
+            return None
+        consulta_fts, anios = traduccion
+        
+        sql = "SELECT a.pmid FROM articulos_fts JOIN articulos a ON a.pmid = articulos_fts.rowid WHERE articulos_fts MATCH ?"
+        parametros = [consulta_fts]
+        if anios:
+            sql += " AND a.anio BETWEEN ? AND ?"
+            parametros.extend(anios)
+        if sort_order == "pub_date":
+            sql += " ORDER BY a.anio DESC, a.pmid DESC"
+        else:
+            sql += f" ORDER BY bm25(articulos_fts, {', '.join(str(p) for p in PESOS_BM25_ESPEJO)})"
+        sql += " LIMIT ?"
+        parametros.append(int(retmax))
+        
+        try:
+            pmids = [str(fila[0]) for fila in self._conexion().execute(sql, parametros)]
+        except sqlite3.Error as e:
+            print(f"Error buscando en el espejo de PubMed: {e}")
+            self._contar("no_traducibles")
+            return None
+        
+        self._contar("busquedas")
+        if not pmids:
+            self._contar("busquedas_vacias")
+        return pmids
+    
+    def obtener_muchos(self, pmids):
+        """Metadatos {pmid: info} con la misma forma que obtener_articulos_lote"""
+        ids = [int(pmid) for pmid in pmids if str(pmid).isdigit()]
+        if not ids:
+            return {}
+        
+        metadatos = {}
+        try:
+            marcas = ",".join("?" * len(ids))
+            filas = self._conexion().execute(
+                f"SELECT pmid, titulo, abstract, autores, journal, pubdate, doi FROM articulos WHERE pmid IN ({marcas})",
+                ids
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Error leyendo el espejo de PubMed: {e}")
+            return {}
+        
+        for pmid, titulo, abstract, autores, journal, pubdate, doi in filas:
+            metadatos[str(pmid)] = {
+                "pmid": str(pmid),
+                "title": titulo,
+                "authors": json.loads(autores),
+                "pubdate": pubdate,
+                "journal": journal or "Journal desconocido",
+                "abstract": abstract,
+                "doi": doi
+            }
+        self._contar("articulos_servidos", len(metadatos))
+        return metadatos
+    
+    def resumen(self):
+        with self._lock:
+            return {**self.estadisticas, "articulos": self.n_articulos}
+
+def cargar_espejo_pubmed(ruta):
+    """Abre el espejo local de PubMed si existe"""
+    if not ruta or not os.path.exists(ruta):
+        return None
+    try:
+        espejo = EspejoPubmed(ruta)
+        print(f"Espejo local de PubMed cargado: {espejo.n_articulos} artículos")
+        return espejo
+    except sqlite3.Error as e:
+        print(f"Error cargando el espejo de PubMed: {e}")
+        return None
+
+espejo_pubmed = cargar_espejo_pubmed(PUBMED_ESPEJO)
+
+def buscar_en_espejo(query, sort_order, retmax):
+    """PMIDs del espejo local; None si hay que consultar la API"""
+    if espejo_pubmed is not None:
+        pmids = espejo_pubmed.buscar(query, sort_order, retmax)
+        if pmids or not PUBMED_ESPEJO_FALLBACK_API:
+            return pmids or []
+    elif not PUBMED_ESPEJO_FALLBACK_API:
+        return []
+    return None
+
+# =========================
+# DETECCIÓN DE CONCEPTOS
+# =========================
+
+class AutomataAhoCorasick:
+    """Autómata Aho-Corasick: encuentra todos los patrones presentes en un texto en una sola pasada"""
+    
+    def __init__(self, patrones):
+        self.patrones = list(dict.fromkeys(p for p in patrones if p))
+        self._transiciones = [{}]
+        self._fallo = [0]
+        self._salidas = [()]
+        
+        for indice, patron in enumerate(self.patrones):
+            nodo = 0
+            for caracter in patron:
+                siguiente = self._transiciones[nodo].get(caracter)
+                if siguiente is None:
+                    siguiente = len(self._transiciones)
+                    self._transiciones.append({})
+                    self._fallo.append(0)
+                    self._salidas.append(())
+                    self._transiciones[nodo][caracter] = siguiente
+                nodo = siguiente
+            self._salidas[nodo] = self._salidas[nodo] + (indice,)
+        
+        # Enlaces de fallo por anchura
+        cola = deque(self._transiciones[0].values())
+        while cola:
+            nodo = cola.popleft()
+            for caracter, siguiente in self._transiciones[nodo].items():
+                cola.append(siguiente)
+                fallo = self._fallo[nodo]
+                while fallo and caracter not in self._transiciones[fallo]:
+                    fallo = self._fallo[fallo]
+                destino = self._transiciones[fallo].get(caracter, 0)
+                self._fallo[siguiente] = destino if destino != siguiente else 0
+                self._salidas[siguiente] = self._salidas[siguiente] + self._salidas[self._fallo[siguiente]]
+    
+    def buscar(self, texto):
+        """Índices de los patrones que aparecen en el texto"""
+        transiciones = self._transiciones
+        fallo = self._fallo
+        salidas = self._salidas
+        encontrados = set()
+        nodo = 0
+        for caracter in texto:
+            while nodo and caracter not in transiciones[nodo]:
+                nodo = fallo[nodo]
+            nodo = transiciones[nodo].get(caracter, 0)
+            if salidas[nodo]:
+                encontrados.update(salidas[nodo])
+        return encontrados
+
+class DetectorConceptos:
+    """MESH_DECS_MAPPING compilado una vez para puntuar conceptos con el mismo criterio que el bucle original"""
+    
+    def __init__(self, mapping):
+        self.areas = []
+        patrones_texto = []
+        patrones_palabra = []
+        self._contenedores = {}
+        
+        for area, terminos in mapping.items():
+            keywords = terminos.get('keywords', [])
+            area_keywords = [ak.lower() for ak in [area] + keywords]
+            self.areas.append({
+                "area": area,
+                "terminos": terminos,
+                "keywords": [(k.lower(), k.split()) for k in keywords],
+                "area_keywords": area_keywords
+            })
+            patrones_texto.extend(k.lower() for k in keywords)
+            for k in keywords:
+                patrones_palabra.extend(k.split())
+            patrones_palabra.extend(area_keywords)
+            
+            # Todas las subcadenas de cada término, para resolver "palabra in término" con un dict
+            for ak in area_keywords:
+                for i in range(len(ak)):
+                    for j in range(i + 1, len(ak) + 1):
+                        self._contenedores.setdefault(ak[i:j], set()).add(ak)
+        
+        self._automata_texto = AutomataAhoCorasick(patrones_texto)
+        self._automata_palabra = AutomataAhoCorasick(patrones_palabra)
+    
+    def puntuar(self, texto, palabras_relevantes):
+        """Devuelve {area: score} con los mismos pesos (5 por keyword, 3 por término del área)"""
+        automata_palabra = self._automata_palabra
+        en_texto = {self._automata_texto.patrones[i] for i in self._automata_texto.buscar(texto.lower())}
+        scores = {area["area"]: 0 for area in self.areas}
+        
+        for palabra, repeticiones in Counter(palabras_relevantes).items():
+            en_palabra = {automata_palabra.patrones[i] for i in automata_palabra.buscar(palabra)}
+            contenedores = self._contenedores.get(palabra, ())
+            for area in self.areas:
+                score = 0
+                for keyword, partes in area["keywords"]:
+                    if keyword in en_texto or any(parte in en_palabra for parte in partes):
+                        score += 5
+                for ak in area["area_keywords"]:
+                    if ak in en_palabra or ak in contenedores:
+                        score += 3
+                scores[area["area"]] += score * repeticiones
+        
+        return scores
+
+detector_conceptos = DetectorConceptos(MESH_DECS_MAPPING)
+
+# Tokenización rápida sin NLTK
+REGEX_PALABRAS = re.compile(r'\w+')
+REGEX_FIN_ORACION = re.compile(r'[.!?]+')
+
 def tokenizar_texto(texto):
     """Tokenizar texto con o sin NLTK"""
-    if NLTK_AVAILABLE:
+    nltk_modulos = cargar_nltk()
+    if nltk_modulos:
         try:
-            return word_tokenize(texto, language='spanish')
+            return nltk_modulos["word_tokenize"](texto, language='spanish')
         except:
-            return word_tokenize(texto)
+            return nltk_modulos["word_tokenize"](texto)
     else:
-        texto = re.sub(r'[^\w\s]', ' ', texto)
-        return texto.split()
+        # Equivale a sustituir la puntuación por espacios y hacer split()
+        return REGEX_PALABRAS.findall(texto)
 
+def dividir_oraciones(texto):
+    """Dividir texto en oraciones con o sin NLTK"""
+    nltk_modulos = cargar_nltk()
+    if nltk_modulos:
+        return nltk_modulos["sent_tokenize"](texto, language='spanish')
+    
+    # Tokenización básica de oraciones
+    oraciones = REGEX_FIN_ORACION.split(texto)
+    return [o.strip() for o in oraciones if o.strip()]
+
+@lru_cache(maxsize=1)
 def obtener_stopwords():
-    """Obtener stopwords con o sin NLTK"""
-    if NLTK_AVAILABLE:
+    """Obtener stopwords con o sin NLTK (se calcula una sola vez)"""
+    nltk_modulos = cargar_nltk()
+    if nltk_modulos:
         try:
-            return set(stopwords.words('spanish'))
+            return frozenset(nltk_modulos["stopwords"].words('spanish'))
         except:
             pass
     
-    return {'el', 'la', 'de', 'que', 'y', 'a', 'en', 'un', 'es', 'se', 'no', 'te', 'lo', 'le', 'da', 'su', 'por', 'son', 'con', 'para', 'al', 'del', 'los', 'las', 'una', 'como', 'pero', 'sus', 'han', 'ser', 'está', 'este', 'más', 'todo', 'tiene', 'muy', 'bien', 'puede', 'sin', 'hasta', 'entre', 'hacer', 'sobre', 'también', 'donde', 'cuando', 'después', 'todos', 'aunque', 'antes', 'cual', 'cada', 'mismo', 'otros', 'así', 'desde', 'durante', 'mientras', 'tanto', 'según', 'sino', 'vez', 'tal', 'caso', 'forma', 'parte', 'tipo', 'manera', 'través', 'contra'}
+    return frozenset({'el', 'la', 'de', 'que', 'y', 'a', 'en', 'un', 'es', 'se', 'no', 'te', 'lo', 'le', 'da', 'su', 'por', 'son', 'con', 'para', 'al', 'del', 'los', 'las', 'una', 'como', 'pero', 'sus', 'han', 'ser', 'está', 'este', 'más', 'todo', 'tiene', 'muy', 'bien', 'puede', 'sin', 'hasta', 'entre', 'hacer', 'sobre', 'también', 'donde', 'cuando', 'después', 'todos', 'aunque', 'antes', 'cual', 'cada', 'mismo', 'otros', 'así', 'desde', 'durante', 'mientras', 'tanto', 'según', 'sino', 'vez', 'tal', 'caso', 'forma', 'parte', 'tipo', 'manera', 'través', 'contra'})
 
+@medir_etapa("deteccion_conceptos")
 def detectar_conceptos_mesh_decs(texto):
     """Detecta conceptos relevantes y mapea a términos MeSH/DeCS"""
     try:
@@ -102,20 +1785,10 @@ def detectar_conceptos_mesh_decs(texto):
         decs_terms = []
         keywords = []
         
-        # Buscar coincidencias con las áreas definidas
+        # Buscar coincidencias con las áreas definidas (matcher precompilado, una pasada)
+        scores = detector_conceptos.puntuar(texto, palabras_relevantes)
         for area, terminos in MESH_DECS_MAPPING.items():
-            score = 0
-            for palabra in palabras_relevantes:
-                # Verificar coincidencias con keywords del área
-                for keyword in terminos.get('keywords', []):
-                    if keyword.lower() in texto.lower() or any(k in palabra for k in keyword.split()):
-                        score += 5
-                
-                # Verificar coincidencias directas
-                area_keywords = [area] + terminos.get('keywords', [])
-                for ak in area_keywords:
-                    if ak.lower() in palabra or palabra in ak.lower():
-                        score += 3
+            score = scores[area]
             
             if score > 0:
                 conceptos_encontrados[area] = score
@@ -144,34 +1817,48 @@ def detectar_conceptos_mesh_decs(texto):
             'keywords': ['physical therapy']
         }
 
+def mesh_relacionados_locales(termino):
+    """Términos relacionados según el índice local; None si hay que consultar la API"""
+    if indice_mesh is not None:
+        relacionados = indice_mesh.relacionados(termino)
+        if relacionados is not None or not MESH_FALLBACK_API:
+            return relacionados or []
+    elif not MESH_FALLBACK_API:
+        return []
+    return None
+
 def obtener_mesh_relacionados(termino):
-    """Obtiene términos MeSH relacionados usando la API de MeSH"""
+    """Obtiene términos MeSH relacionados del índice local o, como respaldo, de la API de MeSH"""
+    locales = mesh_relacionados_locales(termino)
+    if locales is not None:
+        return locales
+    
     mesh_relacionados = []
     try:
         # Buscar en la base de datos MeSH
-        url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
         params = {
             "db": "mesh",
             "term": f"{termino}[MH]",
             "retmode": "json",
-            "retmax": 5
+            "retmax": 5,
+            "api_key": PUBMED_API_KEY
         }
         
-        response = requests.get(url, params=params, timeout=10)
+        response = cliente_eutils.get("esearch.fcgi", params, timeout=10)
         if response.status_code == 200:
             data = response.json()
             mesh_ids = data.get("esearchresult", {}).get("idlist", [])
             
             # Obtener detalles de los términos MeSH encontrados
             if mesh_ids:
-                summary_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
                 summary_params = {
                     "db": "mesh",
                     "id": ",".join(mesh_ids),
-                    "retmode": "json"
+                    "retmode": "json",
+                    "api_key": PUBMED_API_KEY
                 }
                 
-                s_response = requests.get(summary_url, params=summary_params, timeout=10)
+                s_response = cliente_eutils.get("esummary.fcgi", summary_params, timeout=10)
                 if s_response.status_code == 200:
                     s_data = s_response.json()
                     for mesh_id in mesh_ids:
@@ -187,296 +1874,645 @@ def obtener_mesh_relacionados(termino):
 
 def buscar_articulos_mesh_avanzado(mesh_terms, keywords, conceptos_texto, max_results=5):
     """Búsqueda avanzada usando todas las capacidades de PubMed y MeSH"""
-    articulos = []
     try:
-        # 1. EXPANDIR TÉRMINOS MESH CON SINÓNIMOS Y RELACIONADOS
-        mesh_expandidos = set(mesh_terms)
+        pmids_unicos, busqueda = buscar_candidatos(mesh_terms, keywords, conceptos_texto, max_results)
         
-        # Obtener términos MeSH relacionados para mayor cobertura
+        # 6. DESCARGA POR LOTES, PROCESAMIENTO Y SCORING DE RELEVANCIA
+        if CRIBADO_DOS_FASES:
+            return seleccionar_articulos_en_dos_fases(pmids_unicos, mesh_terms, keywords, conceptos_texto, max_results, busqueda)
+        metadatos = obtener_articulos_lote(pmids_unicos, busqueda)
+        return seleccionar_articulos(pmids_unicos, metadatos, mesh_terms, keywords, conceptos_texto, max_results)
+        
+    except Exception as e:
+        print(f"Error en buscar_articulos_mesh_avanzado: {e}")
+        return []
+
+def buscar_pmids_candidatos(mesh_terms, keywords, conceptos_texto, max_results):
+    """Expande los términos MeSH, construye la query y devuelve los PMIDs candidatos sin duplicados"""
+    return buscar_candidatos(mesh_terms, keywords, conceptos_texto, max_results)[0]
+
+def buscar_candidatos(mesh_terms, keywords, conceptos_texto, max_results):
+    """Como buscar_pmids_candidatos, pero también devuelve la búsqueda por relevancia (con su WebEnv)"""
+    # 1. EXPANDIR TÉRMINOS MESH CON SINÓNIMOS Y RELACIONADOS
+    mesh_expandidos = set(mesh_terms)
+    
+    # Obtener términos MeSH relacionados para mayor cobertura
+    with medir_etapa("expansion_mesh"):
         for term in mesh_terms[:2]:  # Solo para los términos principales
             relacionados = obtener_mesh_relacionados(term)
             mesh_expandidos.update(relacionados[:2])  # Máximo 2 relacionados por término
-        
-        print(f"MeSH expandidos: {list(mesh_expandidos)}")
-        
-        # 2. CONSTRUIR QUERY AVANZADA CON MÚLTIPLES ESTRATEGIAS
-        queries = []
-        
-        # Estrategia 1: Términos MeSH principales con subheadings
-        mesh_principales = []
-        for term in list(mesh_expandidos)[:4]:  # Máximo 4 términos principales
-            # Agregar término MeSH básico
-            mesh_principales.append(f'"{term}"[MeSH Terms]')
-            
-            # Agregar con subheadings relevantes para fisioterapia
-            subheadings = ['therapy', 'rehabilitation', 'methods', 'drug therapy']
-            for subh in subheadings:
-                mesh_principales.append(f'"{term}/{subh}"[MeSH Terms]')
-        
-        if mesh_principales:
-            query_mesh = f"({' OR '.join(mesh_principales[:8])})"  # Limitar para evitar queries muy largas
-            queries.append(query_mesh)
-        
-        # Estrategia 2: Búsqueda en Title/Abstract con términos específicos
-        if keywords:
-            # Términos exactos en título (alta precisión)
-            title_terms = [f'"{keyword}"[Title]' for keyword in keywords[:3]]
-            if title_terms:
-                queries.append(f"({' OR '.join(title_terms)})")
-            
-            # Términos en abstract (mayor cobertura)
-            abstract_terms = [f'"{keyword}"[Abstract]' for keyword in keywords[:4]]
-            if abstract_terms:
-                queries.append(f"({' OR '.join(abstract_terms)})")
-        
-        # Estrategia 3: Búsqueda por palabras clave del texto original
-        if conceptos_texto:
-            text_terms = []
-            for concepto in list(conceptos_texto.keys())[:3]:
-                text_terms.append(f'"{concepto}"[Title/Abstract]')
-            if text_terms:
-                queries.append(f"({' OR '.join(text_terms)})")
-        
-        # 3. COMBINAR ESTRATEGIAS CON OPERADORES BOOLEANOS
-        if len(queries) >= 2:
-            # Combinación principal: MeSH AND (Title OR Abstract)
-            query_principal = f"({queries[0]}) AND ({queries[1]})"
-            # Query alternativa: Solo términos más específicos
-            query_alternativa = " OR ".join(queries[:2])
-            query_final = f"({query_principal}) OR ({query_alternativa})"
-        elif queries:
-            query_final = queries[0]
-        else:
-            query_final = '"Physical Therapy Modalities"[MeSH Terms]'
-        
-        # 4. APLICAR FILTROS AVANZADOS DE PUBMED
-        filtros_avanzados = []
-        
-        # Filtros por tipo de estudio (priorizando evidencia de alta calidad)
-        filtros_avanzados.append(
-            '(Clinical Trial[ptyp] OR Randomized Controlled Trial[ptyp] OR '
-            'Systematic Review[ptyp] OR Meta-Analysis[ptyp] OR Review[ptyp] OR '
-            'Comparative Study[ptyp])'
-        )
-        
-        # Filtro temporal
-        filtros_avanzados.append('("2014/01/01"[PDAT] : "2024/12/31"[PDAT])')
-        
-        # Filtros por idioma
-        filtros_avanzados.append('(English[lang] OR Spanish[lang])')
-        
-        # Filtros por edad si es relevante para fisioterapia
-        filtros_avanzados.append('(Adult[MeSH Terms] OR Middle Aged[MeSH Terms] OR Aged[MeSH Terms] OR Young Adult[MeSH Terms])')
-        
-        # Combinar query con filtros
-        query_completa = f"({query_final}) AND {' AND '.join(filtros_avanzados)}"
-        
-        print(f"Query avanzada final: {query_completa}")
-        
-        # 5. REALIZAR BÚSQUEDA MÚLTIPLE CON DIFERENTES ORDENAMIENTOS
-        resultados_combinados = []
-        
+    
+    print(f"MeSH expandidos: {list(mesh_expandidos)}")
+    
+    # 2-4. CONSTRUIR QUERY AVANZADA CON FILTROS
+    query_completa = construir_query_avanzada(mesh_expandidos, keywords, conceptos_texto)
+    print(f"Query avanzada final: {query_completa}")
+    
+    # 5. REALIZAR BÚSQUEDA MÚLTIPLE CON DIFERENTES ORDENAMIENTOS
+    resultados_combinados = []
+    
+    with medir_etapa("esearch"):
         # Búsqueda 1: Por relevancia
-        resultados_relevancia = realizar_busqueda_pubmed(query_completa, "relevance", max_results)
-        resultados_combinados.extend(resultados_relevancia)
+        busqueda_relevancia = realizar_busqueda_pubmed(query_completa, "relevance", max_results)
+        resultados_combinados.extend(busqueda_relevancia.pmids)
         
-        # Búsqueda 2: Por fecha (más recientes)
+        # Búsqueda 2: Por fecha (más recientes), reordenando en NCBI la búsqueda ya evaluada
         if len(resultados_combinados) < max_results:
-            resultados_fecha = realizar_busqueda_pubmed(query_completa, "pub_date", max_results - len(resultados_combinados))
-            resultados_combinados.extend(resultados_fecha)
-        
-        # 6. PROCESAMIENTO Y SCORING DE RELEVANCIA
-        articulos_procesados = []
-        for pmid in set(resultados_combinados):  # Eliminar duplicados
-            articulo = procesar_articulo_pubmed(pmid, mesh_terms, keywords, conceptos_texto)
-            if articulo:
-                articulos_procesados.append(articulo)
-        
-        # Ordenar por score de relevancia
-        articulos_procesados.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+            busqueda_fecha = realizar_busqueda_pubmed(
+                query_completa, "pub_date", max_results - len(resultados_combinados), historial=busqueda_relevancia
+            )
+            resultados_combinados.extend(busqueda_fecha.pmids)
+    
+    return list(dict.fromkeys(resultados_combinados)), busqueda_relevancia  # Eliminar duplicados
+
+def iterar_articulos_puntuados(pmids, mesh_terms, keywords, conceptos_texto, tamano_lote=TAMANO_LOTE_STREAMING):
+    """Genera los artículos que superan el umbral a medida que se descargan y puntúan"""
+    # Primero los que ya están en caché o en el espejo local, que no cuestan ninguna llamada
+    en_cache = obtener_articulos_locales(pmids)
+    for articulo in puntuar_articulos_lote(
+        [en_cache[pmid] for pmid in pmids if pmid in en_cache], mesh_terms, keywords, conceptos_texto
+    ):
+        yield articulo
+    
+    faltantes = [pmid for pmid in pmids if pmid not in en_cache]
+    for inicio in range(0, len(faltantes), tamano_lote):
+        if plazo_vencido():
+            break
+        lote = faltantes[inicio:inicio + tamano_lote]
+        metadatos = obtener_articulos_lote(lote)
+        for articulo in puntuar_articulos_lote(
+            [metadatos[pmid] for pmid in lote if pmid in metadatos], mesh_terms, keywords, conceptos_texto
+        ):
+            yield articulo
+
+def seleccionar_articulos(pmids, metadatos, mesh_terms, keywords, conceptos_texto, max_results):
+    """Puntúa los artículos descargados y devuelve los mejores ordenados por relevancia"""
+    articulos_procesados = puntuar_articulos_lote(
+        [metadatos[pmid] for pmid in pmids if pmid in metadatos],
+        mesh_terms, keywords, conceptos_texto
+    )
+    
+    # Ordenar por score de relevancia
+    articulos_procesados.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+    
+    return articulos_procesados[:max_results]
+
+def ordenar_por_prepuntuacion(pmids, resumenes, mesh_terms, keywords, conceptos_texto):
+    """Candidatos con resumen ordenados por el score de título y tipos de publicación (a igualdad, orden de búsqueda)"""
+    candidatos = [pmid for pmid in pmids if resumenes.get(pmid, {}).get("title")]
+    motor = compilar_motor_relevancia(tuple(mesh_terms), tuple(keywords), tuple(conceptos_texto.keys()))
+    scores = motor.puntuar([
+        f"{resumenes[pmid]['title']} {' '.join(resumenes[pmid].get('pubtype', []))}".lower() for pmid in candidatos
+    ])
+    orden = sorted(range(len(candidatos)), key=lambda i: -scores[i])
+    return [candidatos[i] for i in orden]
+
+def ordenar_seleccion(articulos, pmids, max_results):
+    """Los mejores por score; a igualdad, en el orden en que los devolvió la búsqueda"""
+    posiciones = {pmid: i for i, pmid in enumerate(pmids)}
+    articulos.sort(key=lambda x: (-x.get('relevance_score', 0), posiciones.get(x['pmid'], 0)))
+    return articulos[:max_results]
+
+def seleccionar_articulos_en_dos_fases(pmids, mesh_terms, keywords, conceptos_texto, max_results, busqueda=None):
+    """Preselecciona con un esummary por lotes y descarga el abstract solo de los mejores candidatos,
+    parando en cuanto hay max_results artículos sobre el umbral"""
+    aceptados = list(iterar_articulos_cribados(pmids, mesh_terms, keywords, conceptos_texto, max_results, busqueda))
+    return ordenar_seleccion(aceptados, pmids, max_results)
+
+def iterar_articulos_cribados(pmids, mesh_terms, keywords, conceptos_texto, max_results, busqueda=None, tamano_lote=None):
+    """Genera los artículos aceptados del cribado en dos fases según se descargan: primero los locales y
+    luego lotes en el orden de la preselección (de max_results por defecto) hasta tener max_results"""
+    locales = obtener_articulos_locales(pmids)
+    aceptados = 0
+    for articulo in puntuar_articulos_lote(
+        [locales[pmid] for pmid in pmids if pmid in locales], mesh_terms, keywords, conceptos_texto
+    ):
+        aceptados += 1
+        yield articulo
+    faltantes = [pmid for pmid in pmids if pmid not in locales]
+    if not faltantes or aceptados >= max_results:
+        return
+    
+    resumenes = obtener_resumenes_lote(faltantes, busqueda)
+    if resumenes is None:
+        # Sin preselección posible: descargar todo como en el modo de una fase
+        orden, tamano = faltantes, tamano_lote or len(faltantes)
+    else:
+        orden = ordenar_por_prepuntuacion(faltantes, resumenes, mesh_terms, keywords, conceptos_texto)
+        tamano = tamano_lote or max_results
+    
+    for inicio in range(0, len(orden), tamano):
+        if plazo_vencido():
+            break
+        lote = orden[inicio:inicio + tamano]
+        metadatos = obtener_articulos_lote(lote)
+        for articulo in puntuar_articulos_lote(
+            [metadatos[pmid] for pmid in lote if pmid in metadatos], mesh_terms, keywords, conceptos_texto
+        ):
+            aceptados += 1
+            yield articulo
+        if aceptados >= max_results:
+            metrica_articulos_cribados.inc(len(orden) - inicio - len(lote))
+            break
+
+def obtener_resumenes_lote(pmids, busqueda=None):
+    """Títulos y tipos de publicación de esummary, {pmid: {...}}; None si la llamada falla"""
+    resumenes = {}
+    try:
+        for lote, params in planificar_descarga(pmids, busqueda):
+            resumenes.update(esummary_lote(lote, params))
+    except Exception as e:
+        print(f"Error obteniendo resúmenes para el cribado: {e}")
+        return None
+    return resumenes
+
+def esummary_lote(lote, params):
+    """esummary de un lote; lanza excepción si falla la llamada por IDs"""
+    response = cliente_eutils.post("esummary.fcgi", {**params, "retmode": "json"}, timeout=20)
+    resumenes = extraer_resumenes(lote, response.json()) if response.status_code == 200 else {}
+    
+    pendientes = [pmid for pmid in lote if pmid not in resumenes]
+    if pendientes and "WebEnv" in params:
+        resumenes.update(esummary_lote(pendientes, params_por_ids(pendientes)))
+    elif response.status_code != 200:
+        raise RuntimeError(f"esummary devolvió HTTP {response.status_code}")
+    return resumenes
+
+def extraer_resumenes(lote, s_data):
+    """Solo los campos de esummary que usa la preselección"""
+    resultado = s_data.get("result", {})
+    return {
+        pmid: {"title": resultado[pmid].get("title", ""), "pubtype": resultado[pmid].get("pubtype", [])}
+        for pmid in lote if isinstance(resultado.get(pmid), dict)
+    }
+
+def construir_query_avanzada(mesh_expandidos, keywords, conceptos_texto):
+    """Construye la query booleana de PubMed con estrategias MeSH, Title/Abstract y filtros"""
+    # 2. CONSTRUIR QUERY AVANZADA CON MÚLTIPLES ESTRATEGIAS
+    queries = []
+    
+    # Estrategia 1: Términos MeSH principales con subheadings
+    mesh_principales = []
+    for term in list(mesh_expandidos)[:4]:  # Máximo 4 términos principales
+        # Agregar término MeSH básico
+        mesh_principales.append(f'"{term}"[MeSH Terms]')
         
-        return articulos_procesados[:max_results]
+        # Agregar con subheadings relevantes para fisioterapia
+        subheadings = ['therapy', 'rehabilitation', 'methods', 'drug therapy']
+        for subh in subheadings:
+            mesh_principales.append(f'"{term}/{subh}"[MeSH Terms]')
+    
+    if mesh_principales:
+        query_mesh = f"({' OR '.join(mesh_principales[:8])})"  # Limitar para evitar queries muy largas
+        queries.append(query_mesh)
+    
+    # Estrategia 2: Búsqueda en Title/Abstract con términos específicos
+    if keywords:
+        # Términos exactos en título (alta precisión)
+        title_terms = [f'"{keyword}"[Title]' for keyword in keywords[:3]]
+        if title_terms:
+            queries.append(f"({' OR '.join(title_terms)})")
         
-    except Exception as e:
-        print(f"Error en buscar_articulos_mesh_avanzado: {e}")
-        return []
+        # Términos en abstract (mayor cobertura)
+        abstract_terms = [f'"{keyword}"[Abstract]' for keyword in keywords[:4]]
+        if abstract_terms:
+            queries.append(f"({' OR '.join(abstract_terms)})")
+    
+    # Estrategia 3: Búsqueda por palabras clave del texto original
+    if conceptos_texto:
+        text_terms = []
+        for concepto in list(conceptos_texto.keys())[:3]:
+            text_terms.append(f'"{concepto}"[Title/Abstract]')
+        if text_terms:
+            queries.append(f"({' OR '.join(text_terms)})")
+    
+    # 3. COMBINAR ESTRATEGIAS CON OPERADORES BOOLEANOS
+    if len(queries) >= 2:
+        # Combinación principal: MeSH AND (Title OR Abstract)
+        query_principal = f"({queries[0]}) AND ({queries[1]})"
+        # Query alternativa: Solo términos más específicos
+        query_alternativa = " OR ".join(queries[:2])
+        query_final = f"({query_principal}) OR ({query_alternativa})"
+    elif queries:
+        query_final = queries[0]
+    else:
+        query_final = '"Physical Therapy Modalities"[MeSH Terms]'
+    
+    # 4. APLICAR FILTROS AVANZADOS DE PUBMED
+    filtros_avanzados = []
+    
+    # Filtros por tipo de estudio (priorizando evidencia de alta calidad)
+    filtros_avanzados.append(
+        '(Clinical Trial[ptyp] OR Randomized Controlled Trial[ptyp] OR '
+        'Systematic Review[ptyp] OR Meta-Analysis[ptyp] OR Review[ptyp] OR '
+        'Comparative Study[ptyp])'
+    )
+    
+    # Filtro temporal
+    filtros_avanzados.append('("2014/01/01"[PDAT] : "2024/12/31"[PDAT])')
+    
+    # Filtros por idioma
+    filtros_avanzados.append('(English[lang] OR Spanish[lang])')
+    
+    # Filtros por edad si es relevante para fisioterapia
+    filtros_avanzados.append('(Adult[MeSH Terms] OR Middle Aged[MeSH Terms] OR Aged[MeSH Terms] OR Young Adult[MeSH Terms])')
+    
+    # Combinar query con filtros
+    return f"({query_final}) AND {' AND '.join(filtros_avanzados)}"
+
+class ResultadoBusqueda:
+    """PMIDs de una búsqueda y su referencia en el History server de NCBI (None si no vino de esearch)"""
+    
+    __slots__ = ("pmids", "webenv", "query_key", "total")
+    
+    def __init__(self, pmids, webenv=None, query_key=None, total=None):
+        self.pmids = tuple(pmids)
+        self.webenv = webenv
+        self.query_key = query_key
+        self.total = total if total is not None else len(self.pmids)
 
-def realizar_busqueda_pubmed(query, sort_order, max_results):
-    """Realiza una búsqueda específica en PubMed"""
+def realizar_busqueda_pubmed(query, sort_order, max_results, historial=None):
+    """Realiza una búsqueda específica en PubMed; con historial reordena en NCBI una búsqueda anterior"""
     try:
-        url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-        params = {
-            "db": "pubmed",
-            "term": query,
-            "retmode": "json",
-            "api_key": PUBMED_API_KEY,
-            "retmax": max_results * 3,  # Buscar más para filtrar después
-            "sort": sort_order,
-            "usehistory": "y"
-        }
+        retmax = max_results * 3  # Buscar más para filtrar después
+        locales = buscar_en_espejo(query, sort_order, retmax)
+        if locales is not None:
+            return ResultadoBusqueda(locales)
         
-        response = requests.get(url, params=params, timeout=20)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("esearchresult", {}).get("idlist", [])
+        clave = (" ".join(query.split()), sort_order, retmax)
+        if historial is not None and historial.webenv:
+            try:
+                return cache_busquedas.obtener(clave, lambda: esearch_pubmed(query, sort_order, retmax, historial))
+            except (PlazoAgotado, CircuitoAbierto):
+                raise
+            except Exception as e:
+                # El WebEnv caduca en NCBI: repetir la query completa
+                print(f"Error reutilizando el historial de esearch: {e}")
+        return cache_busquedas.obtener(clave, lambda: esearch_pubmed(query, sort_order, retmax))
         
     except Exception as e:
         print(f"Error en realizar_busqueda_pubmed: {e}")
+        marcar_degradado()
+        return busqueda_obsoleta(query, sort_order, max_results * 3)
+
+def busqueda_obsoleta(query, sort_order, retmax):
+    """Resultado caducado de la misma búsqueda si NCBI falla; vacío si no lo hay"""
+    obsoleta = cache_busquedas.obtener_obsoleto((" ".join(query.split()), sort_order, retmax), CACHE_GRACIA_OBSOLETOS)
+    if obsoleta is None:
+        return ResultadoBusqueda([])
+    metrica_obsoletos_servidos.labels(cache="busquedas").inc()
+    marcar_obsoletos()
+    # Sin WebEnv: el del resultado caducado ya no será válido en NCBI
+    return ResultadoBusqueda(obsoleta.pmids)
+
+def params_esearch(query, sort_order, retmax, historial=None):
+    """Parámetros de esearch; con historial la query es '#query_key' sobre su WebEnv"""
+    params = {
+        "db": "pubmed",
+        "term": query,
+        "retmode": "json",
+        "api_key": PUBMED_API_KEY,
+        "retmax": retmax,
+        "sort": sort_order,
+        "usehistory": "y"
+    }
+    if historial is not None and historial.webenv:
+        params["term"] = f"#{historial.query_key}"
+        params["WebEnv"] = historial.webenv
+    return params
+
+def leer_resultado_esearch(data):
+    resultado = data.get("esearchresult", {})
+    if "ERROR" in resultado:
+        raise RuntimeError(f"esearch devolvió un error: {resultado['ERROR']}")
+    total = resultado.get("count")
+    return ResultadoBusqueda(
+        resultado.get("idlist", []),
+        resultado.get("webenv"),
+        resultado.get("querykey"),
+        int(total) if str(total).isdigit() else None
+    )
+
+def esearch_pubmed(query, sort_order, retmax, historial=None):
+    """Llama a esearch y devuelve un ResultadoBusqueda; lanza excepción si la llamada falla"""
+    response = cliente_eutils.post("esearch.fcgi", params_esearch(query, sort_order, retmax, historial), timeout=20)
+    if response.status_code != 200:
+        raise RuntimeError(f"esearch devolvió HTTP {response.status_code}")
+    
+    return leer_resultado_esearch(response.json())
+
+def params_por_ids(lote):
+    return {"db": "pubmed", "id": ",".join(lote), "api_key": PUBMED_API_KEY}
+
+def planificar_descarga(pmids, busqueda=None, tamano=None):
+    """Divide los PMIDs en peticiones de tamaño fijo: el tramo que coincide con resultados consecutivos de la
+    búsqueda se pagina por el History server (WebEnv/query_key + retstart) y el resto va por lista de IDs"""
+    tamano = tamano or TAMANO_LOTE_PUBMED
+    peticiones = []
+    resto = list(pmids)
     
-    return []
+    if busqueda is not None and busqueda.webenv and resto:
+        posiciones = {pmid: i for i, pmid in enumerate(busqueda.pmids)}
+        inicio = posiciones.get(resto[0])
+        if inicio is not None:
+            n = 1
+            while n < len(resto) and posiciones.get(resto[n]) == inicio + n:
+                n += 1
+            for desplazamiento in range(0, n, tamano):
+                lote = resto[desplazamiento:min(n, desplazamiento + tamano)]
+                peticiones.append((lote, {
+                    "db": "pubmed",
+                    "query_key": busqueda.query_key,
+                    "WebEnv": busqueda.webenv,
+                    "retstart": inicio + desplazamiento,
+                    "retmax": len(lote),
+                    "api_key": PUBMED_API_KEY
+                }))
+            resto = resto[n:]
+    
+    for desplazamiento in range(0, len(resto), tamano):
+        lote = resto[desplazamiento:desplazamiento + tamano]
+        peticiones.append((lote, params_por_ids(lote)))
+    return peticiones
 
 def procesar_articulo_pubmed(pmid, mesh_terms, keywords, conceptos_texto):
     """Procesa un artículo individual de PubMed con scoring de relevancia"""
     try:
-        time.sleep(0.2)  # Rate limiting
-        
-        # Obtener resumen completo del artículo
-        fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-        fetch_params = {
-            "db": "pubmed",
-            "id": pmid,
-            "retmode": "xml",
-            "api_key": PUBMED_API_KEY
-        }
-        
-        fetch_response = requests.get(fetch_url, params=fetch_params, timeout=15)
-        if fetch_response.status_code != 200:
-            return None
-        
-        # También obtener el summary para información básica
-        summary_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-        summary_params = {
-            "db": "pubmed",
-            "id": pmid,
-            "retmode": "json",
-            "api_key": PUBMED_API_KEY
-        }
-        
-        s_response = requests.get(summary_url, params=summary_params, timeout=10)
-        if s_response.status_code != 200:
-            return None
-        
-        s_data = s_response.json()
-        info = s_data.get("result", {}).get(pmid, {})
-        
-        if not info or not info.get("title"):
+        metadatos = obtener_articulos_lote([pmid])
+        info = metadatos.get(pmid)
+        if not info:
             return None
+        return construir_articulo(info, mesh_terms, keywords, conceptos_texto)
         
-        # CALCULAR SCORE DE RELEVANCIA AVANZADO
-        title = info.get("title", "").lower()
-        abstract_text = ""
-        
-        # Extraer abstract del XML si está disponible
+    except Exception as e:
+        print(f"Error procesando PMID {pmid}: {e}")
+        return None
+
+def obtener_articulos_locales(pmids):
+    """Metadatos disponibles sin red: caché de artículos y, para el resto, el espejo local"""
+    metadatos = cache_articulos.obtener_muchos(pmids)
+    if espejo_pubmed is not None:
+        faltantes = [pmid for pmid in pmids if pmid not in metadatos]
+        if faltantes:
+            metadatos.update(espejo_pubmed.obtener_muchos(faltantes))
+    return metadatos
+
+@medir_etapa("efetch")
+def obtener_articulos_lote(pmids, busqueda=None):
+    """Obtiene metadatos de varios artículos (caché y espejo primero, luego efetch por lotes)"""
+    pmids = [str(pmid) for pmid in pmids]
+    metadatos = obtener_articulos_locales(pmids)
+    faltantes = [pmid for pmid in pmids if pmid not in metadatos]
+    descargados = {}
+    
+    # efetch trae todo lo necesario (autores, revista, fecha, abstract, DOI) en una sola llamada
+    for lote, params in planificar_descarga(faltantes, busqueda):
         try:
-            import xml.etree.ElementTree as ET
-            root = ET.fromstring(fetch_response.text)
-            abstract_elem = root.find(".//Abstract/AbstractText")
-            if abstract_elem is not None:
-                abstract_text = abstract_elem.text or ""
-        except:
-            pass
+            descargados.update(efetch_lote(lote, params))
+        except Exception as e:
+            print(f"Error obteniendo lote de artículos: {e}")
+            marcar_degradado()
+    
+    cache_articulos.guardar_muchos(descargados)
+    metadatos.update(descargados)
+    metadatos.update(articulos_obsoletos([pmid for pmid in faltantes if pmid not in descargados]))
+    return metadatos
+
+def articulos_obsoletos(pmids):
+    """Metadatos caducados de la caché para los artículos que efetch no pudo traer"""
+    obsoletos = cache_articulos.obtener_obsoletos(pmids, CACHE_GRACIA_OBSOLETOS)
+    if obsoletos:
+        metrica_obsoletos_servidos.labels(cache="articulos").inc(len(obsoletos))
+        marcar_obsoletos()
+    return obsoletos
+
+def efetch_lote(lote, params):
+    """efetch de un lote; lo que no llegue por el History server (p. ej. WebEnv caducado) se pide por IDs.
+    Lanza excepción si falla la llamada por IDs"""
+    # En streaming: el XML se parsea según llega, sin tener el cuerpo entero en memoria
+    fetch_response = cliente_eutils.post("efetch.fcgi", {**params, "retmode": "xml"}, timeout=30, stream=True)
+    descargados = {}
+    try:
+        if fetch_response.status_code == 200:
+            descargados = metadatos_efetch(lote, fetch_response.iter_content(64 * 1024))
+    finally:
+        fetch_response.close()
+    
+    pendientes = [pmid for pmid in lote if pmid not in descargados]
+    if pendientes and "WebEnv" in params:
+        descargados.update(efetch_lote(pendientes, params_por_ids(pendientes)))
+    elif fetch_response.status_code != 200:
+        raise RuntimeError(f"efetch devolvió HTTP {fetch_response.status_code}")
+    return descargados
+
+def anotar_metadatos(metadatos, pedidos, registros):
+    for registro in registros:
+        if registro.pmid in pedidos and registro.titulo:
+            metadatos[registro.pmid] = registro.como_metadatos()
+
+def metadatos_efetch(lote, trozos):
+    """Metadatos por PMID de un lote a partir de su XML de efetch"""
+    metadatos = {}
+    try:
+        anotar_metadatos(metadatos, set(lote), iterar_registros_efetch(trozos))
+    except ET.ParseError as e:
+        print(f"Error parseando XML de efetch: {e}")
+    return metadatos
+
+async def metadatos_efetch_async(lote, response):
+    """Versión asíncrona de metadatos_efetch: parsea la respuesta en streaming según llegan los trozos"""
+    pedidos = set(lote)
+    metadatos = {}
+    lector = LectorEfetch()
+    try:
+        async for trozo in response.aiter_bytes(64 * 1024):
+            anotar_metadatos(metadatos, pedidos, lector.alimentar(trozo))
+        lector.cerrar()
+    except ET.ParseError as e:
+        print(f"Error parseando XML de efetch (async): {e}")
+    return metadatos
+
+def texto_para_relevancia(info):
+    """Título y abstract en minúsculas, tal como los puntúa calcular_relevancia_avanzada"""
+    title = info.get("title", "").lower()
+    abstract_text = info.get("abstract", "")
+    return f"{title} {abstract_text}".lower()
+
+def construir_articulo(info, mesh_terms, keywords, conceptos_texto, relevance_score=None):
+    """Calcula la relevancia de un artículo ya descargado y arma su cita APA"""
+    pmid = info["pmid"]
+    
+    # CALCULAR SCORE DE RELEVANCIA AVANZADO (si no viene ya calculado por lotes)
+    if relevance_score is None:
+        relevance_score = calcular_relevancia_avanzada(texto_para_relevancia(info), mesh_terms, keywords, conceptos_texto)
+    
+    # Filtrar artículos con baja relevancia
+    if relevance_score < 15:  # Umbral mínimo
+        return None
+    
+    # Procesar información del artículo
+    autores = info.get("authors", [])
+    title_original = info.get("title", "").strip()
+    if title_original.endswith('.'):
+        title_original = title_original[:-1]
+    
+    # Procesar autores para formato APA
+    autor_apa = procesar_autores_apa(autores)
+    
+    # Año y journal
+    pubdate = info.get("pubdate", "")
+    año = pubdate.split(" ")[0] if pubdate else "s.f."
+    journal = info.get("journal") or "Journal desconocido"
+    doi = info.get("doi", "")
+    
+    # Construir URL preferencial (DOI si existe, sino PubMed)
+    if doi:
+        url_articulo = f"https://doi.org/{doi}"
+    else:
+        url_articulo = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
+    
+    return {
+        "pmid": pmid,
+        "autor": autor_apa,
+        "año": año,
+        "titulo": title_original,
+        "journal": journal,
+        "doi": doi,
+        "url": url_articulo,
+        "abstract": info.get("abstract", ""),
+        "mesh": info.get("mesh", []),
+        "relevance_score": relevance_score,
+        "cita_apa": f"{autor_apa} ({año}). {title_original}. *{journal}*. {url_articulo}"
+    }
+
+@medir_etapa("scoring")
+def puntuar_articulos_lote(metadatos, mesh_terms, keywords, conceptos_texto):
+    """Calcula la relevancia de un lote de artículos y descarta los de bajo score"""
+    metadatos = list(metadatos)
+    try:
+        motor = compilar_motor_relevancia(tuple(mesh_terms), tuple(keywords), tuple(conceptos_texto.keys()))
+        scores = motor.puntuar([texto_para_relevancia(info) for info in metadatos])
+    except Exception as e:
+        print(f"Error calculando relevancia por lotes: {e}")
+        scores = [0] * len(metadatos)
+    
+    articulos_procesados = []
+    descartados = 0
+    for info, score in zip(metadatos, scores):
+        try:
+            articulo = construir_articulo(info, mesh_terms, keywords, conceptos_texto, relevance_score=score)
+        except Exception as e:
+            print(f"Error procesando PMID {info.get('pmid')}: {e}")
+            continue
+        if articulo:
+            articulos_procesados.append(articulo)
+        else:
+            descartados += 1
+    metrica_articulos_descartados.inc(descartados)
+    return articulos_procesados
+
+# Términos técnicos que suman relevancia (peso medio)
+TERMINOS_TECNICOS = [
+    'clinical trial', 'randomized', 'systematic review', 'meta-analysis',
+    'efficacy', 'effectiveness', 'treatment', 'intervention', 'therapy',
+    'rehabilitation', 'exercise', 'training', 'recovery'
+]
+
+class MotorRelevancia:
+    """Conjunto de términos de una petición compilado una vez para puntuar lotes de textos"""
+    
+    def __init__(self, mesh_terms, keywords, conceptos):
+        pesos_texto = Counter()
+        pesos_compacto = Counter()
         
-        combined_text = f"{title} {abstract_text}".lower()
-        relevance_score = calcular_relevancia_avanzada(combined_text, mesh_terms, keywords, conceptos_texto)
+        # 1. Términos MeSH exactos (20) y sus palabras de más de 3 letras (5)
+        for mesh_term in mesh_terms:
+            pesos_texto[mesh_term.lower()] += 20
+            for palabra in mesh_term.lower().split():
+                if len(palabra) > 3:
+                    pesos_texto[palabra] += 5
         
-        # Filtrar artículos con baja relevancia
-        if relevance_score < 15:  # Umbral mínimo
-            return None
+        # 2. Keywords (15) y sus variantes sin espacios (10)
+        for keyword in keywords:
+            pesos_texto[keyword.lower()] += 15
+            pesos_compacto[keyword.replace(' ', '')] += 10
         
-        # Procesar información del artículo
-        autores = info.get("authors", [])
-        title_original = info.get("title", "").strip()
-        if title_original.endswith('.'):
-            title_original = title_original[:-1]
+        # 3. Conceptos del texto original (12)
+        for concepto in conceptos:
+            pesos_texto[concepto.lower()] += 12
         
-        # Procesar autores para formato APA
-        autor_apa = procesar_autores_apa(autores)
+        # 4. Términos técnicos (8)
+        for termino in TERMINOS_TECNICOS:
+            pesos_texto[termino] += 8
         
-        # Año y journal
-        pubdate = info.get("pubdate", "")
-        año = pubdate.split(" ")[0] if pubdate else "s.f."
-        journal = info.get("fulljournalname", info.get("source", "Journal desconocido"))
+        # Un patrón vacío siempre "aparece": se suma como constante
+        self.constante = pesos_texto.pop('', 0) + pesos_compacto.pop('', 0)
         
-        # Obtener DOI si está disponible
-        doi = ""
-        try:
-            doi_elem = ET.fromstring(fetch_response.text).find(".//ELocationID[@EIdType='doi']")
-            if doi_elem is not None:
-                doi = doi_elem.text or ""
-        except:
-            pass
+        # Cada patrón distinto se busca una sola vez por texto, con su peso acumulado
+        self._patrones_texto = list(pesos_texto)
+        self._patrones_compacto = list(pesos_compacto)
+        self._pesos_texto = [pesos_texto[p] for p in self._patrones_texto]
+        self._pesos_compacto = [pesos_compacto[p] for p in self._patrones_compacto]
         
-        # Construir URL preferencial (DOI si existe, sino PubMed)
-        if doi:
-            url_articulo = f"https://doi.org/{doi}"
+        # 5. Términos de densidad en una sola regex; solo pueden estar dentro de una palabra si no tienen espacios
+        terminos_densidad = list(keywords) + list(conceptos)
+        self._densidad_total = '' in terminos_densidad
+        alternativas = sorted({t for t in terminos_densidad if t and not any(c.isspace() for c in t)}, key=len, reverse=True)
+        self._regex_densidad = re.compile('|'.join(re.escape(t) for t in alternativas)) if alternativas else None
+    
+    def _puntos_presencia(self, patrones, pesos, textos):
+        """Suma de pesos de los patrones presentes: matriz textos x patrones por vector de pesos"""
+        if not patrones:
+            return [0] * len(textos)
+        if NUMPY_AVAILABLE:
+            matriz = np.array([[patron in texto for patron in patrones] for texto in textos], dtype=np.int64)
+            return (matriz @ np.asarray(pesos, dtype=np.int64)).tolist()
+        return [sum(peso for patron, peso in zip(patrones, pesos) if patron in texto) for texto in textos]
+    
+    def _bonus_densidad(self, texto, memo):
+        palabras = texto.split()
+        if not palabras:
+            return 0
+        if self._densidad_total:
+            densidad = len(palabras)
+        elif self._regex_densidad is None:
+            densidad = 0
         else:
-            url_articulo = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
-        
-        articulo = {
-            "pmid": pmid,
-            "autor": autor_apa,
-            "año": año,
-            "titulo": title_original,
-            "journal": journal,
-            "doi": doi,
-            "url": url_articulo,
-            "relevance_score": relevance_score,
-            "cita_apa": f"{autor_apa} ({año}). {title_original}. *{journal}*. {url_articulo}"
-        }
-        
-        return articulo
-        
-    except Exception as e:
-        print(f"Error procesando PMID {pmid}: {e}")
-        return None
+            densidad = 0
+            buscar = self._regex_densidad.search
+            for palabra in palabras:
+                coincide = memo.get(palabra)
+                if coincide is None:
+                    coincide = memo[palabra] = buscar(palabra) is not None
+                densidad += coincide
+        return int((densidad / len(palabras)) * 100)
+    
+    def puntuar(self, textos):
+        """Vector de scores, idéntico a aplicar calcular_relevancia_avanzada a cada texto"""
+        textos = list(textos)
+        if not textos:
+            return []
+        puntos_texto = self._puntos_presencia(self._patrones_texto, self._pesos_texto, textos)
+        puntos_compacto = self._puntos_presencia(
+            self._patrones_compacto, self._pesos_compacto, [t.replace(' ', '') for t in textos]
+        )
+        # La caché de palabras se comparte en todo el lote: los abstracts repiten vocabulario
+        memo = {}
+        return [
+            int(a + b) + self.constante + self._bonus_densidad(texto, memo)
+            for texto, a, b in zip(textos, puntos_texto, puntos_compacto)
+        ]
+
+@lru_cache(maxsize=128)
+def compilar_motor_relevancia(mesh_terms, keywords, conceptos):
+    """Motor de relevancia cacheado por conjunto de términos (las peticiones repiten temas)"""
+    return MotorRelevancia(mesh_terms, keywords, conceptos)
 
 def calcular_relevancia_avanzada(texto_completo, mesh_terms, keywords, conceptos_texto):
     """Calcula score de relevancia avanzado considerando múltiples factores"""
-    score = 0
-    
     try:
-        # 1. Coincidencias exactas con términos MeSH (peso alto)
-        for mesh_term in mesh_terms:
-            if mesh_term.lower() in texto_completo:
-                score += 20
-            # Coincidencias parciales
-            palabras_mesh = mesh_term.lower().split()
-            for palabra in palabras_mesh:
-                if len(palabra) > 3 and palabra in texto_completo:
-                    score += 5
-        
-        # 2. Coincidencias con keywords (peso medio)
-        for keyword in keywords:
-            if keyword.lower() in texto_completo:
-                score += 15
-            # Variaciones del keyword
-            if keyword.replace(' ', '') in texto_completo.replace(' ', ''):
-                score += 10
-        
-        # 3. Coincidencias con conceptos del texto original (peso medio)
-        for concepto in conceptos_texto.keys():
-            if concepto.lower() in texto_completo:
-                score += 12
-        
-        # 4. Términos técnicos específicos (peso medio)
-        terminos_tecnicos = [
-            'clinical trial', 'randomized', 'systematic review', 'meta-analysis',
-            'efficacy', 'effectiveness', 'treatment', 'intervention', 'therapy',
-            'rehabilitation', 'exercise', 'training', 'recovery'
-        ]
-        
-        for termino in terminos_tecnicos:
-            if termino in texto_completo:
-                score += 8
-        
-        # 5. Bonus por densidad de términos relevantes
-        total_palabras = len(texto_completo.split())
-        if total_palabras > 0:
-            densidad = sum(1 for word in texto_completo.split() 
-                          if any(term in word for term in keywords + list(conceptos_texto.keys())))
-            score += int((densidad / total_palabras) * 100)
-        
-        return score
+        motor = compilar_motor_relevancia(tuple(mesh_terms), tuple(keywords), tuple(conceptos_texto.keys()))
+        return motor.puntuar([texto_completo])[0]
         
     except Exception as e:
         print(f"Error calculando relevancia: {e}")
@@ -510,189 +2546,1034 @@ def procesar_autores_apa(autores):
     except:
         return "Autor desconocido"
 
+# Oraciones con afirmaciones científicas, datos o resultados: siempre llevan cita
+PALABRAS_CIENTIFICAS = (
+    'estudio', 'investigación', 'resultado', 'evidencia', 'datos',
+    'análisis', 'tratamiento', 'terapia', 'eficacia', 'efectividad',
+    'paciente', 'clínico', 'mejora', 'reduce', 'aumenta', 'demuestra',
+    'indica', 'sugiere', 'reporta', 'encuentra', 'observa'
+)
+
+def debe_citar_oracion(i, oracion, n_oraciones):
+    """Afirmaciones científicas y, en textos de más de 3 oraciones, una de cada 2"""
+    oracion_lower = oracion.lower()
+    if any(palabra in oracion_lower for palabra in PALABRAS_CIENTIFICAS):
+        return True
+    return (i + 1) % 2 == 0 and n_oraciones > 3
+
+def terminos_emparejamiento(texto, stop_words):
+    """Tokens en minúsculas sin stopwords ni palabras de menos de 3 letras"""
+    return [p for p in REGEX_PALABRAS.findall(texto.lower()) if len(p) > 2 and p not in stop_words]
+
+def terminos_oracion(oracion, stop_words):
+    """Tokens de la oración más las keywords y términos MeSH (en inglés) de los conceptos que menciona,
+    para que pueda coincidir con títulos y abstracts de PubMed"""
+    palabras = terminos_emparejamiento(oracion, stop_words)
+    scores = detector_conceptos.puntuar(oracion, [p for p in palabras if len(p) > 3])
+    for area, score in scores.items():
+        if score > 0:
+            terminos = MESH_DECS_MAPPING[area]
+            palabras.extend(terminos_emparejamiento(
+                " ".join(terminos.get('keywords', []) + terminos.get('mesh', [])), stop_words
+            ))
+    return palabras
+
+def terminos_articulo(articulo, stop_words):
+    texto = " ".join([articulo.get('titulo', ''), articulo.get('abstract', ''), " ".join(articulo.get('mesh', []))])
+    return terminos_emparejamiento(texto, stop_words)
+
+def similitud_tfidf(consultas, documentos):
+    """Similitud coseno TF-IDF (tf sublineal, idf suavizado) entre listas de tokens: matriz consultas x documentos"""
+    todos = consultas + documentos
+    vocabulario = {}
+    for tokens in todos:
+        for token in tokens:
+            vocabulario.setdefault(token, len(vocabulario))
+    
+    if NUMPY_AVAILABLE:
+        if not vocabulario:
+            return np.zeros((len(consultas), len(documentos)))
+        filas = np.repeat(np.arange(len(todos)), [len(tokens) for tokens in todos])
+        columnas = np.fromiter((vocabulario[t] for tokens in todos for t in tokens), dtype=np.int64, count=len(filas))
+        tf = np.bincount(filas * len(vocabulario) + columnas, minlength=len(todos) * len(vocabulario))
+        tf = tf.reshape(len(todos), len(vocabulario)).astype(np.float64)
+        idf = np.log((1 + len(todos)) / (1 + np.count_nonzero(tf, axis=0))) + 1
+        pesos = np.log1p(tf) * idf
+        normas = np.linalg.norm(pesos, axis=1, keepdims=True)
+        pesos /= np.where(normas == 0, 1, normas)
+        return pesos[:len(consultas)] @ pesos[len(consultas):].T
+    
+    # Sin NumPy: vectores dispersos en dicts
+    df = Counter(token for tokens in todos for token in set(tokens))
+    vectores = []
+    for tokens in todos:
+        pesos = {t: (1 + math.log(n)) * (math.log((1 + len(todos)) / (1 + df[t])) + 1) for t, n in Counter(tokens).items()}
+        norma = math.sqrt(sum(w * w for w in pesos.values())) or 1
+        vectores.append({t: w / norma for t, w in pesos.items()})
+    return [
+        [sum(w * d.get(t, 0) for t, w in c.items()) for d in vectores[len(consultas):]]
+        for c in vectores[:len(consultas)]
+    ]
+
+def asignar_articulos(similitud, n_oraciones, n_articulos):
+    """Asigna a cada oración un artículo distinto, primero los pares de mayor similitud; las que no coinciden
+    con ninguno reciben los restantes por orden de relevancia. Devuelve {oración: artículo}"""
+    if NUMPY_AVAILABLE:
+        valores = np.asarray(similitud, dtype=np.float64).ravel()
+        orden = np.argsort(-valores, kind="stable").tolist()
+        valores = valores.tolist()
+    else:
+        valores = [v for fila in similitud for v in fila]
+        orden = sorted(range(len(valores)), key=lambda k: -valores[k])
+    
+    limite = min(n_oraciones, n_articulos)
+    asignacion = {}
+    usados = set()
+    for k in orden:
+        if len(asignacion) == limite or valores[k] <= 0:
+            break
+        oracion, articulo = divmod(k, n_articulos)
+        if oracion not in asignacion and articulo not in usados:
+            asignacion[oracion] = articulo
+            usados.add(articulo)
+    
+    libres = (j for j in range(n_articulos) if j not in usados)
+    for oracion in range(n_oraciones):
+        if len(asignacion) == limite:
+            break
+        if oracion not in asignacion:
+            asignacion[oracion] = next(libres)
+    return asignacion
+
+@medir_etapa("integracion_citas")
 def integrar_citas_en_texto(texto, articulos):
-    """Integra citas en el texto de manera inteligente"""
+    """Integra citas en el texto, eligiendo para cada oración el artículo con más similitud TF-IDF"""
     try:
-        if NLTK_AVAILABLE:
-            oraciones = sent_tokenize(texto, language='spanish')
-        else:
-            # Tokenización básica de oraciones
-            oraciones = re.split(r'[.!?]+', texto)
-            oraciones = [o.strip() for o in oraciones if o.strip()]
+        oraciones = dividir_oraciones(texto)
         
         if not articulos:
             return texto, []
         
-        texto_citado = ""
-        referencias_usadas = []
-        contador_citas = 1
-        
-        # Mapear artículos a números de referencia
-        mapa_referencias = {}
-        for i, articulo in enumerate(articulos):
-            mapa_referencias[articulo['pmid']] = i + 1
+        # Emparejar en un solo lote todas las oraciones a citar con todos los artículos
+        candidatas = [i for i, oracion in enumerate(oraciones) if debe_citar_oracion(i, oracion, len(oraciones))]
+        stop_words = obtener_stopwords()
+        similitud = similitud_tfidf(
+            [terminos_oracion(oraciones[i], stop_words) for i in candidatas],
+            [terminos_articulo(articulo, stop_words) for articulo in articulos]
+        )
+        citas = {candidatas[i]: articulos[j] for i, j in asignar_articulos(similitud, len(candidatas), len(articulos)).items()}
         
+        partes = []
+        referencias_usadas = []
+        pmids_usados = set()
         for i, oracion in enumerate(oraciones):
-            # Agregar la oración
-            texto_citado += oracion
-            
-            # Determinar si agregar cita basándose en contenido y posición
-            debe_citar = False
-            
-            # Criterios para citar:
-            # 1. Cada 2-3 oraciones
-            # 2. Oraciones con afirmaciones científicas
-            # 3. Datos, estadísticas o resultados
-            
-            palabras_cientificas = [
-                'estudio', 'investigación', 'resultado', 'evidencia', 'datos',
-                'análisis', 'tratamiento', 'terapia', 'eficacia', 'efectividad',
-                'paciente', 'clínico', 'mejora', 'reduce', 'aumenta', 'demuestra',
-                'indica', 'sugiere', 'reporta', 'encuentra', 'observa'
-            ]
-            
-            # Verificar si la oración contiene términos que requieren citación
-            oracion_lower = oracion.lower()
-            if any(palabra in oracion_lower for palabra in palabras_cientificas):
-                debe_citar = True
+            partes.append(oracion)
             
-            # También citar cada 2-3 oraciones para mantener respaldo científico
-            if (i + 1) % 2 == 0 and len(oraciones) > 3:
-                debe_citar = True
-            
-            # Agregar cita si corresponde
-            if debe_citar and contador_citas <= len(articulos):
-                # Seleccionar artículo más relevante disponible
-                articulo_seleccionado = articulos[contador_citas - 1]
-                numero_ref = mapa_referencias[articulo_seleccionado['pmid']]
-                
-                # Agregar cita en formato APA (Autor, año)
-                cita_autor_año = f"({articulo_seleccionado['autor'].split(',')[0]}, {articulo_seleccionado['año']})"
-                texto_citado += f" {cita_autor_año}"
-                
-                if articulo_seleccionado not in referencias_usadas:
-                    referencias_usadas.append(articulo_seleccionado)
-                
-                contador_citas += 1
+            # Agregar cita en formato APA (Autor, año)
+            articulo = citas.get(i)
+            if articulo is not None:
+                partes.append(f" ({articulo['autor'].split(',')[0]}, {articulo['año']})")
+                if articulo['pmid'] not in pmids_usados:
+                    pmids_usados.add(articulo['pmid'])
+                    referencias_usadas.append(articulo)
             
             # Agregar punto final si no lo tiene
-            if not texto_citado.endswith(('.', '!', '?')):
-                texto_citado += "."
+            if not partes[-1].endswith(('.', '!', '?')):
+                partes.append(".")
             
             # Agregar espacio para la siguiente oración
             if i < len(oraciones) - 1:
-                texto_citado += " "
+                partes.append(" ")
         
-        return texto_citado, referencias_usadas
+        return "".join(partes), referencias_usadas
         
     except Exception as e:
         print(f"Error en integrar_citas_en_texto: {e}")
         return texto, []
 
-def generar_lista_referencias(referencias):
-    """Genera la lista de referencias en formato APA"""
+def generar_lista_referencias(referencias):
+    """Genera la lista de referencias en formato APA"""
+    try:
+        if not referencias:
+            return ""
+        
+        lista_referencias = "\n\n**REFERENCIAS:**\n\n"
+        
+        for i, ref in enumerate(referencias, 1):
+            lista_referencias += f"{i}. {ref['cita_apa']}\n\n"
+        
+        return lista_referencias
+        
+    except Exception as e:
+        print(f"Error en generar_lista_referencias: {e}")
+        return ""
+
+# =========================
+# COLA DE TRABAJOS
+# =========================
+
+class ColaTrabajos:
+    """Cola de trabajos durable en SQLite con un pool acotado de hilos que la procesa"""
+    
+    def __init__(self, ruta_db, n_workers, lease, max_intentos, retencion):
+        self.ruta_db = ruta_db
+        self.n_workers = n_workers
+        self.lease = lease
+        self.max_intentos = max_intentos
+        self.retencion = retencion
+        self._procesadores = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._aviso = threading.Condition()
+        self._pid = None
+        self._hilos = []
+        self._parar = threading.Event()
+    
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(self.ruta_db, timeout=10, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, tipo TEXT NOT NULL, estado TEXT NOT NULL, entrada TEXT NOT NULL, "
+                "resultado TEXT, error TEXT, intentos INTEGER NOT NULL DEFAULT 0, "
+                "creado REAL NOT NULL, actualizado REAL NOT NULL)"
+            )
+            conexion.execute("CREATE INDEX IF NOT EXISTS idx_jobs_estado ON jobs (estado, creado)")
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+    
+    def registrar(self, tipo, procesador):
+        """Asocia un tipo de trabajo con la función que lo ejecuta (recibe la entrada, devuelve el resultado)"""
+        self._procesadores[tipo] = procesador
+    
+    def iniciar(self):
+        """Arranca los hilos del proceso actual si aún no existen (también tras un fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._parar = threading.Event()
+            self._hilos = [
+                threading.Thread(target=self._bucle, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.n_workers)
+            ]
+            for hilo in self._hilos:
+                hilo.start()
+    
+    def detener(self, timeout=None):
+        """Para los hilos del proceso cuando acaben su trabajo en curso (lo que quede lo retoma otro worker)"""
+        if self._pid != os.getpid():
+            return
+        self._parar.set()
+        with self._aviso:
+            self._aviso.notify_all()
+        limite = time.time() + timeout if timeout is not None else None
+        for hilo in self._hilos:
+            hilo.join(None if limite is None else max(0.0, limite - time.time()))
+    
+    def encolar(self, tipo, entrada):
+        """Guarda el trabajo y devuelve su id"""
+        self.iniciar()
+        job_id = uuid.uuid4().hex
+        ahora = time.time()
+        self._conexion().execute(
+            "INSERT INTO jobs (id, tipo, estado, entrada, creado, actualizado) VALUES (?, ?, 'pendiente', ?, ?, ?)",
+            (job_id, tipo, json.dumps(entrada, ensure_ascii=False), ahora, ahora)
+        )
+        with self._aviso:
+            self._aviso.notify()
+        return job_id
+    
+    def consultar(self, job_id):
+        """Estado (y resultado si terminó) de un trabajo; None si no existe"""
+        fila = self._conexion().execute(
+            "SELECT id, estado, resultado, error, intentos, creado, actualizado FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if fila is None:
+            return None
+        trabajo = {
+            "job_id": fila[0],
+            "estado": fila[1],
+            "intentos": fila[4],
+            "creado": fila[5],
+            "actualizado": fila[6]
+        }
+        if fila[2] is not None:
+            trabajo["resultado"] = json.loads(fila[2])
+        if fila[3]:
+            trabajo["error"] = fila[3]
+        return trabajo
+    
+    def _reclamar(self):
+        """Toma el trabajo pendiente más antiguo (o uno abandonado por un worker caído)"""
+        conexion = self._conexion()
+        ahora = time.time()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conexion.execute(
+                "SELECT id, tipo, entrada, intentos FROM jobs "
+                "WHERE estado = 'pendiente' OR (estado = 'en_proceso' AND actualizado < ?) "
+                "ORDER BY creado LIMIT 1",
+                (ahora - self.lease,)
+            ).fetchone()
+            if fila is not None:
+                conexion.execute(
+                    "UPDATE jobs SET estado = 'en_proceso', intentos = intentos + 1, actualizado = ? WHERE id = ?",
+                    (ahora, fila[0])
+                )
+            conexion.execute("COMMIT")
+            return fila
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+    
+    def _terminar(self, job_id, estado, resultado=None, error=None):
+        self._conexion().execute(
+            "UPDATE jobs SET estado = ?, resultado = ?, error = ?, actualizado = ? WHERE id = ?",
+            (estado, json.dumps(resultado, ensure_ascii=False) if resultado is not None else None, error, time.time(), job_id)
+        )
+    
+    def _purgar(self):
+        self._conexion().execute(
+            "DELETE FROM jobs WHERE estado IN ('completado', 'error') AND actualizado < ?",
+            (time.time() - self.retencion,)
+        )
+    
+    def _bucle(self):
+        ultima_purga = 0
+        while not self._parar.is_set():
+            try:
+                if time.time() - ultima_purga > 3600:
+                    self._purgar()
+                    ultima_purga = time.time()
+                
+                fila = self._reclamar()
+                if fila is None:
+                    # Sin trabajo: esperar aviso local o sondear (otros procesos también encolan)
+                    with self._aviso:
+                        self._aviso.wait(timeout=2)
+                    continue
+                
+                job_id, tipo, entrada, intentos = fila
+                if intentos + 1 > self.max_intentos:
+                    self._terminar(job_id, "error", error="Se superó el número máximo de intentos")
+                    continue
+                
+                try:
+                    resultado = self._procesadores[tipo](json.loads(entrada))
+                    self._terminar(job_id, "completado", resultado=resultado)
+                except Exception as e:
+                    print(f"Error procesando job {job_id}: {e}")
+                    self._terminar(job_id, "error", error=str(e))
+            
+            except sqlite3.Error as e:
+                print(f"Error en la cola de trabajos: {e}")
+                time.sleep(1)
+
+cola_trabajos = ColaTrabajos(JOBS_DB, JOBS_WORKERS, JOBS_LEASE, JOBS_MAX_INTENTOS, JOBS_RETENCION)
+
+# =========================
+# PIPELINE ASÍNCRONO
+# =========================
+
+class BucleAsync:
+    """Event loop en un hilo propio, compartido por todas las peticiones del proceso"""
+    
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def loop(self):
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="bucle-async", daemon=True).start()
+                    self._loop = loop
+                    self._pid = os.getpid()
+        return self._loop
+
+bucle_async = BucleAsync()
+
+def ejecutar_en_bucle_async(corrutina):
+    """Ejecuta la corrutina en el bucle compartido y devuelve un awaitable para el bucle que llama"""
+    return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(corrutina, bucle_async.loop()))
+
+class ClienteEutilsAsync:
+    """Equivalente asíncrono de ClienteEutils (httpx) con pool keep-alive, gzip y reintentos"""
+    
+    _ESTADOS_REINTENTO = ESTADOS_REINTENTO_NCBI
+    
+    def __init__(self, base_url, pool_maxsize, reintentos, backoff, timeout_conexion):
+        self.base_url = base_url
+        self.pool_maxsize = pool_maxsize
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.timeout_conexion = timeout_conexion
+        self._cliente = None
+    
+    def _cliente_http(self):
+        # Solo se usa desde el bucle compartido, así que no necesita lock
+        if self._cliente is None:
+            self._cliente = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize),
+                headers={"Accept-Encoding": "gzip, deflate"}
+            )
+        return self._cliente
+    
+    async def _solicitar(self, metodo, endpoint, timeout, **kwargs):
+        if endpoint in HEDGE_ENDPOINTS:
+            cupo_hedges.contar()
+        retraso = retraso_hedge(endpoint)
+        if retraso is None:
+            return await self._solicitar_una(metodo, endpoint, timeout, **kwargs)
+        
+        # Hedging: si tarda más que el p95, otra petición idéntica; la que pierde se cancela
+        principal = ganadora = asyncio.ensure_future(self._solicitar_una(metodo, endpoint, timeout, **kwargs))
+        tareas = {principal}
+        try:
+            hechas, _ = await asyncio.wait(tareas, timeout=retraso)
+            if hechas:
+                return await principal
+            if not permitir_hedge(endpoint):
+                metrica_hedges.labels(endpoint=endpoint.split(".", 1)[0], resultado="omitido").inc()
+                return await principal
+            duplicada = asyncio.ensure_future(self._solicitar_una(metodo, endpoint, timeout, **kwargs))
+            tareas.add(duplicada)
+            pendientes = set(tareas)
+            error = None
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    if tarea.exception() is None:
+                        resultado = "gana" if tarea is duplicada else "pierde"
+                        metrica_hedges.labels(endpoint=endpoint.split(".", 1)[0], resultado=resultado).inc()
+                        ganadora = tarea
+                        return tarea.result()
+                    error = error or tarea.exception()
+            metrica_hedges.labels(endpoint=endpoint.split(".", 1)[0], resultado="error").inc()
+            raise error
+        finally:
+            for tarea in tareas:
+                if tarea is not ganadora:
+                    if not tarea.done():
+                        tarea.cancel()
+                    tarea.add_done_callback(descartar_respuesta)
+    
+    async def _solicitar_una(self, metodo, endpoint, timeout, **kwargs):
+        """Una petición con sus reintentos, protegida por el circuit breaker del endpoint"""
+        circuito = circuito_ncbi(endpoint)
+        circuito.permitir()
+        try:
+            response = await self._solicitar_con_reintentos(metodo, endpoint, timeout, **kwargs)
+        except (PlazoAgotado, asyncio.CancelledError):
+            circuito.liberar()
+            raise
+        except Exception:
+            circuito.registrar(False)
+            raise
+        circuito.registrar(response.status_code not in ESTADOS_REINTENTO_NCBI)
+        return response
+    
+    async def _solicitar_con_reintentos(self, metodo, endpoint, timeout, stream=False, **kwargs):
+        url = f"{self.base_url}/{endpoint}"
+        intento = 0
+        inicio = time.perf_counter()
+        while True:
+            contador_conexiones.sumar("peticiones")
+            espera = limitador_ncbi.reservar(max_espera=tiempo_restante())
+            if espera is None:
+                raise agotar_plazo()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            timeout_intento = limitar_timeout(timeout)
+            inicio_intento = time.perf_counter()
+            try:
+                cliente = self._cliente_http()
+                peticion = cliente.build_request(
+                    metodo, url, timeout=httpx.Timeout(timeout_intento, connect=min(self.timeout_conexion, timeout_intento)), **kwargs
+                )
+                # wait_for cancela la llamada en curso si se acaba el plazo de la petición; con stream=True
+                # solo espera a las cabeceras y el cuerpo lo lee quien llama (y cierra la respuesta)
+                response = await asyncio.wait_for(cliente.send(peticion, stream=stream), timeout_intento)
+                if response.status_code == 200:
+                    # Para el p95 solo la ida y vuelta, sin la espera del limitador ni los reintentos
+                    latencias_ncbi.registrar(endpoint, time.perf_counter() - inicio_intento)
+                if response.status_code not in self._ESTADOS_REINTENTO or intento >= self.reintentos:
+                    registrar_llamada_ncbi(endpoint, inicio, response.status_code)
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                pausa = float(retry_after) if retry_after.isdigit() else self.backoff * (2 ** intento)
+                await response.aclose()
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                contador_conexiones.sumar("errores")
+                if plazo_vencido():
+                    registrar_llamada_ncbi(endpoint, inicio)
+                    raise agotar_plazo()
+                if intento >= self.reintentos:
+                    registrar_llamada_ncbi(endpoint, inicio)
+                    raise
+                pausa = self.backoff * (2 ** intento)
+            intento += 1
+            restante = tiempo_restante()
+            if restante is not None and pausa >= restante:
+                raise agotar_plazo()
+            await asyncio.sleep(pausa)
+    
+    async def get(self, endpoint, params, timeout):
+        return await self._solicitar("GET", endpoint, timeout, params=params)
+    
+    async def post(self, endpoint, data, timeout, stream=False):
+        return await self._solicitar("POST", endpoint, timeout, data=data, stream=stream)
+
+cliente_eutils_async = ClienteEutilsAsync(
+    EUTILS_BASE_URL,
+    EUTILS_POOL_MAXSIZE,
+    EUTILS_REINTENTOS,
+    EUTILS_BACKOFF,
+    EUTILS_TIMEOUT_CONEXION
+) if ASYNC_DISPONIBLE else None
+
+async def obtener_mesh_relacionados_async(termino):
+    """Versión asíncrona de obtener_mesh_relacionados"""
+    locales = mesh_relacionados_locales(termino)
+    if locales is not None:
+        return locales
+    
+    mesh_relacionados = []
+    try:
+        params = {
+            "db": "mesh",
+            "term": f"{termino}[MH]",
+            "retmode": "json",
+            "retmax": 5,
+            "api_key": PUBMED_API_KEY
+        }
+        response = await cliente_eutils_async.get("esearch.fcgi", params, timeout=10)
+        if response.status_code == 200:
+            mesh_ids = response.json().get("esearchresult", {}).get("idlist", [])
+            if mesh_ids:
+                summary_params = {
+                    "db": "mesh",
+                    "id": ",".join(mesh_ids),
+                    "retmode": "json",
+                    "api_key": PUBMED_API_KEY
+                }
+                s_response = await cliente_eutils_async.get("esummary.fcgi", summary_params, timeout=10)
+                if s_response.status_code == 200:
+                    s_data = s_response.json()
+                    for mesh_id in mesh_ids:
+                        mesh_term = s_data.get("result", {}).get(mesh_id, {}).get("ds_meshterms", [""])[0]
+                        if mesh_term:
+                            mesh_relacionados.append(mesh_term)
+    
+    except Exception as e:
+        print(f"Error obteniendo MeSH relacionados (async): {e}")
+    
+    return mesh_relacionados
+
+async def esearch_pubmed_async(query, sort_order, retmax, historial=None):
+    """Versión asíncrona de esearch_pubmed"""
+    response = await cliente_eutils_async.post("esearch.fcgi", params_esearch(query, sort_order, retmax, historial), timeout=20)
+    if response.status_code != 200:
+        raise RuntimeError(f"esearch devolvió HTTP {response.status_code}")
+    
+    return leer_resultado_esearch(response.json())
+
+async def realizar_busqueda_pubmed_async(query, sort_order, max_results, historial=None):
+    """Versión asíncrona de realizar_busqueda_pubmed (comparte la caché de búsquedas)"""
+    try:
+        retmax = max_results * 3
+        locales = buscar_en_espejo(query, sort_order, retmax)
+        if locales is not None:
+            return ResultadoBusqueda(locales)
+        
+        clave = (" ".join(query.split()), sort_order, retmax)
+        if historial is not None and historial.webenv:
+            try:
+                return await cache_busquedas.obtener_async(clave, lambda: esearch_pubmed_async(query, sort_order, retmax, historial))
+            except (PlazoAgotado, CircuitoAbierto):
+                raise
+            except Exception as e:
+                print(f"Error reutilizando el historial de esearch (async): {e}")
+        return await cache_busquedas.obtener_async(clave, lambda: esearch_pubmed_async(query, sort_order, retmax))
+    
+    except Exception as e:
+        print(f"Error en realizar_busqueda_pubmed_async: {e}")
+        marcar_degradado()
+        return busqueda_obsoleta(query, sort_order, max_results * 3)
+
+async def efetch_lote_async(lote, params):
+    """Versión asíncrona de efetch_lote"""
+    fetch_response = await cliente_eutils_async.post("efetch.fcgi", {**params, "retmode": "xml"}, timeout=30, stream=True)
+    descargados = {}
+    try:
+        if fetch_response.status_code == 200:
+            descargados = await metadatos_efetch_async(lote, fetch_response)
+    finally:
+        await fetch_response.aclose()
+    
+    pendientes = [pmid for pmid in lote if pmid not in descargados]
+    if pendientes and "WebEnv" in params:
+        descargados.update(await efetch_lote_async(pendientes, params_por_ids(pendientes)))
+    elif fetch_response.status_code != 200:
+        raise RuntimeError(f"efetch devolvió HTTP {fetch_response.status_code}")
+    return descargados
+
+async def esummary_lote_async(lote, params):
+    """Versión asíncrona de esummary_lote"""
+    response = await cliente_eutils_async.post("esummary.fcgi", {**params, "retmode": "json"}, timeout=20)
+    resumenes = extraer_resumenes(lote, response.json()) if response.status_code == 200 else {}
+    
+    pendientes = [pmid for pmid in lote if pmid not in resumenes]
+    if pendientes and "WebEnv" in params:
+        resumenes.update(await esummary_lote_async(pendientes, params_por_ids(pendientes)))
+    elif response.status_code != 200:
+        raise RuntimeError(f"esummary devolvió HTTP {response.status_code}")
+    return resumenes
+
+async def obtener_articulos_lote_async(pmids, concurrencia=ASYNC_CONCURRENCIA, busqueda=None):
+    """Versión asíncrona de obtener_articulos_lote: descarga los lotes en paralelo con un límite"""
+    pmids = [str(pmid) for pmid in pmids]
+    metadatos = obtener_articulos_locales(pmids)
+    faltantes = [pmid for pmid in pmids if pmid not in metadatos]
+    semaforo = asyncio.Semaphore(concurrencia)
+    
+    async def descargar_lote(lote, params):
+        async with semaforo:
+            try:
+                return await efetch_lote_async(lote, params)
+            except Exception as e:
+                print(f"Error obteniendo lote de artículos (async): {e}")
+                marcar_degradado()
+                return {}
+    
+    descargados = {}
+    peticiones = planificar_descarga(faltantes, busqueda)
+    for resultado in await asyncio.gather(*(descargar_lote(lote, params) for lote, params in peticiones)):
+        descargados.update(resultado)
+    
+    cache_articulos.guardar_muchos(descargados)
+    metadatos.update(descargados)
+    metadatos.update(articulos_obsoletos([pmid for pmid in faltantes if pmid not in descargados]))
+    return metadatos
+
+async def obtener_resumenes_lote_async(pmids, busqueda=None):
+    """Versión asíncrona de obtener_resumenes_lote (lotes en paralelo)"""
     try:
-        if not referencias:
-            return ""
+        resumenes = {}
+        peticiones = planificar_descarga(pmids, busqueda)
+        for resultado in await asyncio.gather(*(esummary_lote_async(lote, params) for lote, params in peticiones)):
+            resumenes.update(resultado)
+        return resumenes
+    except Exception as e:
+        print(f"Error obteniendo resúmenes para el cribado (async): {e}")
+        return None
+
+async def seleccionar_articulos_en_dos_fases_async(pmids, mesh_terms, keywords, conceptos_texto, max_results, busqueda=None):
+    """Versión asíncrona de seleccionar_articulos_en_dos_fases"""
+    locales = obtener_articulos_locales(pmids)
+    aceptados = puntuar_articulos_lote(
+        [locales[pmid] for pmid in pmids if pmid in locales], mesh_terms, keywords, conceptos_texto
+    )
+    faltantes = [pmid for pmid in pmids if pmid not in locales]
+    
+    if faltantes and len(aceptados) < max_results:
+        resumenes = await obtener_resumenes_lote_async(faltantes, busqueda)
+        if resumenes is None:
+            orden, tamano = faltantes, len(faltantes)
+        else:
+            orden, tamano = ordenar_por_prepuntuacion(faltantes, resumenes, mesh_terms, keywords, conceptos_texto), max_results
         
-        lista_referencias = "\n\n**REFERENCIAS:**\n\n"
+        for inicio in range(0, len(orden), tamano):
+            if plazo_vencido():
+                break
+            lote = orden[inicio:inicio + tamano]
+            with medir_etapa("efetch"):
+                metadatos = await obtener_articulos_lote_async(lote)
+            aceptados.extend(puntuar_articulos_lote(
+                [metadatos[pmid] for pmid in lote if pmid in metadatos], mesh_terms, keywords, conceptos_texto
+            ))
+            if len(aceptados) >= max_results:
+                metrica_articulos_cribados.inc(len(orden) - inicio - len(lote))
+                break
+    
+    return ordenar_seleccion(aceptados, pmids, max_results)
+
+async def buscar_articulos_mesh_avanzado_async(mesh_terms, keywords, conceptos_texto, max_results=5):
+    """Versión asíncrona de buscar_articulos_mesh_avanzado con etapas concurrentes"""
+    try:
+        # 1. Expansión MeSH de los términos principales en paralelo
+        mesh_expandidos = set(mesh_terms)
+        with medir_etapa("expansion_mesh"):
+            for relacionados in await asyncio.gather(*(obtener_mesh_relacionados_async(t) for t in mesh_terms[:2])):
+                mesh_expandidos.update(relacionados[:2])
         
-        for i, ref in enumerate(referencias, 1):
-            lista_referencias += f"{i}. {ref['cita_apa']}\n\n"
+        query_completa = construir_query_avanzada(mesh_expandidos, keywords, conceptos_texto)
         
-        return lista_referencias
+        # 2. Búsqueda por relevancia; la de fecha solo si faltan resultados y reordenando en NCBI la ya evaluada
+        with medir_etapa("esearch"):
+            busqueda = await realizar_busqueda_pubmed_async(query_completa, "relevance", max_results)
+            resultados_combinados = list(busqueda.pmids)
+            if len(resultados_combinados) < max_results:
+                busqueda_fecha = await realizar_busqueda_pubmed_async(
+                    query_completa, "pub_date", max_results - len(resultados_combinados), historial=busqueda
+                )
+                resultados_combinados.extend(busqueda_fecha.pmids)
         
+        # 3. Descarga concurrente por lotes y scoring
+        pmids_unicos = list(dict.fromkeys(resultados_combinados))
+        if CRIBADO_DOS_FASES:
+            return await seleccionar_articulos_en_dos_fases_async(
+                pmids_unicos, mesh_terms, keywords, conceptos_texto, max_results, busqueda
+            )
+        with medir_etapa("efetch"):
+            metadatos = await obtener_articulos_lote_async(pmids_unicos, busqueda=busqueda)
+        return seleccionar_articulos(pmids_unicos, metadatos, mesh_terms, keywords, conceptos_texto, max_results)
+    
     except Exception as e:
-        print(f"Error en generar_lista_referencias: {e}")
-        return ""
+        print(f"Error en buscar_articulos_mesh_avanzado_async: {e}")
+        return []
 
 # =========================
 # ENDPOINTS
 # =========================
 
+@app.before_request
+def registrar_inicio_peticion():
+    """Suma la petición al gauge de peticiones en curso de su endpoint"""
+    g.endpoint_metricas = request.endpoint or "desconocido"
+    metrica_peticiones_en_curso.labels(endpoint=g.endpoint_metricas).inc()
+
+@app.teardown_request
+def registrar_fin_peticion(error=None):
+    """Resta la petición del gauge (en streaming, al terminar de enviar la respuesta)"""
+    endpoint = g.pop("endpoint_metricas", None)
+    if endpoint is not None:
+        metrica_peticiones_en_curso.labels(endpoint=endpoint).dec()
+
+def validar_texto_entrada(data):
+    """Valida el JSON de /citar_texto; devuelve (texto, None) o (None, (respuesta, status))"""
+    if not data or 'texto' not in data:
+        return None, ({
+            "error": "Se requiere el campo 'texto' en el JSON"
+        }, 400)
+    
+    texto_original = data['texto'].strip()
+    
+    if not texto_original:
+        return None, ({
+            "error": "El texto no puede estar vacío"
+        }, 400)
+    
+    if len(texto_original) > 5000:
+        return None, ({
+            "error": "Texto demasiado largo (máximo 5000 caracteres)"
+        }, 400)
+    
+    return texto_original, None
+
+def construir_respuesta_citas(texto_original, conceptos_info, articulos, parcial=False):
+    """Integra las citas y arma el JSON de respuesta de /citar_texto"""
+    if not articulos:
+        return {
+            "texto_original": texto_original,
+            "texto_citado": texto_original,
+            "conceptos_detectados": conceptos_info['conceptos'],
+            "numero_articulos": 0,
+            "referencias": "",
+            "mensaje": "No se encontraron artículos científicos para este tema",
+            "parcial": parcial
+        }
+    
+    # 3. Integrar citas en el texto
+    texto_citado, referencias_usadas = integrar_citas_en_texto(texto_original, articulos)
+    
+    # 4. Generar lista de referencias
+    lista_referencias = generar_lista_referencias(referencias_usadas)
+    
+    # 5. Combinar texto citado con referencias
+    resultado_final = texto_citado + lista_referencias
+    
+    return {
+        "texto_original": texto_original,
+        "texto_citado": resultado_final,
+        "conceptos_detectados": conceptos_info['conceptos'],
+        "numero_articulos": len(referencias_usadas),
+        "referencias": lista_referencias,
+        "articulos_utilizados": [
+            {
+                "autor": art['autor'],
+                "año": art['año'],
+                "titulo": art['titulo'],
+                "journal": art['journal'],
+                "url": art['url']
+            }
+            for art in referencias_usadas
+        ],
+        "parcial": parcial
+    }
+
+def formato_streaming():
+    """'ndjson' o 'sse' si el cliente pidió respuesta en streaming (?stream= o cabecera Accept)"""
+    formato = request.args.get('stream', '').lower()
+    if formato in ('ndjson', 'sse'):
+        return formato
+    aceptado = request.headers.get('Accept', '')
+    if 'text/event-stream' in aceptado:
+        return 'sse'
+    if 'application/x-ndjson' in aceptado:
+        return 'ndjson'
+    return None
+
+def serializar_evento(formato, evento, datos):
+    """Una línea NDJSON o un evento SSE"""
+    cuerpo = json.dumps({"evento": evento, **datos}, ensure_ascii=False)
+    if formato == 'sse':
+        return f"event: {evento}\ndata: {cuerpo}\n\n"
+    return cuerpo + "\n"
+
+def respuesta_desde_cache(clave, cache_control):
+    """Respuesta cacheada, o 304 si el cliente ya tiene esa versión (If-None-Match); None si no está"""
+    cacheada = cache_respuestas.obtener(clave)
+    if cacheada is None:
+        return None
+    cuerpo, etag = cacheada
+    if request.if_none_match.contains_weak(etag):
+        respuesta = Response(status=304)
+    else:
+        respuesta = Response(cuerpo, mimetype="application/json")
+    respuesta.set_etag(etag)
+    respuesta.headers["Cache-Control"] = cache_control
+    return respuesta
+
+def respuesta_cacheable(clave, datos, cache_control, cacheable, incompleta):
+    """jsonify de la respuesta; si es cacheable y no incompleta la guarda en la caché de respuestas y la sirve con su ETag.
+    Si es incompleta (NCBI falló o se agotó el plazo) y hay una versión anterior caducada, sirve esa"""
+    if incompleta:
+        obsoleta = cache_respuestas.obtener_obsoleta(clave, CACHE_GRACIA_OBSOLETOS)
+        if obsoleta is not None:
+            metrica_obsoletos_servidos.labels(cache="respuestas").inc()
+            respuesta = Response(obsoleta[0], mimetype="application/json")
+            respuesta.set_etag(obsoleta[1])
+            respuesta.headers["Cache-Control"] = "no-cache"
+            respuesta.headers["Warning"] = '110 - "Response is Stale"'
+            return respuesta
+    
+    respuesta = jsonify(datos)
+    if not cacheable or incompleta:
+        respuesta.headers["Cache-Control"] = "no-store"
+        return respuesta
+    respuesta.set_etag(cache_respuestas.guardar(clave, respuesta.get_data()))
+    respuesta.headers["Cache-Control"] = cache_control
+    return respuesta
+
+# /buscar es un GET cacheable por clientes y proxies; /citar_texto (POST) se revalida siempre con el ETag
+CACHE_CONTROL_BUSCAR = f"public, max-age={CACHE_RESPUESTAS_MAX_AGE}"
+CACHE_CONTROL_CITAR = "private, no-cache"
+
+def leer_presupuesto():
+    """Segundos de presupuesto de la petición: cabecera X-Presupuesto-Ms o PRESUPUESTO_PETICION"""
+    segundos = PRESUPUESTO_PETICION
+    try:
+        pedido = float(request.headers.get("X-Presupuesto-Ms", "")) / 1000
+        if pedido > 0:
+            segundos = pedido
+    except ValueError:
+        pass
+    if segundos and PRESUPUESTO_PETICION_MAX > 0:
+        segundos = min(segundos, PRESUPUESTO_PETICION_MAX)
+    return segundos
+
+def leer_max_results(valor):
+    """Valida el parámetro max_results; devuelve (n, None) o (None, mensaje de error)"""
+    if valor is None or valor == "":
+        return 5, None
+    if isinstance(valor, float) and not valor.is_integer():
+        return None, "'max_results' debe ser un número entero"
+    try:
+        n = int(valor)
+    except (TypeError, ValueError):
+        return None, "'max_results' debe ser un número entero"
+    if isinstance(valor, bool) or not 1 <= n <= MAX_RESULTADOS_MAX:
+        return None, f"'max_results' debe estar entre 1 y {MAX_RESULTADOS_MAX}"
+    return n, None
+
+def eventos_citar_texto(texto_original, max_results=5, presupuesto=None):
+    """Pipeline de /citar_texto como generador de eventos (conceptos, articulo..., resultado)"""
+    with plazo_peticion(presupuesto):
+        yield from _eventos_citar_texto(texto_original, max_results)
+
+def _eventos_citar_texto(texto_original, max_results):
+    conceptos_info = detectar_conceptos_mesh_decs(texto_original)
+    yield "conceptos", {
+        "conceptos_detectados": conceptos_info['conceptos'],
+        "mesh_terms": conceptos_info['mesh_terms']
+    }
+    
+    articulos = []
+    pmids = []
+    try:
+        pmids, busqueda = buscar_candidatos(
+            conceptos_info['mesh_terms'], conceptos_info['keywords'], conceptos_info['conceptos'], max_results
+        )
+        # El mismo cribado que el modo normal, en lotes pequeños para emitir antes los primeros artículos
+        if CRIBADO_DOS_FASES:
+            puntuados = iterar_articulos_cribados(
+                pmids, conceptos_info['mesh_terms'], conceptos_info['keywords'], conceptos_info['conceptos'],
+                max_results, busqueda, tamano_lote=TAMANO_LOTE_STREAMING
+            )
+        else:
+            puntuados = iterar_articulos_puntuados(
+                pmids, conceptos_info['mesh_terms'], conceptos_info['keywords'], conceptos_info['conceptos']
+            )
+        for articulo in puntuados:
+            articulos.append(articulo)
+            yield "articulo", {
+                "articulo": {
+                    "pmid": articulo['pmid'],
+                    "autor": articulo['autor'],
+                    "año": articulo['año'],
+                    "titulo": articulo['titulo'],
+                    "journal": articulo['journal'],
+                    "url": articulo['url'],
+                    "relevance_score": articulo['relevance_score']
+                }
+            }
+    except Exception as e:
+        print(f"Error en eventos_citar_texto: {e}")
+    
+    # Mismo orden que el modo normal: score descendente y, a igualdad, el orden de la búsqueda
+    yield "resultado", construir_respuesta_citas(
+        texto_original, conceptos_info, ordenar_seleccion(articulos, pmids, max_results), resultado_parcial()
+    )
+
+def respuesta_streaming(formato, eventos):
+    """Response de Flask que escribe cada evento en cuanto se produce"""
+    def generar():
+        try:
+            for evento, datos in eventos:
+                yield serializar_evento(formato, evento, datos)
+        except Exception as e:
+            print(f"Error en streaming: {e}")
+            yield serializar_evento(formato, "error", {"error": "Error interno del servidor", "detalle": str(e)})
+    
+    mimetype = 'text/event-stream' if formato == 'sse' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generar()),
+        mimetype=mimetype,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/citar_texto", methods=["POST"])
 def citar_texto():
     """
     Endpoint principal para citar texto automáticamente
     Recibe texto y devuelve el mismo texto con citas integradas + lista de referencias
+    Con ?stream=ndjson o ?stream=sse envía los resultados por etapas
+    Con ?modo=job encola el trabajo y responde al instante con el id para consultar en /jobs/<id>
     """
     try:
         data = request.get_json()
+        texto_original, error = validar_texto_entrada(data)
+        if error:
+            return jsonify(error[0]), error[1]
         
-        if not data or 'texto' not in data:
-            return jsonify({
-                "error": "Se requiere el campo 'texto' en el JSON"
-            }), 400
+        max_results, error = leer_max_results(data.get('max_results', request.args.get('max_results')))
+        if error:
+            return jsonify({"error": error}), 400
         
-        texto_original = data['texto'].strip()
+        formato = formato_streaming()
+        if formato:
+            return respuesta_streaming(formato, eventos_citar_texto(texto_original, max_results, leer_presupuesto()))
         
-        if not texto_original:
+        if request.args.get('modo') == 'job':
+            job_id = cola_trabajos.encolar("citar_texto", {"texto": texto_original, "max_results": max_results})
             return jsonify({
-                "error": "El texto no puede estar vacío"
-            }), 400
+                "job_id": job_id,
+                "estado": "pendiente",
+                "url": f"/jobs/{job_id}"
+            }), 202, {"Location": f"/jobs/{job_id}"}
         
-        if len(texto_original) > 5000:
-            return jsonify({
-                "error": "Texto demasiado largo (máximo 5000 caracteres)"
-            }), 400
+        clave = clave_respuesta("citar_texto", texto_original, max_results)
+        cacheada = respuesta_desde_cache(clave, CACHE_CONTROL_CITAR)
+        if cacheada is not None:
+            return cacheada
         
         print(f"Procesando texto de {len(texto_original)} caracteres")
         
-        # 1. Detectar conceptos y mapear a MeSH/DeCS
-        conceptos_info = detectar_conceptos_mesh_decs(texto_original)
-        print(f"Conceptos detectados: {conceptos_info['conceptos']}")
-        print(f"Términos MeSH: {conceptos_info['mesh_terms']}")
-        
-        # 2. Buscar artículos científicos usando búsqueda avanzada MeSH
-        articulos = buscar_articulos_mesh_avanzado(
-            conceptos_info['mesh_terms'], 
-            conceptos_info['keywords'],
-            conceptos_info['conceptos'],
-            max_results=5
-        )
-        print(f"Artículos encontrados: {len(articulos)}")
-        
-        if not articulos:
-            return jsonify({
-                "texto_original": texto_original,
-                "texto_citado": texto_original,
-                "conceptos_detectados": conceptos_info['conceptos'],
-                "numero_articulos": 0,
-                "referencias": "",
-                "mensaje": "No se encontraron artículos científicos para este tema"
-            })
+        with plazo_peticion(leer_presupuesto()):
+            # 1. Detectar conceptos y mapear a MeSH/DeCS
+            conceptos_info = detectar_conceptos_mesh_decs(texto_original)
+            print(f"Conceptos detectados: {conceptos_info['conceptos']}")
+            print(f"Términos MeSH: {conceptos_info['mesh_terms']}")
+            
+            # 2. Buscar artículos científicos usando búsqueda avanzada MeSH (lo mejor puntuado si se acaba el plazo)
+            articulos = buscar_articulos_mesh_avanzado(
+                conceptos_info['mesh_terms'], 
+                conceptos_info['keywords'],
+                conceptos_info['conceptos'],
+                max_results=max_results
+            )
+            parcial = resultado_parcial()
+            degradada = respuesta_degradada()
+        print(f"Artículos encontrados: {len(articulos)}{' (parcial)' if parcial else ''}")
         
-        # 3. Integrar citas en el texto
-        texto_citado, referencias_usadas = integrar_citas_en_texto(texto_original, articulos)
+        return respuesta_cacheable(
+            clave, construir_respuesta_citas(texto_original, conceptos_info, articulos, parcial),
+            CACHE_CONTROL_CITAR, bool(articulos), parcial or degradada
+        ), 200
+    
+    except Exception as e:
+        print(f"Error en citar_texto: {e}")
+        return jsonify({
+            "error": "Error interno del servidor",
+            "detalle": str(e)
+        }), 500
+
+async def citar_texto_async():
+    """Versión asíncrona de /citar_texto (se activa con PIPELINE_ASYNC=1)"""
+    try:
+        data = request.get_json()
+        texto_original, error = validar_texto_entrada(data)
+        if error:
+            return jsonify(error[0]), error[1]
         
-        # 4. Generar lista de referencias
-        lista_referencias = generar_lista_referencias(referencias_usadas)
+        max_results, error = leer_max_results(data.get('max_results', request.args.get('max_results')))
+        if error:
+            return jsonify({"error": error}), 400
         
-        # 5. Combinar texto citado con referencias
-        resultado_final = texto_citado + lista_referencias
+        clave = clave_respuesta("citar_texto", texto_original, max_results)
+        cacheada = respuesta_desde_cache(clave, CACHE_CONTROL_CITAR)
+        if cacheada is not None:
+            return cacheada
         
-        response = {
-            "texto_original": texto_original,
-            "texto_citado": resultado_final,
-            "conceptos_detectados": conceptos_info['conceptos'],
-            "numero_articulos": len(referencias_usadas),
-            "referencias": lista_referencias,
-            "articulos_utilizados": [
-                {
-                    "autor": art['autor'],
-                    "año": art['año'],
-                    "titulo": art['titulo'],
-                    "journal": art['journal'],
-                    "url": art['url']
-                }
-                for art in referencias_usadas
-            ]
-        }
+        print(f"Procesando texto de {len(texto_original)} caracteres (async)")
+        with plazo_peticion(leer_presupuesto()):
+            conceptos_info = detectar_conceptos_mesh_decs(texto_original)
+            articulos = await ejecutar_en_bucle_async(buscar_articulos_mesh_avanzado_async(
+                conceptos_info['mesh_terms'],
+                conceptos_info['keywords'],
+                conceptos_info['conceptos'],
+                max_results=max_results
+            ))
+            parcial = resultado_parcial()
+            degradada = respuesta_degradada()
+        print(f"Artículos encontrados: {len(articulos)}{' (parcial)' if parcial else ''}")
         
-        return jsonify(response), 200
+        return respuesta_cacheable(
+            clave, construir_respuesta_citas(texto_original, conceptos_info, articulos, parcial),
+            CACHE_CONTROL_CITAR, bool(articulos), parcial or degradada
+        ), 200
     
     except Exception as e:
-        print(f"Error en citar_texto: {e}")
+        print(f"Error en citar_texto_async: {e}")
         return jsonify({
             "error": "Error interno del servidor",
             "detalle": str(e)
@@ -713,22 +3594,39 @@ def buscar_citas_apa():
                 "citas": []
             }), 400
         
+        max_results, error = leer_max_results(request.args.get('max_results'))
+        if error:
+            return jsonify({
+                "error": error,
+                "tema": tema,
+                "citas": []
+            }), 400
+        
+        clave = clave_respuesta("buscar", tema, max_results)
+        cacheada = respuesta_desde_cache(clave, CACHE_CONTROL_BUSCAR)
+        if cacheada is not None:
+            return cacheada
+        
         # Usar nuevo sistema de búsqueda avanzada
-        conceptos_info = detectar_conceptos_mesh_decs(tema)
-        articulos = buscar_articulos_mesh_avanzado(
-            conceptos_info['mesh_terms'], 
-            conceptos_info['keywords'],
-            conceptos_info['conceptos'],
-            max_results=5
-        )
+        with plazo_peticion(leer_presupuesto()):
+            conceptos_info = detectar_conceptos_mesh_decs(tema)
+            articulos = buscar_articulos_mesh_avanzado(
+                conceptos_info['mesh_terms'], 
+                conceptos_info['keywords'],
+                conceptos_info['conceptos'],
+                max_results=max_results
+            )
+            parcial = resultado_parcial()
+            degradada = respuesta_degradada()
         
         citas = [art['cita_apa'] for art in articulos]
         
-        return jsonify({
+        return respuesta_cacheable(clave, {
             "tema": tema,
             "citas": citas,
-            "conceptos_detectados": conceptos_info['conceptos']
-        }), 200
+            "conceptos_detectados": conceptos_info['conceptos'],
+            "parcial": parcial
+        }, CACHE_CONTROL_BUSCAR, bool(citas), parcial or degradada), 200
     
     except Exception as e:
         print(f"Error en buscar_citas_apa: {e}")
@@ -738,6 +3636,338 @@ def buscar_citas_apa():
             "citas": []
         }), 500
 
+async def buscar_citas_apa_async():
+    """Versión asíncrona de /buscar (se activa con PIPELINE_ASYNC=1)"""
+    tema = request.args.get('q', '').strip()
+    try:
+        if not tema:
+            return jsonify({
+                "error": "Parámetro 'q' requerido",
+                "tema": "",
+                "citas": []
+            }), 400
+        
+        max_results, error = leer_max_results(request.args.get('max_results'))
+        if error:
+            return jsonify({
+                "error": error,
+                "tema": tema,
+                "citas": []
+            }), 400
+        
+        clave = clave_respuesta("buscar", tema, max_results)
+        cacheada = respuesta_desde_cache(clave, CACHE_CONTROL_BUSCAR)
+        if cacheada is not None:
+            return cacheada
+        
+        with plazo_peticion(leer_presupuesto()):
+            conceptos_info = detectar_conceptos_mesh_decs(tema)
+            articulos = await ejecutar_en_bucle_async(buscar_articulos_mesh_avanzado_async(
+                conceptos_info['mesh_terms'],
+                conceptos_info['keywords'],
+                conceptos_info['conceptos'],
+                max_results=max_results
+            ))
+            parcial = resultado_parcial()
+            degradada = respuesta_degradada()
+        
+        citas = [art['cita_apa'] for art in articulos]
+        
+        return respuesta_cacheable(clave, {
+            "tema": tema,
+            "citas": citas,
+            "conceptos_detectados": conceptos_info['conceptos'],
+            "parcial": parcial
+        }, CACHE_CONTROL_BUSCAR, bool(citas), parcial or degradada), 200
+    
+    except Exception as e:
+        print(f"Error en buscar_citas_apa_async: {e}")
+        return jsonify({
+            "error": "Error interno del servidor",
+            "tema": tema,
+            "citas": []
+        }), 500
+
+def procesar_job_citar_texto(entrada):
+    """Trabajo en segundo plano equivalente a /citar_texto"""
+    texto_original = entrada["texto"]
+    conceptos_info = detectar_conceptos_mesh_decs(texto_original)
+    articulos = buscar_articulos_mesh_avanzado(
+        conceptos_info['mesh_terms'],
+        conceptos_info['keywords'],
+        conceptos_info['conceptos'],
+        max_results=entrada.get("max_results", 5)
+    )
+    return construir_respuesta_citas(texto_original, conceptos_info, articulos)
+
+cola_trabajos.registrar("citar_texto", procesar_job_citar_texto)
+
+if JOBS_INICIAR_AL_IMPORTAR:
+    cola_trabajos.iniciar()
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def consultar_job(job_id):
+    """Estado o resultado de un trabajo encolado con /citar_texto?modo=job"""
+    try:
+        cola_trabajos.iniciar()
+        trabajo = cola_trabajos.consultar(job_id)
+        if trabajo is None:
+            return jsonify({
+                "error": "Job no encontrado",
+                "job_id": job_id
+            }), 404
+        return jsonify(trabajo), 200
+    
+    except Exception as e:
+        print(f"Error en consultar_job: {e}")
+        return jsonify({
+            "error": "Error interno del servidor",
+            "detalle": str(e)
+        }), 500
+
+# Con PIPELINE_ASYNC=1 las rutas /citar_texto y /buscar usan el pipeline asíncrono
+if PIPELINE_ASYNC:
+    if ASYNC_DISPONIBLE:
+        app.view_functions["citar_texto"] = citar_texto_async
+        app.view_functions["buscar_citas_apa"] = buscar_citas_apa_async
+    else:
+        print("PIPELINE_ASYNC activado pero faltan httpx/asgiref, usando pipeline síncrono")
+
+def clave_conceptos(conceptos_info):
+    """Textos con el mismo conjunto de conceptos generan exactamente la misma búsqueda"""
+    return tuple(sorted(conceptos_info['conceptos']))
+
+def citar_textos_lote(textos, max_results=5):
+    """Cita muchos textos compartiendo búsquedas por tema y una sola descarga de artículos"""
+    # 1. Detectar conceptos de cada texto y agrupar por tema
+    entradas = []
+    grupos = {}
+    for texto in textos:
+        if not isinstance(texto, str):
+            entradas.append({"error": "Cada elemento de 'textos' debe ser un string"})
+            continue
+        texto_original, error = validar_texto_entrada({"texto": texto})
+        if error:
+            entradas.append(error[0])
+            continue
+        conceptos_info = detectar_conceptos_mesh_decs(texto_original)
+        clave = clave_conceptos(conceptos_info)
+        grupos.setdefault(clave, {"conceptos_info": conceptos_info})
+        entradas.append({"texto": texto_original, "conceptos_info": conceptos_info, "clave": clave})
+    
+    # 2-3. Una búsqueda por tema distinto y una sola descarga para todo el lote
+    articulos_por_grupo, n_pmids = buscar_articulos_por_grupo(grupos, max_results)
+    parcial = resultado_parcial()
+    
+    # 4. Resultados por texto en el orden de entrada
+    resultados = []
+    for entrada in entradas:
+        if "error" in entrada:
+            resultados.append(entrada)
+            continue
+        articulos = articulos_por_grupo[entrada["clave"]]
+        resultados.append(construir_respuesta_citas(entrada["texto"], entrada["conceptos_info"], articulos, parcial))
+    
+    return resultados, len(grupos), n_pmids
+
+def buscar_articulos_por_grupo(grupos, max_results):
+    """Una búsqueda por grupo de conceptos y la descarga de sus artículos; devuelve ({clave: artículos}, nº de PMIDs)"""
+    busquedas = {}
+    for clave, grupo in grupos.items():
+        info = grupo["conceptos_info"]
+        if plazo_vencido():
+            busquedas[clave] = ([], None)
+            continue
+        try:
+            busquedas[clave] = buscar_candidatos(info['mesh_terms'], info['keywords'], info['conceptos'], max_results)
+        except Exception as e:
+            print(f"Error buscando candidatos del grupo {clave}: {e}")
+            busquedas[clave] = ([], None)
+    
+    todos_pmids = list(dict.fromkeys(pmid for pmids, _ in busquedas.values() for pmid in pmids))
+    articulos_por_grupo = {}
+    
+    if CRIBADO_DOS_FASES:
+        # Cribado por grupo; lo que descarga un grupo queda en la caché de artículos para los siguientes
+        for clave, grupo in grupos.items():
+            info = grupo["conceptos_info"]
+            pmids, busqueda = busquedas[clave]
+            articulos_por_grupo[clave] = seleccionar_articulos_en_dos_fases(
+                pmids, info['mesh_terms'], info['keywords'], info['conceptos'], max_results, busqueda
+            )
+        return articulos_por_grupo, len(todos_pmids)
+    
+    metadatos = obtener_articulos_lote(todos_pmids)
+    for clave, grupo in grupos.items():
+        info = grupo["conceptos_info"]
+        articulos_por_grupo[clave] = seleccionar_articulos(
+            busquedas[clave][0], metadatos, info['mesh_terms'], info['keywords'], info['conceptos'], max_results
+        )
+    
+    return articulos_por_grupo, len(todos_pmids)
+
+@app.route("/citar_lote", methods=["POST"])
+def citar_lote():
+    """
+    Cita una lista de textos en una sola petición
+    Los textos del mismo tema comparten búsqueda y descarga de artículos
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or not isinstance(data.get('textos'), list):
+            return jsonify({
+                "error": "Se requiere el campo 'textos' (lista) en el JSON"
+            }), 400
+        
+        if not data['textos']:
+            return jsonify({
+                "error": "La lista de textos no puede estar vacía"
+            }), 400
+        
+        if len(data['textos']) > CITAR_LOTE_MAX_TEXTOS:
+            return jsonify({
+                "error": f"Demasiados textos (máximo {CITAR_LOTE_MAX_TEXTOS})"
+            }), 400
+        
+        max_results, error = leer_max_results(data.get('max_results', request.args.get('max_results')))
+        if error:
+            return jsonify({"error": error}), 400
+        
+        print(f"Procesando lote de {len(data['textos'])} textos")
+        with plazo_peticion(leer_presupuesto()):
+            resultados, n_grupos, n_articulos = citar_textos_lote(data['textos'], max_results)
+            parcial = resultado_parcial()
+        print(f"Lote: {n_grupos} temas distintos, {n_articulos} PMIDs candidatos")
+        
+        return jsonify({
+            "numero_textos": len(resultados),
+            "temas_distintos": n_grupos,
+            "parcial": parcial,
+            "resultados": resultados
+        }), 200
+    
+    except Exception as e:
+        print(f"Error en citar_lote: {e}")
+        return jsonify({
+            "error": "Error interno del servidor",
+            "detalle": str(e)
+        }), 500
+
+def iterar_secciones(texto, max_caracteres=SECCION_MAX_CARACTERES):
+    """Genera (sección, separador) por párrafos; los párrafos largos se parten en ventanas de oraciones"""
+    for coincidencia in re.finditer(r'(.+?)(\n\s*\n|\Z)', texto, flags=re.S):
+        parrafo, separador = coincidencia.group(1).strip(), coincidencia.group(2)
+        if not parrafo:
+            continue
+        if len(parrafo) <= max_caracteres:
+            yield parrafo, separador
+            continue
+        
+        ventana = []
+        longitud = 0
+        for oracion in dividir_oraciones(parrafo):
+            if ventana and longitud + len(oracion) > max_caracteres:
+                yield " ".join(ventana), " "
+                ventana, longitud = [], 0
+            ventana.append(oracion)
+            longitud += len(oracion) + 1
+        if ventana:
+            yield " ".join(ventana), separador
+
+def citar_documento_largo(texto, max_results=5):
+    """Cita un documento largo por secciones con una lista de referencias única y numeración estable"""
+    # 1. Primera pasada: conceptos por sección; solo se guarda la clave de tema de cada una
+    grupos = {}
+    claves_secciones = []
+    conceptos_totales = Counter()
+    for seccion, _ in iterar_secciones(texto):
+        conceptos_info = detectar_conceptos_mesh_decs(seccion)
+        clave = clave_conceptos(conceptos_info)
+        grupos.setdefault(clave, {"conceptos_info": conceptos_info})
+        claves_secciones.append(clave)
+        conceptos_totales.update(conceptos_info['conceptos'])
+    
+    # 2. Temas compartidos entre secciones se buscan una sola vez, con una descarga común
+    articulos_por_grupo, _ = buscar_articulos_por_grupo(grupos, max_results)
+    
+    # 3. Segunda pasada: citas por sección y referencias numeradas por orden de primera aparición
+    partes = []
+    referencias = {}
+    for (seccion, separador), clave in zip(iterar_secciones(texto), claves_secciones):
+        texto_citado, usadas = integrar_citas_en_texto(seccion, articulos_por_grupo[clave])
+        partes.append(texto_citado)
+        partes.append(separador)
+        for articulo in usadas:
+            referencias.setdefault(articulo['pmid'], articulo)
+    
+    referencias_usadas = list(referencias.values())
+    lista_referencias = generar_lista_referencias(referencias_usadas)
+    
+    return {
+        "texto_citado": "".join(partes).rstrip() + lista_referencias,
+        "parcial": resultado_parcial(),
+        "conceptos_detectados": dict(conceptos_totales),
+        "numero_secciones": len(claves_secciones),
+        "temas_distintos": len(grupos),
+        "numero_articulos": len(referencias_usadas),
+        "referencias": lista_referencias,
+        "articulos_utilizados": [
+            {
+                "autor": art['autor'],
+                "año": art['año'],
+                "titulo": art['titulo'],
+                "journal": art['journal'],
+                "url": art['url']
+            }
+            for art in referencias_usadas
+        ]
+    }
+
+@app.route("/citar_documento", methods=["POST"])
+def citar_documento():
+    """
+    Cita documentos largos (capítulos, tesis) procesándolos por secciones
+    Recibe el mismo JSON que /citar_texto con un límite mucho mayor
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or not isinstance(data.get('texto'), str):
+            return jsonify({
+                "error": "Se requiere el campo 'texto' en el JSON"
+            }), 400
+        
+        texto_original = data['texto'].strip()
+        
+        if not texto_original:
+            return jsonify({
+                "error": "El texto no puede estar vacío"
+            }), 400
+        
+        if len(texto_original) > DOCUMENTO_MAX_CARACTERES:
+            return jsonify({
+                "error": f"Documento demasiado largo (máximo {DOCUMENTO_MAX_CARACTERES} caracteres)"
+            }), 400
+        
+        max_results, error = leer_max_results(data.get('max_results', request.args.get('max_results')))
+        if error:
+            return jsonify({"error": error}), 400
+        
+        print(f"Procesando documento de {len(texto_original)} caracteres")
+        with plazo_peticion(leer_presupuesto()):
+            resultado = citar_documento_largo(texto_original, max_results)
+        print(f"Documento: {resultado['numero_secciones']} secciones, {resultado['temas_distintos']} temas distintos")
+        
+        return jsonify(resultado), 200
+    
+    except Exception as e:
+        print(f"Error en citar_documento: {e}")
+        return jsonify({
+            "error": "Error interno del servidor",
+            "detalle": str(e)
+        }), 500
+
 @app.route("/", methods=["GET"])
 def info_api():
     """Información de la API actualizada"""
@@ -751,12 +3981,40 @@ def info_api():
                 "url": "/citar_texto",
                 "description": "Integra citas automáticamente en un texto proporcionado",
                 "body": {
-                    "texto": "Texto a citar..."
+                    "texto": "Texto a citar...",
+                    "max_results": f"Opcional, artículos a citar (1-{MAX_RESULTADOS_MAX}, por defecto 5)"
+                },
+                "streaming": "?stream=ndjson o ?stream=sse para recibir conceptos, artículos y resultado por etapas",
+                "job": "?modo=job para encolar y consultar el resultado en /jobs/<id>",
+                "presupuesto": "Cabecera X-Presupuesto-Ms para fijar el tiempo máximo; si se agota se devuelve lo encontrado con parcial: true"
+            },
+            "jobs": {
+                "method": "GET",
+                "url": "/jobs/<id>",
+                "description": "Estado o resultado de un trabajo encolado"
+            },
+            "citar_documento": {
+                "method": "POST",
+                "url": "/citar_documento",
+                "description": "Integra citas en documentos largos procesándolos por secciones",
+                "body": {
+                    "texto": "Capítulo completo...",
+                    "max_results": f"Opcional, artículos por tema (1-{MAX_RESULTADOS_MAX}, por defecto 5)"
+                },
+                "presupuesto": "Cabecera X-Presupuesto-Ms, como en /citar_texto"
+            },
+            "citar_lote": {
+                "method": "POST",
+                "url": "/citar_lote",
+                "description": "Integra citas en varios textos a la vez, compartiendo búsquedas por tema",
+                "body": {
+                    "textos": ["Texto 1...", "Texto 2..."],
+                    "max_results": f"Opcional, artículos por texto (1-{MAX_RESULTADOS_MAX}, por defecto 5)"
                 }
             },
             "buscar": {
                 "method": "GET", 
-                "url": "/buscar?q=tema",
+                "url": f"/buscar?q=tema&max_results=5 (max_results opcional, 1-{MAX_RESULTADOS_MAX})",
                 "description": "Buscar artículos por tema (compatibilidad)"
             }
         },
@@ -769,6 +4027,82 @@ def info_api():
         }
     })
 
+@app.route("/estadisticas", methods=["GET"])
+def estadisticas():
+    """Estadísticas internas de cachés y del cliente HTTP"""
+    return jsonify({
+        "cache_articulos": cache_articulos.resumen(),
+        "cache_busquedas": cache_busquedas.resumen(),
+        "cache_respuestas": cache_respuestas.resumen(),
+        "eutils": cliente_eutils.resumen(),
+        "circuitos_ncbi": circuito_ncbi.resumen(),
+        "p95_ms_ncbi": latencias_ncbi.resumen(),
+        "limitador_ncbi": limitador_ncbi.resumen(),
+        "espejo_pubmed": espejo_pubmed.resumen() if espejo_pubmed is not None else None
+    }), 200
+
+@app.route("/metrics", methods=["GET"])
+def metricas():
+    """Métricas en formato Prometheus, agregadas entre workers si hay PROMETHEUS_MULTIPROC_DIR"""
+    if not PROMETHEUS_DISPONIBLE:
+        return jsonify({
+            "error": "prometheus_client no está instalado"
+        }), 501
+    
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registro = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registro), content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+# =========================
+# ARRANQUE
+# =========================
+
+_estado_arranque = {"iniciado": False, "listo": False, "segundos": None, "articulos_precargados": 0}
+_arranque_lock = threading.Lock()
+
+def precalentar():
+    """Carga tokenizador, detector e índices y llena la caché en memoria antes de hacer fork,
+    para que los workers de gunicorn compartan esas páginas copy-on-write"""
+    with _arranque_lock:
+        if _estado_arranque["iniciado"]:
+            return
+        _estado_arranque["iniciado"] = True
+    
+    inicio = time.time()
+    try:
+        cargar_nltk()
+        obtener_stopwords()
+        texto = "La fisioterapia respiratoria mejora la función pulmonar. El ejercicio reduce el dolor crónico."
+        detector_conceptos.puntuar(texto, tokenizar_texto(texto.lower()))
+        dividir_oraciones(texto)
+        if indice_mesh is not None:
+            indice_mesh.relacionados("Exercise Therapy")
+        _estado_arranque["articulos_precargados"] = cache_articulos.precargar(CACHE_ARTICULOS_MEMORIA)
+    except Exception as e:
+        print(f"Error en el precalentamiento: {e}")
+    
+    _estado_arranque["segundos"] = round(time.time() - inicio, 3)
+    _estado_arranque["listo"] = True
+    print(f"Precalentamiento completado en {_estado_arranque['segundos']}s "
+          f"({_estado_arranque['articulos_precargados']} artículos en memoria)")
+
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    """Readiness: 503 hasta que termina el precalentamiento"""
+    if not _estado_arranque["iniciado"]:
+        # Servidores que no llaman a precalentar() (p.ej. flask run): se lanza aquí en segundo plano
+        threading.Thread(target=precalentar, name="precalentar", daemon=True).start()
+    
+    estado = {
+        "status": "ready" if _estado_arranque["listo"] else "warming_up",
+        "segundos_precalentamiento": _estado_arranque["segundos"],
+        "articulos_precargados": _estado_arranque["articulos_precargados"]
+    }
+    return jsonify(estado), 200 if _estado_arranque["listo"] else 503
+
 @app.route("/health", methods=["GET"])
 def health_check():
     """Health check"""
@@ -779,5 +4113,7 @@ def health_check():
     }), 200
 
 if __name__ == "__main__":
+    # Solo para desarrollo; en producción: gunicorn -c gunicorn.conf.py app:app
+    precalentar()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
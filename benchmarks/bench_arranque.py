@@ -0,0 +1,71 @@
+"""
+Benchmark de arranque en frío.
+
+Para cada modo de tokenización (TOKENIZADOR=nltk y TOKENIZADOR=regex) lanza un
+proceso nuevo y mide el tiempo de "import app" y el de la primera petición
+(detección de conceptos + integración de citas, sin red), que es donde se paga
+la carga perezosa de NLTK.
+
+Uso:
+    python benchmarks/bench_arranque.py [--repeticiones 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CODIGO_MEDICION = r'''
+import json, sys, time
+inicio = time.perf_counter()
+import app
+t_import = time.perf_counter() - inicio
+
+texto = ("La fisioterapia respiratoria es efectiva para mejorar la función pulmonar. "
+         "Los ejercicios respiratorios pueden reducir la disnea en pacientes con EPOC.")
+articulo = {"pmid": "1", "autor": "Smith, J", "año": "2020", "titulo": "T", "journal": "J",
+            "url": "u", "cita_apa": "c"}
+inicio = time.perf_counter()
+conceptos = app.detectar_conceptos_mesh_decs(texto)
+app.integrar_citas_en_texto(texto, [articulo])
+t_primera = time.perf_counter() - inicio
+
+inicio = time.perf_counter()
+app.detectar_conceptos_mesh_decs(texto)
+app.integrar_citas_en_texto(texto, [articulo])
+t_segunda = time.perf_counter() - inicio
+
+print(json.dumps({"import": t_import, "primera": t_primera, "segunda": t_segunda,
+                  "nltk": app.cargar_nltk() is not None}))
+'''
+
+def medir(modo, repeticiones):
+    entorno = dict(os.environ, TOKENIZADOR=modo, PYTHONDONTWRITEBYTECODE="1")
+    muestras = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", CODIGO_MEDICION],
+            cwd=RAIZ, env=entorno, capture_output=True, text=True, check=True
+        ).stdout
+        muestras.append(json.loads(salida.strip().splitlines()[-1]))
+    return {
+        "modo": modo,
+        "nltk_activo": muestras[-1]["nltk"],
+        "ms_import": round(statistics.median(m["import"] for m in muestras) * 1000, 1),
+        "ms_primera_peticion": round(statistics.median(m["primera"] for m in muestras) * 1000, 2),
+        "ms_peticion_caliente": round(statistics.median(m["segunda"] for m in muestras) * 1000, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    resultados = [medir(modo, args.repeticiones) for modo in ("nltk", "regex")]
+    print(json.dumps({"benchmark": "arranque", "repeticiones": args.repeticiones, "resultados": resultados}, indent=2))
+
+if __name__ == "__main__":
+    main()
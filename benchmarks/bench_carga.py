@@ -0,0 +1,242 @@
+"""
+Benchmark de carga de extremo a extremo contra un E-utilities falso.
+
+Arranca benchmarks/eutils_falso.py en este proceso, lanza la API en un proceso
+aparte apuntando a él (EUTILS_BASE_URL) con cachés en un directorio temporal y
+envía peticiones a /citar_texto y /buscar con la concurrencia indicada. Imprime
+en JSON el throughput y las latencias p50/p95/p99 por endpoint, para comparar
+resultados entre commits.
+
+Las entradas se repiten, así que la caché de respuestas está desactivada salvo
+con --cache-respuestas: si no, tras el calentamiento no se mediría el pipeline.
+
+Uso:
+    python benchmarks/bench_carga.py --concurrencia 8 --peticiones 400 --latencia-ms 80
+    python benchmarks/bench_carga.py --sin-cache --tasa-error 0.05 --salida resultado.json
+    python benchmarks/bench_carga.py --cache-respuestas
+    python benchmarks/bench_carga.py --comando "gunicorn -c gunicorn.conf.py app:app"
+"""
+import argparse
+import itertools
+import json
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from eutils_falso import DIRECTORIO_FIXTURES, FixturesEutils, ServidorEutilsFalso
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TEXTOS = [
+    "La fisioterapia respiratoria es efectiva para mejorar la función pulmonar. "
+    "Los ejercicios respiratorios pueden reducir la disnea en pacientes con EPOC.",
+    "El dolor crónico lumbar mejora con terapia por ejercicio supervisada. "
+    "Los estudios indican una reducción del dolor y mejor funcionalidad.",
+    "La rehabilitación cardiaca reduce la mortalidad tras un infarto. "
+    "El entrenamiento aeróbico mejora la capacidad funcional de los pacientes.",
+    "La rehabilitación neurológica tras un ictus favorece la recuperación motora. "
+    "La plasticidad neuronal se potencia con práctica intensiva.",
+    "El fortalecimiento muscular es clave en la rehabilitación musculoesquelética. "
+    "La fisioterapia mejora la fuerza y reduce el riesgo de lesiones.",
+]
+
+TEMAS = ["fisioterapia respiratoria", "dolor crónico", "rehabilitación cardiaca", "neurologia ictus", "fortalecimiento muscular"]
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def esperar_api(url, proceso, limite=60):
+    inicio = time.time()
+    while time.time() - inicio < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"La API terminó al arrancar (código {proceso.returncode})")
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return time.time() - inicio
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("La API no respondió a /health a tiempo")
+
+def percentil(valores, p):
+    """Percentil por interpolación lineal (valores ya ordenados)"""
+    if not valores:
+        return None
+    posicion = (len(valores) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(valores) - 1)
+    return valores[inferior] + (valores[superior] - valores[inferior]) * (posicion - inferior)
+
+def resumir(muestras, duracion):
+    latencias = sorted(m["segundos"] for m in muestras)
+    errores = sum(1 for m in muestras if m["estado"] != 200)
+    return {
+        "peticiones": len(muestras),
+        "errores": errores,
+        "tasa_error": round(errores / len(muestras), 4) if muestras else 0,
+        "rps": round(len(muestras) / duracion, 2) if duracion else None,
+        "ms_media": round(statistics.fmean(latencias) * 1000, 2) if latencias else None,
+        "ms_p50": round(percentil(latencias, 50) * 1000, 2) if latencias else None,
+        "ms_p95": round(percentil(latencias, 95) * 1000, 2) if latencias else None,
+        "ms_p99": round(percentil(latencias, 99) * 1000, 2) if latencias else None,
+        "ms_max": round(latencias[-1] * 1000, 2) if latencias else None
+    }
+
+def generar_peticiones(endpoints):
+    """Secuencia infinita que alterna endpoints y entradas de forma determinista"""
+    textos = itertools.cycle(TEXTOS)
+    temas = itertools.cycle(TEMAS)
+    for endpoint in itertools.cycle(endpoints):
+        if endpoint == "citar_texto":
+            yield endpoint, "POST", "/citar_texto", {"json": {"texto": next(textos)}}
+        else:
+            yield endpoint, "GET", "/buscar", {"params": {"q": next(temas)}}
+
+def ejecutar_carga(url, endpoints, total, concurrencia, timeout):
+    generador = generar_peticiones(endpoints)
+    lock = threading.Lock()
+    muestras = []
+    emitidas = [0]
+
+    def siguiente():
+        with lock:
+            if emitidas[0] >= total:
+                return None
+            emitidas[0] += 1
+            return next(generador)
+
+    def trabajador():
+        sesion = requests.Session()
+        while True:
+            peticion = siguiente()
+            if peticion is None:
+                return
+            endpoint, metodo, ruta, kwargs = peticion
+            inicio = time.perf_counter()
+            try:
+                estado = sesion.request(metodo, f"{url}{ruta}", timeout=timeout, **kwargs).status_code
+            except requests.RequestException:
+                estado = None
+            muestra = {"endpoint": endpoint, "estado": estado, "segundos": time.perf_counter() - inicio}
+            with lock:
+                muestras.append(muestra)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        for futuro in [pool.submit(trabajador) for _ in range(concurrencia)]:
+            futuro.result()
+    return muestras, time.perf_counter() - inicio
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default="citar_texto,buscar", help="Lista separada por comas: citar_texto, buscar")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--peticiones", type=int, default=200, help="Peticiones medidas")
+    parser.add_argument("--calentamiento", type=int, default=10, help="Peticiones previas no medidas")
+    parser.add_argument("--latencia-ms", type=float, default=50.0, help="Latencia media del E-utilities falso")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de 503 del E-utilities falso")
+    parser.add_argument("--fixtures", default=DIRECTORIO_FIXTURES)
+    parser.add_argument("--sin-cache", action="store_true", help="Desactiva las cachés de búsquedas, artículos y respuestas")
+    parser.add_argument("--cache-respuestas", action="store_true", help="Activa la caché de respuestas (mide solo sus hits)")
+    parser.add_argument("--tasa-ncbi", type=float, default=1000.0, help="NCBI_TASA_MAX de la API durante la prueba")
+    parser.add_argument("--comando", default=f"{shlex.quote(sys.executable)} app.py", help="Comando que arranca la API (usa $PORT)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--salida", help="Además de imprimirlo, guarda el JSON en este archivo")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    eutils = ServidorEutilsFalso(
+        FixturesEutils(args.fixtures), latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms, tasa_error=args.tasa_error
+    ).iniciar()
+
+    temporal = tempfile.mkdtemp(prefix="bench_carga_")
+    puerto = puerto_libre()
+    entorno = dict(
+        os.environ,
+        PORT=str(puerto),
+        EUTILS_BASE_URL=eutils.url,
+        NCBI_TASA_MAX=str(args.tasa_ncbi),
+        NCBI_LIMITADOR_ARCHIVO=os.path.join(temporal, "bucket"),
+        CACHE_ARTICULOS_DB=os.path.join(temporal, "articulos.sqlite3"),
+        CACHE_RESPUESTAS_DB=os.path.join(temporal, "respuestas.sqlite3"),
+        JOBS_DB=os.path.join(temporal, "jobs.sqlite3"),
+        MESH_FALLBACK_API="1",
+        PYTHONUNBUFFERED="1"
+    )
+    if args.sin_cache or not args.cache_respuestas:
+        entorno.update(CACHE_RESPUESTAS_TTL="0")
+    if args.sin_cache:
+        entorno.update(CACHE_BUSQUEDAS_MAX="0", CACHE_ARTICULOS_MEMORIA="0", CACHE_ARTICULOS_TTL="0")
+
+    api = subprocess.Popen(
+        shlex.split(args.comando), cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    try:
+        segundos_arranque = esperar_api(url, api)
+        if args.calentamiento:
+            ejecutar_carga(url, endpoints, args.calentamiento, min(args.concurrencia, args.calentamiento), args.timeout)
+        llamadas_previas = sum(eutils.resumen()["llamadas"].values())
+        muestras, duracion = ejecutar_carga(url, endpoints, args.peticiones, args.concurrencia, args.timeout)
+        llamadas_medidas = sum(eutils.resumen()["llamadas"].values()) - llamadas_previas
+    finally:
+        api.terminate()
+        try:
+            api.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            api.kill()
+        eutils.detener()
+
+    resultado = {
+        "benchmark": "carga",
+        "commit": commit_actual(),
+        "configuracion": {
+            "endpoints": endpoints,
+            "concurrencia": args.concurrencia,
+            "peticiones": args.peticiones,
+            "calentamiento": args.calentamiento,
+            "latencia_ms": args.latencia_ms,
+            "jitter_ms": args.jitter_ms,
+            "tasa_error": args.tasa_error,
+            "sin_cache": args.sin_cache,
+            "cache_respuestas": args.cache_respuestas and not args.sin_cache,
+            "comando": args.comando
+        },
+        "segundos_arranque": round(segundos_arranque, 2),
+        "segundos_totales": round(duracion, 3),
+        "total": resumir(muestras, duracion),
+        "por_endpoint": {
+            endpoint: resumir([m for m in muestras if m["endpoint"] == endpoint], duracion)
+            for endpoint in endpoints
+        },
+        "eutils": {**eutils.resumen(), "llamadas_por_peticion": round(llamadas_medidas / len(muestras), 2) if muestras else None}
+    }
+    salida = json.dumps(resultado, indent=2, ensure_ascii=False)
+    print(salida)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            archivo.write(salida + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark de detectar_conceptos_mesh_decs.
+
+Compara el bucle original (áreas x palabras x keywords con escaneos de subcadenas)
+con el DetectorConceptos precompilado: verifica que los scores coinciden en todos
+los textos y reporta el speedup.
+
+Uso:
+    python benchmarks/bench_conceptos.py [--textos 200] [--caracteres 5000]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+VOCABULARIO = (
+    "la fisioterapia respiratoria mejora función pulmonar pacientes ejercicios respiratorios "
+    "disnea epoc rehabilitación cardiaca dolor crónico manejo terapia manual fortalecimiento "
+    "muscular neurológica accidente cerebrovascular recuperación motora physiotherapy therapy "
+    "pain management exercise training estudio evidencia resultados tratamiento eficacia "
+    "musculoesquelético columna lumbar rodilla hombro equilibrio marcha plasticidad neuronal"
+).split()
+
+def scores_originales(texto, palabras_relevantes):
+    """Copia del bucle original de detectar_conceptos_mesh_decs"""
+    scores = {}
+    for area, terminos in app.MESH_DECS_MAPPING.items():
+        score = 0
+        for palabra in palabras_relevantes:
+            for keyword in terminos.get('keywords', []):
+                if keyword.lower() in texto.lower() or any(k in palabra for k in keyword.split()):
+                    score += 5
+            area_keywords = [area] + terminos.get('keywords', [])
+            for ak in area_keywords:
+                if ak.lower() in palabra or palabra in ak.lower():
+                    score += 3
+        scores[area] = score
+    return scores
+
+def generar_texto(rng, caracteres):
+    palabras = []
+    longitud = 0
+    while longitud < caracteres:
+        palabra = rng.choice(VOCABULARIO)
+        if rng.random() < 0.08:
+            palabra += "."
+        palabras.append(palabra)
+        longitud += len(palabra) + 1
+    return " ".join(palabras)[:caracteres]
+
+def palabras_relevantes(texto):
+    texto_limpio = re.sub(r'[^\w\s]', ' ', texto.lower())
+    stop_words = app.obtener_stopwords()
+    return [p for p in app.tokenizar_texto(texto_limpio) if len(p) > 3 and p not in stop_words]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--textos", type=int, default=200)
+    parser.add_argument("--caracteres", type=int, default=5000)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    textos = [generar_texto(rng, args.caracteres) for _ in range(args.textos)]
+    entradas = [(texto, palabras_relevantes(texto)) for texto in textos]
+
+    inicio = time.perf_counter()
+    esperados = [scores_originales(texto, palabras) for texto, palabras in entradas]
+    t_original = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    obtenidos = [app.detector_conceptos.puntuar(texto, palabras) for texto, palabras in entradas]
+    t_compilado = time.perf_counter() - inicio
+
+    diferencias = sum(1 for a, b in zip(esperados, obtenidos) if a != b)
+    print(json.dumps({
+        "benchmark": "detectar_conceptos",
+        "textos": args.textos,
+        "caracteres": args.caracteres,
+        "paridad": diferencias == 0,
+        "textos_distintos": diferencias,
+        "ms_por_texto_original": round(t_original / args.textos * 1000, 3),
+        "ms_por_texto_compilado": round(t_compilado / args.textos * 1000, 3),
+        "speedup": round(t_original / t_compilado, 1) if t_compilado else None
+    }, indent=2))
+    return 0 if diferencias == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Benchmark del scoring de relevancia por lotes.
+
+Compara calcular_relevancia_avanzada original (escaneos de subcadenas por término
+y densidad palabra x término, artículo a artículo) con MotorRelevancia, que compila
+los términos de la petición una vez y puntúa todo el lote. Verifica que los scores
+son idénticos y reporta el speedup.
+
+Uso:
+    python benchmarks/bench_relevancia.py [--articulos 150] [--repeticiones 20]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+VOCABULARIO = (
+    "patients randomized controlled trial physical therapy rehabilitation exercise training "
+    "breathing exercises pulmonary rehabilitation copd dyspnea quality of life chronic pain "
+    "pain management low back knee osteoarthritis muscle strengthening cardiac rehabilitation "
+    "stroke motor recovery neurorehabilitation efficacy effectiveness intervention systematic "
+    "review meta-analysis outcomes significant improvement group control weeks baseline"
+).split()
+
+def relevancia_original(texto_completo, mesh_terms, keywords, conceptos_texto):
+    """Copia de calcular_relevancia_avanzada antes del motor por lotes"""
+    score = 0
+    for mesh_term in mesh_terms:
+        if mesh_term.lower() in texto_completo:
+            score += 20
+        for palabra in mesh_term.lower().split():
+            if len(palabra) > 3 and palabra in texto_completo:
+                score += 5
+    for keyword in keywords:
+        if keyword.lower() in texto_completo:
+            score += 15
+        if keyword.replace(' ', '') in texto_completo.replace(' ', ''):
+            score += 10
+    for concepto in conceptos_texto.keys():
+        if concepto.lower() in texto_completo:
+            score += 12
+    for termino in app.TERMINOS_TECNICOS:
+        if termino in texto_completo:
+            score += 8
+    total_palabras = len(texto_completo.split())
+    if total_palabras > 0:
+        densidad = sum(1 for word in texto_completo.split()
+                       if any(term in word for term in keywords + list(conceptos_texto.keys())))
+        score += int((densidad / total_palabras) * 100)
+    return score
+
+def generar_abstract(rng):
+    titulo = " ".join(rng.choice(VOCABULARIO) for _ in range(rng.randint(6, 14)))
+    resumen = " ".join(rng.choice(VOCABULARIO) for _ in range(rng.randint(150, 300)))
+    return f"{titulo} {resumen}".lower()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articulos", type=int, default=150)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    textos = [generar_abstract(rng) for _ in range(args.articulos)]
+    conceptos = app.detectar_conceptos_mesh_decs(
+        "Fisioterapia respiratoria y rehabilitación cardiaca para el dolor crónico musculoesquelético"
+    )
+    mesh_terms, keywords, conceptos_texto = conceptos["mesh_terms"], conceptos["keywords"], conceptos["conceptos"]
+
+    inicio = time.perf_counter()
+    for _ in range(args.repeticiones):
+        esperados = [relevancia_original(t, mesh_terms, keywords, conceptos_texto) for t in textos]
+    t_original = (time.perf_counter() - inicio) / args.repeticiones
+
+    inicio = time.perf_counter()
+    for _ in range(args.repeticiones):
+        # Se compila en cada repetición para incluir ese coste en la medida
+        motor = app.MotorRelevancia(mesh_terms, keywords, conceptos_texto.keys())
+        obtenidos = motor.puntuar(textos)
+    t_motor = (time.perf_counter() - inicio) / args.repeticiones
+
+    diferencias = sum(1 for a, b in zip(esperados, obtenidos) if a != b)
+    print(json.dumps({
+        "benchmark": "relevancia_lote",
+        "articulos": args.articulos,
+        "numpy": app.NUMPY_AVAILABLE,
+        "paridad": diferencias == 0,
+        "articulos_distintos": diferencias,
+        "ms_por_lote_original": round(t_original * 1000, 3),
+        "ms_por_lote_motor": round(t_motor * 1000, 3),
+        "speedup": round(t_original / t_motor, 1) if t_motor else None
+    }, indent=2))
+    return 0 if diferencias == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""
+Servidor local que imita esearch/esummary/efetch de las E-utilities (db=pubmed y db=mesh).
+
+Sirve respuestas guardadas en un directorio de fixtures, con latencia y tasa de
+errores configurables, para medir la API sin depender de NCBI. Los fixtures se
+pueden grabar una vez contra NCBI (--grabar) o generar de forma determinista
+(--generar); si el directorio está vacío se generan automáticamente.
+
+Archivos del directorio de fixtures:
+    esearch_pubmed.json   respuesta de esearch (idlist en orden de relevancia)
+    esummary_pubmed.json  respuesta de esummary con todos los PMIDs
+    efetch_pubmed.xml     PubmedArticleSet con todos los PMIDs
+    esearch_mesh.json     respuesta de esearch en db=mesh
+    esummary_mesh.json    respuesta de esummary en db=mesh
+
+Uso:
+    python benchmarks/eutils_falso.py --puerto 18800 --latencia-ms 80 --tasa-error 0.02
+    python benchmarks/eutils_falso.py --grabar "physical therapy rehabilitation" --articulos 300
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIRECTORIO_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+ARCHIVOS_FIXTURES = (
+    "esearch_pubmed.json",
+    "esummary_pubmed.json",
+    "efetch_pubmed.xml",
+    "esearch_mesh.json",
+    "esummary_mesh.json",
+)
+
+VOCABULARIO = (
+    "physical therapy rehabilitation exercise training breathing pulmonary pain chronic "
+    "management cardiac randomized trial efficacy patients recovery muscle strengthening "
+    "neurological motor stroke function outcomes intervention quality life adults program"
+).split()
+
+def generar_fixtures(directorio, n_articulos=300, semilla=1):
+    """Escribe un juego de fixtures sintético y determinista con el formato real de E-utilities"""
+    aleatorio = random.Random(semilla)
+    os.makedirs(directorio, exist_ok=True)
+    pmids = [str(30000000 + i) for i in range(n_articulos)]
+    resumenes = {"uids": pmids}
+    articulos_xml = []
+
+    for i, pmid in enumerate(pmids):
+        titulo = " ".join(aleatorio.choice(VOCABULARIO) for _ in range(9)).capitalize() + "."
+        abstract = " ".join(aleatorio.choice(VOCABULARIO) for _ in range(120))
+        anio = str(2014 + i % 11)
+        journal = f"Journal of Rehabilitation Research {i % 13}"
+        autores = [(f"Autor{i}{letra}", "AB"[j % 2]) for j, letra in enumerate("xyz"[:1 + i % 3])]
+        doi = f"10.5555/bench.{pmid}" if i % 4 else ""
+
+        resumenes[pmid] = {
+            "uid": pmid,
+            "title": titulo,
+            "authors": [{"name": f"{apellido} {iniciales}", "authtype": "Author"} for apellido, iniciales in autores],
+            "pubdate": f"{anio} Mar",
+            "source": f"J Rehabil Res {i % 13}",
+            "fulljournalname": journal,
+            "pubtype": ["Journal Article", "Randomized Controlled Trial"][: 1 + i % 2]
+        }
+
+        articulo = ET.Element("PubmedArticle")
+        citacion = ET.SubElement(articulo, "MedlineCitation", Status="MEDLINE")
+        ET.SubElement(citacion, "PMID", Version="1").text = pmid
+        datos = ET.SubElement(citacion, "Article")
+        revista = ET.SubElement(datos, "Journal")
+        fecha = ET.SubElement(ET.SubElement(revista, "JournalIssue"), "PubDate")
+        ET.SubElement(fecha, "Year").text = anio
+        ET.SubElement(fecha, "Month").text = "Mar"
+        ET.SubElement(revista, "Title").text = journal
+        ET.SubElement(datos, "ArticleTitle").text = titulo
+        if doi:
+            ET.SubElement(datos, "ELocationID", EIdType="doi", ValidYN="Y").text = doi
+        ET.SubElement(ET.SubElement(datos, "Abstract"), "AbstractText").text = abstract
+        lista_autores = ET.SubElement(datos, "AuthorList")
+        for apellido, iniciales in autores:
+            autor = ET.SubElement(lista_autores, "Author")
+            ET.SubElement(autor, "LastName").text = apellido
+            ET.SubElement(autor, "Initials").text = iniciales
+        tipos = ET.SubElement(datos, "PublicationTypeList")
+        for tipo in resumenes[pmid]["pubtype"]:
+            ET.SubElement(tipos, "PublicationType").text = tipo
+        encabezados = ET.SubElement(citacion, "MeshHeadingList")
+        for descriptor in aleatorio.sample(["Exercise Therapy", "Physical Therapy Modalities", "Pain Management",
+                                            "Breathing Exercises", "Cardiac Rehabilitation", "Stroke Rehabilitation"], 2):
+            ET.SubElement(ET.SubElement(encabezados, "MeshHeading"), "DescriptorName").text = descriptor
+        articulos_xml.append(ET.tostring(articulo, encoding="unicode"))
+
+    escribir_fixtures(
+        directorio,
+        {"esearchresult": {"count": str(n_articulos), "retmax": str(n_articulos), "idlist": pmids}},
+        {"result": resumenes},
+        '<?xml version="1.0" ?>\n<PubmedArticleSet>' + "".join(articulos_xml) + "</PubmedArticleSet>",
+        {"esearchresult": {"count": "2", "idlist": ["68005081", "68026741"]}},
+        {"result": {
+            "uids": ["68005081", "68026741"],
+            "68005081": {"uid": "68005081", "ds_meshterms": ["Exercise Therapy", "Remedial Exercise"]},
+            "68026741": {"uid": "68026741", "ds_meshterms": ["Physical Therapy Modalities"]}
+        }}
+    )
+
+def grabar_fixtures(directorio, query, n_articulos=300, api_key=None, termino_mesh="Physical Therapy Modalities"):
+    """Graba las respuestas reales de NCBI para una query (una sola vez, respetando el límite de tasa)"""
+    import requests
+
+    base = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+    comunes = {"api_key": api_key} if api_key else {}
+
+    def llamar(endpoint, **params):
+        response = requests.post(f"{base}/{endpoint}", data={**comunes, **params}, timeout=60)
+        response.raise_for_status()
+        time.sleep(0.4)
+        return response
+
+    esearch = llamar("esearch.fcgi", db="pubmed", term=query, retmode="json", retmax=n_articulos).json()
+    ids = ",".join(esearch["esearchresult"]["idlist"])
+    esummary = llamar("esummary.fcgi", db="pubmed", id=ids, retmode="json").json()
+    efetch = llamar("efetch.fcgi", db="pubmed", id=ids, retmode="xml").text
+    esearch_mesh = llamar("esearch.fcgi", db="mesh", term=f"{termino_mesh}[MH]", retmode="json", retmax=5).json()
+    esummary_mesh = llamar(
+        "esummary.fcgi", db="mesh", id=",".join(esearch_mesh["esearchresult"]["idlist"]), retmode="json"
+    ).json()
+
+    escribir_fixtures(directorio, esearch, esummary, efetch, esearch_mesh, esummary_mesh)
+
+def escribir_fixtures(directorio, esearch, esummary, efetch, esearch_mesh, esummary_mesh):
+    os.makedirs(directorio, exist_ok=True)
+    contenidos = (json.dumps(esearch), json.dumps(esummary), efetch, json.dumps(esearch_mesh), json.dumps(esummary_mesh))
+    for nombre, contenido in zip(ARCHIVOS_FIXTURES, contenidos):
+        with open(os.path.join(directorio, nombre), "w", encoding="utf-8") as archivo:
+            archivo.write(contenido)
+
+class FixturesEutils:
+    """Respuestas grabadas, indexadas por PMID para servir cualquier subconjunto"""
+
+    def __init__(self, directorio):
+        if not all(os.path.exists(os.path.join(directorio, nombre)) for nombre in ARCHIVOS_FIXTURES):
+            generar_fixtures(directorio)
+
+        def leer(nombre):
+            with open(os.path.join(directorio, nombre), encoding="utf-8") as archivo:
+                return archivo.read()
+
+        self.pmids = json.loads(leer("esearch_pubmed.json"))["esearchresult"]["idlist"]
+        self.resumenes = json.loads(leer("esummary_pubmed.json"))["result"]
+        self.articulos_xml = {}
+        for articulo in ET.fromstring(leer("efetch_pubmed.xml")).iter("PubmedArticle"):
+            pmid = articulo.findtext("MedlineCitation/PMID", "").strip()
+            if pmid:
+                self.articulos_xml[pmid] = ET.tostring(articulo, encoding="unicode")
+        self.esearch_mesh = leer("esearch_mesh.json")
+        self.esummary_mesh = leer("esummary_mesh.json")
+
+        # Orden por fecha para sort=pub_date: los más recientes primero
+        self.pmids_por_fecha = sorted(
+            self.pmids, key=lambda pmid: self.resumenes.get(pmid, {}).get("pubdate", ""), reverse=True
+        )
+
+    def esearch(self, params):
+        if params.get("db") == "mesh":
+            return "application/json", self.esearch_mesh
+        orden = self.pmids_por_fecha if params.get("sort") == "pub_date" else self.pmids
+        inicio = int(params.get("retstart", 0))
+        retmax = int(params.get("retmax", 20))
+        return "application/json", json.dumps({"esearchresult": {
+            "count": str(len(orden)),
+            "retmax": str(retmax),
+            "retstart": str(inicio),
+            "idlist": orden[inicio:inicio + retmax],
+            "webenv": "MCID_FIXTURES",
+            "querykey": "1"
+        }})
+
+    def _ids(self, params):
+        if params.get("id"):
+            return [pmid.strip() for pmid in params["id"].split(",")]
+        # Consultas al History server: se sirve la misma lista grabada por posición
+        inicio = int(params.get("retstart", 0))
+        return self.pmids[inicio:inicio + int(params.get("retmax", 20))]
+
+    def esummary(self, params):
+        if params.get("db") == "mesh":
+            return "application/json", self.esummary_mesh
+        ids = [pmid for pmid in self._ids(params) if pmid in self.resumenes]
+        resultado = {"uids": ids}
+        for pmid in ids:
+            resultado[pmid] = self.resumenes[pmid]
+        return "application/json", json.dumps({"result": resultado})
+
+    def efetch(self, params):
+        cuerpo = "".join(self.articulos_xml[pmid] for pmid in self._ids(params) if pmid in self.articulos_xml)
+        return "text/xml", f'<?xml version="1.0" ?>\n<PubmedArticleSet>{cuerpo}</PubmedArticleSet>'
+
+class ServidorEutilsFalso:
+    """ThreadingHTTPServer con latencia (media ± jitter) y errores 503 inyectados"""
+
+    def __init__(self, fixtures, puerto=0, latencia_ms=0.0, jitter_ms=0.0, tasa_error=0.0, semilla=1):
+        self.fixtures = fixtures
+        self.latencia = latencia_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.tasa_error = tasa_error
+        self._aleatorio = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.llamadas = Counter()
+        self.errores_inyectados = Counter()
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        self.puerto = self._servidor.server_address[1]
+        self.url = f"http://127.0.0.1:{self.puerto}"
+
+    def _sortear(self):
+        with self._lock:
+            espera = max(0.0, self._aleatorio.gauss(self.latencia, self.jitter)) if self.jitter else self.latencia
+            return espera, self._aleatorio.random() < self.tasa_error
+
+    def _manejador(self):
+        servidor = self
+        rutas = {"esearch.fcgi": self.fixtures.esearch, "esummary.fcgi": self.fixtures.esummary, "efetch.fcgi": self.fixtures.efetch}
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, consulta):
+                params = {clave: valores[0] for clave, valores in urllib.parse.parse_qs(consulta).items()}
+                endpoint = urllib.parse.urlparse(self.path).path.rsplit("/", 1)[-1]
+                clave = f"{endpoint}:{params.get('db', 'pubmed')}"
+                with servidor._lock:
+                    servidor.llamadas[clave] += 1
+
+                espera, fallar = servidor._sortear()
+                if espera:
+                    time.sleep(espera)
+
+                if endpoint not in rutas:
+                    estado, tipo, cuerpo = 404, "text/plain", "endpoint desconocido"
+                elif fallar:
+                    with servidor._lock:
+                        servidor.errores_inyectados[clave] += 1
+                    estado, tipo, cuerpo = 503, "text/plain", "error inyectado"
+                else:
+                    estado = 200
+                    tipo, cuerpo = rutas[endpoint](params)
+
+                datos = cuerpo.encode("utf-8")
+                self.send_response(estado)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_GET(self):
+                self._responder(urllib.parse.urlparse(self.path).query)
+
+            def do_POST(self):
+                longitud = int(self.headers.get("Content-Length", 0))
+                self._responder(self.rfile.read(longitud).decode("utf-8"))
+
+        return Manejador
+
+    def iniciar(self):
+        threading.Thread(target=self._servidor.serve_forever, name="eutils-falso", daemon=True).start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "llamadas": dict(self.llamadas),
+                "errores_inyectados": dict(self.errores_inyectados),
+                "latencia_ms": self.latencia * 1000,
+                "jitter_ms": self.jitter * 1000,
+                "tasa_error": self.tasa_error
+            }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=DIRECTORIO_FIXTURES, help="Directorio de fixtures")
+    parser.add_argument("--puerto", type=int, default=18800)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="Latencia media añadida a cada respuesta")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Desviación típica de la latencia")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de respuestas 503 (0-1)")
+    parser.add_argument("--generar", action="store_true", help="Regenera los fixtures sintéticos y termina")
+    parser.add_argument("--grabar", metavar="QUERY", help="Graba fixtures reales de NCBI para la query y termina")
+    parser.add_argument("--articulos", type=int, default=300, help="Artículos a generar o grabar")
+    args = parser.parse_args()
+
+    if args.grabar:
+        grabar_fixtures(args.fixtures, args.grabar, args.articulos, os.getenv("PUBMED_API_KEY"))
+        print(f"Fixtures grabados en {args.fixtures}")
+        return
+    if args.generar:
+        generar_fixtures(args.fixtures, args.articulos)
+        print(f"Fixtures generados en {args.fixtures}")
+        return
+
+    servidor = ServidorEutilsFalso(
+        FixturesEutils(args.fixtures), args.puerto, args.latencia_ms, args.jitter_ms, args.tasa_error
+    ).iniciar()
+    print(f"E-utilities falso en {servidor.url} (EUTILS_BASE_URL={servidor.url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(servidor.resumen(), indent=2))
+        servidor.detener()
+
+if __name__ == "__main__":
+    main()
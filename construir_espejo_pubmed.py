@@ -0,0 +1,193 @@
+"""
+Construye y actualiza el espejo local de PubMed que consulta realizar_busqueda_pubmed.
+
+Recorre con iterparse los archivos XML de PubMed (baseline y updatefiles,
+pubmedYYnNNNN.xml.gz) y guarda en SQLite/FTS5 los artículos cuyos descriptores
+MeSH caen dentro de los subárboles indicados (por defecto Physical Therapy
+Modalities E02.779 y Rehabilitation E02.831). El filtro usa el índice MeSH local
+(construir_indice_mesh.py) para conocer los números de árbol de cada descriptor.
+
+Los archivos se aplican en orden y cada uno una sola vez, así que los updatefiles
+diarios se pueden aplicar sin reconstruir: los artículos revisados se reemplazan
+(o se eliminan si ya no pertenecen al subconjunto) y los <DeleteCitation> se borran.
+
+Uso:
+    python construir_espejo_pubmed.py baseline/pubmed24n*.xml.gz
+    python construir_espejo_pubmed.py updatefiles/pubmed24n1220.xml.gz --arbol E02.779 --arbol C23.888.592
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+
+from formatos_ncbi import ESQUEMA_ESPEJO_PUBMED, IndiceMesh, MESH_INDICE, PUBMED_ESPEJO, extraer_registro_pubmed
+
+ARBOLES_POR_DEFECTO = ["E02.779", "E02.831"]
+TAMANO_LOTE = 1000
+
+def abrir_archivo(ruta):
+    if ruta.endswith(".gz"):
+        return gzip.open(ruta, "rb")
+    return open(ruta, "rb")
+
+class ArbolesMesh:
+    """Números de árbol por descriptor y nombre por número de árbol, leídos del índice MeSH"""
+
+    def __init__(self, indice):
+        self.indice = indice
+        self.nombre_por_arbol = {}
+        for i in range(indice.n_descriptores):
+            registro = indice.descriptor(i)
+            for arbol in registro["arboles"]:
+                self.nombre_por_arbol[arbol] = registro["nombre"]
+
+    def arboles(self, nombre):
+        descriptor = self.indice.buscar_descriptor(nombre)
+        return self.indice.descriptor(descriptor)["arboles"] if descriptor is not None else []
+
+    def ancestros(self, arboles):
+        """Nombres de todos los ancestros, para que buscar un descriptor incluya sus hijos"""
+        nombres = set()
+        for arbol in arboles:
+            partes = arbol.split(".")
+            for n in range(1, len(partes)):
+                nombre = self.nombre_por_arbol.get(".".join(partes[:n]))
+                if nombre:
+                    nombres.add(nombre)
+        return nombres
+
+def en_subarbol(arboles, prefijos):
+    return any(arbol == p or arbol.startswith(p + ".") for arbol in arboles for p in prefijos)
+
+def leer_archivo(ruta):
+    """Produce ("articulo", registro) y ("borrado", pmid) recorriendo el XML con memoria constante"""
+    with abrir_archivo(ruta) as archivo:
+        contexto = ET.iterparse(archivo, events=("start", "end"))
+        _, raiz = next(contexto)
+        for evento, elem in contexto:
+            if evento != "end":
+                continue
+            if elem.tag == "PubmedArticle":
+                registro = extraer_registro_pubmed(elem)
+                if registro is not None and registro.pmid.isdigit():
+                    yield "articulo", registro
+                raiz.clear()
+            elif elem.tag == "DeleteCitation":
+                for pmid in elem.iterfind("PMID"):
+                    if pmid.text and pmid.text.strip().isdigit():
+                        yield "borrado", int(pmid.text.strip())
+                raiz.clear()
+            elif elem.tag == "PubmedBookArticle":
+                raiz.clear()
+
+def fila_articulo(registro, arboles, arboles_mesh):
+    mesh = list(registro.mesh)
+    if arboles_mesh is not None:
+        mesh.extend(sorted(arboles_mesh.ancestros(arboles) - set(mesh)))
+    return (
+        int(registro.pmid), registro.titulo, registro.abstract,
+        json.dumps([{"name": autor} for autor in registro.autores], ensure_ascii=False), registro.journal,
+        registro.anio, registro.pubdate, registro.doi, " ; ".join(mesh), " ; ".join(registro.tipos),
+        " ".join(registro.idiomas), time.time()
+    )
+
+SQL_UPSERT = (
+    "INSERT INTO articulos (pmid, titulo, abstract, autores, journal, anio, pubdate, doi, mesh, tipos, idiomas, actualizado) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(pmid) DO UPDATE SET titulo = excluded.titulo, abstract = excluded.abstract, "
+    "autores = excluded.autores, journal = excluded.journal, anio = excluded.anio, pubdate = excluded.pubdate, "
+    "doi = excluded.doi, mesh = excluded.mesh, tipos = excluded.tipos, idiomas = excluded.idiomas, "
+    "actualizado = excluded.actualizado"
+)
+
+def aplicar_archivo(conexion, ruta, prefijos, arboles_mesh):
+    """Aplica un archivo en una transacción; devuelve (artículos guardados, artículos borrados)"""
+    guardados = 0
+    borrados = 0
+    filas = {}
+    eliminar = set()
+
+    def volcar():
+        # Las operaciones pendientes nunca afectan al mismo PMID, así que el orden entre ellas da igual
+        nonlocal borrados
+        if filas:
+            conexion.executemany(SQL_UPSERT, filas.values())
+            filas.clear()
+        if eliminar:
+            borrados += conexion.executemany(
+                "DELETE FROM articulos WHERE pmid = ?", [(pmid,) for pmid in eliminar]
+            ).rowcount
+            eliminar.clear()
+
+    with conexion:
+        for tipo, valor in leer_archivo(ruta):
+            if tipo == "borrado":
+                pmid = valor
+                if pmid in filas:
+                    volcar()
+                eliminar.add(pmid)
+            else:
+                pmid = int(valor.pmid)
+                if pmid in eliminar or pmid in filas:
+                    volcar()
+                arboles = [a for nombre in valor.mesh for a in arboles_mesh.arboles(nombre)] if arboles_mesh else []
+                if not prefijos or en_subarbol(arboles, prefijos):
+                    filas[pmid] = fila_articulo(valor, arboles, arboles_mesh)
+                    guardados += 1
+                else:
+                    # Una revisión puede sacar del subconjunto un artículo que ya estaba en el espejo
+                    eliminar.add(pmid)
+
+            if len(filas) >= TAMANO_LOTE or len(eliminar) >= TAMANO_LOTE:
+                volcar()
+        volcar()
+
+        conexion.execute(
+            "INSERT OR REPLACE INTO archivos (nombre, tamano, articulos, borrados, procesado) VALUES (?, ?, ?, ?, ?)",
+            (os.path.basename(ruta), os.path.getsize(ruta), guardados, borrados, time.time())
+        )
+    return guardados, borrados
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archivos", nargs="+", help="Archivos pubmedYYnNNNN.xml(.gz) de baseline o updatefiles")
+    parser.add_argument("-o", "--salida", default=PUBMED_ESPEJO, help="Base de datos del espejo")
+    parser.add_argument("--arbol", action="append", help="Prefijo de número de árbol MeSH a incluir (repetible)")
+    parser.add_argument("--todos", action="store_true", help="No filtrar por MeSH: guardar todos los artículos")
+    parser.add_argument("--mesh-indice", default=MESH_INDICE, help="Índice MeSH generado con construir_indice_mesh.py")
+    parser.add_argument("--forzar", action="store_true", help="Reaplicar archivos ya procesados")
+    args = parser.parse_args()
+
+    prefijos = [] if args.todos else (args.arbol or ARBOLES_POR_DEFECTO)
+    arboles_mesh = None
+    if os.path.exists(args.mesh_indice):
+        arboles_mesh = ArbolesMesh(IndiceMesh(args.mesh_indice))
+    elif prefijos:
+        parser.error(f"El filtro por subárbol necesita el índice MeSH ({args.mesh_indice}); usa --todos para no filtrar")
+
+    conexion = sqlite3.connect(args.salida)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.executescript(ESQUEMA_ESPEJO_PUBMED)
+    procesados = {fila[0] for fila in conexion.execute("SELECT nombre FROM archivos")}
+
+    inicio = time.time()
+    # Los nombres de PubMed llevan número de secuencia: el orden alfabético es el de aplicación
+    for ruta in sorted(args.archivos, key=os.path.basename):
+        if os.path.basename(ruta) in procesados and not args.forzar:
+            print(f"{ruta}: ya aplicado, se omite")
+            continue
+        inicio_archivo = time.time()
+        guardados, borrados = aplicar_archivo(conexion, ruta, prefijos, arboles_mesh)
+        print(f"{ruta}: {guardados} artículos, {borrados} borrados ({time.time() - inicio_archivo:.1f}s)")
+
+    total = conexion.execute("SELECT COUNT(*) FROM articulos").fetchone()[0]
+    conexion.execute("INSERT INTO articulos_fts (articulos_fts) VALUES ('optimize')")
+    conexion.commit()
+    conexion.close()
+    print(f"Espejo de PubMed en {args.salida}: {total} artículos ({time.time() - inicio:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Construye el índice MeSH local que usa obtener_mesh_relacionados.
+
+Lee el volcado de descriptores MeSH de la NLM (descYYYY.xml, opcionalmente .gz)
+y genera un archivo binario mapeable en memoria con, para cada descriptor, sus
+vecinos precalculados a partir de números de árbol (hijos y padres), enlaces
+"see also" y entry terms como claves de búsqueda.
+
+Uso:
+    python construir_indice_mesh.py desc2024.xml.gz -o mesh_indice.bin
+"""
+import argparse
+import gzip
+import time
+import xml.etree.ElementTree as ET
+
+from formatos_ncbi import (
+    MAGIA_INDICE_MESH,
+    CABECERA_INDICE_MESH,
+    CLAVE_INDICE_MESH,
+    DESCRIPTOR_INDICE_MESH,
+)
+
+MAX_VECINOS = 10
+
+def abrir_volcado(ruta):
+    """Abre el XML de descriptores, comprimido o no"""
+    if ruta.endswith(".gz"):
+        return gzip.open(ruta, "rb")
+    return open(ruta, "rb")
+
+def leer_descriptores(ruta):
+    """Recorre el volcado con iterparse y produce un dict por DescriptorRecord"""
+    with abrir_volcado(ruta) as archivo:
+        for _, elem in ET.iterparse(archivo, events=("end",)):
+            if elem.tag != "DescriptorRecord":
+                continue
+
+            ui = elem.findtext("DescriptorUI", "").strip()
+            nombre = elem.findtext("DescriptorName/String", "").strip()
+            arboles = [t.text.strip() for t in elem.iterfind("TreeNumberList/TreeNumber") if t.text]
+            terminos = {t.text.strip() for t in elem.iterfind("ConceptList/Concept/TermList/Term/String") if t.text}
+            ver_tambien = [
+                d.text.strip()
+                for d in elem.iterfind("SeeRelatedList/SeeRelatedDescriptor/DescriptorReferredTo/DescriptorUI")
+                if d.text
+            ]
+            elem.clear()
+
+            if ui and nombre:
+                yield {
+                    "ui": ui,
+                    "nombre": nombre,
+                    "arboles": arboles,
+                    "terminos": terminos,
+                    "ver_tambien": ver_tambien
+                }
+
+def calcular_vecinos(descriptores):
+    """Vecinos de cada descriptor: hijos, "see also" y padres, sin repetir"""
+    por_ui = {d["ui"]: i for i, d in enumerate(descriptores)}
+    por_arbol = {}
+    hijos = {}
+    for i, d in enumerate(descriptores):
+        for arbol in d["arboles"]:
+            por_arbol[arbol] = i
+    for arbol, i in por_arbol.items():
+        if "." in arbol:
+            hijos.setdefault(arbol.rsplit(".", 1)[0], []).append(i)
+
+    vecinos = []
+    for i, d in enumerate(descriptores):
+        candidatos = []
+        for arbol in d["arboles"]:
+            candidatos.extend(sorted(hijos.get(arbol, []), key=lambda j: descriptores[j]["nombre"]))
+        candidatos.extend(por_ui[ui] for ui in d["ver_tambien"] if ui in por_ui)
+        for arbol in d["arboles"]:
+            if "." in arbol:
+                padre = por_arbol.get(arbol.rsplit(".", 1)[0])
+                if padre is not None:
+                    candidatos.append(padre)
+
+        vistos = {i}
+        lista = []
+        for j in candidatos:
+            if j not in vistos:
+                vistos.add(j)
+                lista.append(j)
+            if len(lista) >= MAX_VECINOS:
+                break
+        vecinos.append(lista)
+    return vecinos
+
+def escribir_indice(descriptores, vecinos, salida):
+    """Serializa el índice con el formato que lee formatos_ncbi.IndiceMesh"""
+    claves = {}
+    for i, d in enumerate(descriptores):
+        for termino in {d["nombre"]} | d["terminos"]:
+            clave = termino.lower().encode("utf-8")
+            # Si un entry term aparece en varios descriptores, gana el que lo tiene como nombre
+            if clave not in claves or termino == d["nombre"]:
+                claves[clave] = i
+    claves_ordenadas = sorted(claves.items())
+
+    registros = []
+    for d, lista in zip(descriptores, vecinos):
+        registro = "\x1f".join([
+            d["ui"],
+            d["nombre"],
+            ";".join(d["arboles"]),
+            ",".join(str(j) for j in lista)
+        ])
+        registros.append(registro.encode("utf-8"))
+
+    inicio_datos = (
+        CABECERA_INDICE_MESH.size
+        + len(claves_ordenadas) * CLAVE_INDICE_MESH.size
+        + len(registros) * DESCRIPTOR_INDICE_MESH.size
+    )
+    tabla_claves = bytearray()
+    tabla_descriptores = bytearray()
+    datos = bytearray()
+
+    for clave, i in claves_ordenadas:
+        tabla_claves += CLAVE_INDICE_MESH.pack(inicio_datos + len(datos), len(clave), i)
+        datos += clave
+    for registro in registros:
+        tabla_descriptores += DESCRIPTOR_INDICE_MESH.pack(inicio_datos + len(datos), len(registro))
+        datos += registro
+
+    with open(salida, "wb") as archivo:
+        archivo.write(CABECERA_INDICE_MESH.pack(MAGIA_INDICE_MESH, len(claves_ordenadas), len(registros)))
+        archivo.write(tabla_claves)
+        archivo.write(tabla_descriptores)
+        archivo.write(datos)
+
+    return len(claves_ordenadas)
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice MeSH local a partir del volcado de descriptores de la NLM")
+    parser.add_argument("volcado", help="Archivo descYYYY.xml o descYYYY.xml.gz")
+    parser.add_argument("-o", "--salida", default="mesh_indice.bin", help="Ruta del índice generado")
+    args = parser.parse_args()
+
+    inicio = time.time()
+    descriptores = list(leer_descriptores(args.volcado))
+    vecinos = calcular_vecinos(descriptores)
+    n_claves = escribir_indice(descriptores, vecinos, args.salida)
+    print(f"Índice MeSH generado en {args.salida}: {len(descriptores)} descriptores, "
+          f"{n_claves} claves ({time.time() - inicio:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Formatos de datos de NCBI compartidos por la API y los scripts de construcción.
+
+El índice MeSH local lo escribe construir_indice_mesh.py y el espejo de PubMed
+construir_espejo_pubmed.py (con el mismo parser de XML que usa la API para
+efetch); la API lee ambos. Este módulo no importa app, así los scripts no
+arrancan Flask ni abren las cachés.
+"""
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ET
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Rutas de los archivos generados; las mismas variables de entorno para la API y los scripts
+MESH_INDICE = os.getenv("MESH_INDICE", os.path.join(DIRECTORIO, "mesh_indice.bin"))
+PUBMED_ESPEJO = os.getenv("PUBMED_ESPEJO", os.path.join(DIRECTORIO, "pubmed_espejo.sqlite3"))
+
+# =========================
+# ÍNDICE MESH LOCAL
+# =========================
+
+# Formato del archivo de índice (little-endian):
+#   cabecera:     MAGIA_INDICE_MESH, n_claves (uint32), n_descriptores (uint32)
+#   claves:       n_claves x (offset uint32, longitud uint16, descriptor uint32), ordenadas por bytes
+#   descriptores: n_descriptores x (offset uint32, longitud uint32)
+#   datos:        cadenas UTF-8; cada registro de descriptor es "UI\x1fNombre\x1fárboles;\x1fvecinos,"
+MAGIA_INDICE_MESH = b"MESHIDX1"
+CABECERA_INDICE_MESH = struct.Struct("<8sII")
+CLAVE_INDICE_MESH = struct.Struct("<IHI")
+DESCRIPTOR_INDICE_MESH = struct.Struct("<II")
+
+class IndiceMesh:
+    """Índice de vecinos MeSH precalculado y mapeado en memoria"""
+    
+    def __init__(self, ruta):
+        with open(ruta, "rb") as archivo:
+            self._mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        magia, self.n_claves, self.n_descriptores = CABECERA_INDICE_MESH.unpack_from(self._mapa, 0)
+        if magia != MAGIA_INDICE_MESH:
+            raise ValueError(f"Archivo de índice MeSH no válido: {ruta}")
+        self._inicio_claves = CABECERA_INDICE_MESH.size
+        self._inicio_descriptores = self._inicio_claves + self.n_claves * CLAVE_INDICE_MESH.size
+    
+    def _clave(self, i):
+        offset, longitud, descriptor = CLAVE_INDICE_MESH.unpack_from(self._mapa, self._inicio_claves + i * CLAVE_INDICE_MESH.size)
+        return self._mapa[offset:offset + longitud], descriptor
+    
+    def _registro(self, i):
+        offset, longitud = DESCRIPTOR_INDICE_MESH.unpack_from(self._mapa, self._inicio_descriptores + i * DESCRIPTOR_INDICE_MESH.size)
+        ui, nombre, arboles, vecinos = self._mapa[offset:offset + longitud].decode("utf-8").split("\x1f")
+        return {
+            "ui": ui,
+            "nombre": nombre,
+            "arboles": arboles.split(";") if arboles else [],
+            "vecinos": [int(v) for v in vecinos.split(",")] if vecinos else []
+        }
+    
+    def buscar_descriptor(self, termino):
+        """Búsqueda binaria del término (nombre o entry term) sin distinguir mayúsculas"""
+        objetivo = termino.strip().lower().encode("utf-8")
+        bajo, alto = 0, self.n_claves
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            clave, descriptor = self._clave(medio)
+            if clave < objetivo:
+                bajo = medio + 1
+            elif clave > objetivo:
+                alto = medio
+            else:
+                return descriptor
+        return None
+    
+    def descriptor(self, i):
+        """Registro completo de un descriptor por su posición"""
+        return self._registro(i)
+    
+    def relacionados(self, termino, limite=5):
+        """Nombres de los descriptores vecinos; None si el término no está en el índice"""
+        descriptor = self.buscar_descriptor(termino)
+        if descriptor is None:
+            return None
+        vecinos = self._registro(descriptor)["vecinos"][:limite]
+        return [self._registro(v)["nombre"] for v in vecinos]
+
+# =========================
+# ESPEJO LOCAL DE PUBMED
+# =========================
+
+# Esquema que crea construir_espejo_pubmed.py y consulta la API. El índice FTS5 usa la tabla articulos
+# como contenido externo y se mantiene con triggers (las actualizaciones usan UPSERT)
+ESQUEMA_ESPEJO_PUBMED = """
+CREATE TABLE IF NOT EXISTS articulos (
+    pmid INTEGER PRIMARY KEY,
+    titulo TEXT NOT NULL,
+    abstract TEXT NOT NULL,
+    autores TEXT NOT NULL,
+    journal TEXT NOT NULL,
+    anio INTEGER,
+    pubdate TEXT NOT NULL,
+    doi TEXT NOT NULL,
+    mesh TEXT NOT NULL,
+    tipos TEXT NOT NULL,
+    idiomas TEXT NOT NULL,
+    actualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_articulos_anio ON articulos (anio);
+CREATE VIRTUAL TABLE IF NOT EXISTS articulos_fts USING fts5(
+    titulo, abstract, mesh, tipos, idiomas,
+    content='articulos', content_rowid='pmid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS articulos_ai AFTER INSERT ON articulos BEGIN
+    INSERT INTO articulos_fts (rowid, titulo, abstract, mesh, tipos, idiomas)
+    VALUES (new.pmid, new.titulo, new.abstract, new.mesh, new.tipos, new.idiomas);
+END;
+CREATE TRIGGER IF NOT EXISTS articulos_ad AFTER DELETE ON articulos BEGIN
+    INSERT INTO articulos_fts (articulos_fts, rowid, titulo, abstract, mesh, tipos, idiomas)
+    VALUES ('delete', old.pmid, old.titulo, old.abstract, old.mesh, old.tipos, old.idiomas);
+END;
+CREATE TRIGGER IF NOT EXISTS articulos_au AFTER UPDATE ON articulos BEGIN
+    INSERT INTO articulos_fts (articulos_fts, rowid, titulo, abstract, mesh, tipos, idiomas)
+    VALUES ('delete', old.pmid, old.titulo, old.abstract, old.mesh, old.tipos, old.idiomas);
+    INSERT INTO articulos_fts (rowid, titulo, abstract, mesh, tipos, idiomas)
+    VALUES (new.pmid, new.titulo, new.abstract, new.mesh, new.tipos, new.idiomas);
+END;
+CREATE TABLE IF NOT EXISTS archivos (
+    nombre TEXT PRIMARY KEY,
+    tamano INTEGER NOT NULL,
+    articulos INTEGER NOT NULL,
+    borrados INTEGER NOT NULL,
+    procesado REAL NOT NULL
+);
+"""
+
+# =========================
+# XML DE PUBMED (EFETCH Y ARCHIVOS BASELINE)
+# =========================
+
+MESES_PUBMED = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+class RegistroArticulo:
+    """Artículo extraído de efetch; con __slots__ los lotes grandes ocupan poca memoria"""
+    
+    __slots__ = ("pmid", "titulo", "abstract", "autores", "journal", "anio", "pubdate", "doi", "mesh", "tipos", "idiomas")
+    
+    def __init__(self, pmid, titulo, abstract, autores, journal, anio, pubdate, doi, mesh, tipos, idiomas):
+        self.pmid = pmid
+        self.titulo = titulo
+        self.abstract = abstract
+        self.autores = autores
+        self.journal = journal
+        self.anio = anio
+        self.pubdate = pubdate
+        self.doi = doi
+        self.mesh = mesh
+        self.tipos = tipos
+        self.idiomas = idiomas
+    
+    def como_metadatos(self):
+        """Dict con la forma que usan la caché y el scoring (autores como en esummary)"""
+        return {
+            "pmid": self.pmid,
+            "title": self.titulo,
+            "authors": [{"name": autor} for autor in self.autores],
+            "pubdate": self.pubdate,
+            "journal": self.journal or "Journal desconocido",
+            "abstract": self.abstract,
+            "doi": self.doi,
+            "mesh": list(self.mesh),
+            "publication_types": list(self.tipos)
+        }
+
+def texto_nodo(elem):
+    """Texto de un nodo incluidas sus etiquetas de formato (<i>, <sup>...)"""
+    return "".join(elem.itertext()).strip() if elem is not None else ""
+
+def extraer_registro_pubmed(articulo_xml):
+    """Todos los campos que usamos de un <PubmedArticle>, en un único recorrido del nodo"""
+    citacion = articulo_xml.find("MedlineCitation")
+    if citacion is None:
+        return None
+    pmid = citacion.findtext("PMID", "").strip()
+    datos = citacion.find("Article")
+    if not pmid or datos is None:
+        return None
+    
+    # Abstracts estructurados: todas las secciones, con su etiqueta (BACKGROUND:, METHODS:...)
+    partes_abstract = []
+    for parte in datos.iterfind("Abstract/AbstractText"):
+        texto = texto_nodo(parte)
+        if texto:
+            etiqueta = parte.get("Label")
+            partes_abstract.append(f"{etiqueta}: {texto}" if etiqueta else texto)
+    
+    autores = []
+    for autor in datos.iterfind("AuthorList/Author"):
+        apellido = autor.findtext("LastName")
+        if apellido:
+            autores.append(f"{apellido} {autor.findtext('Initials', '')}".strip())
+        elif autor.findtext("CollectiveName"):
+            autores.append(autor.findtext("CollectiveName").strip())
+    
+    fecha = datos.find("Journal/JournalIssue/PubDate")
+    anio = mes = ""
+    if fecha is not None:
+        anio = fecha.findtext("Year") or (fecha.findtext("MedlineDate") or "")[:4]
+        mes = fecha.findtext("Month", "")
+        if mes.isdigit() and 1 <= int(mes) <= 12:
+            mes = MESES_PUBMED[int(mes) - 1]
+    
+    doi = ""
+    for nodo in datos.iterfind("ELocationID"):
+        if nodo.get("EIdType") == "doi" and nodo.text:
+            doi = nodo.text.strip()
+            break
+    if not doi:
+        for nodo in articulo_xml.iterfind("PubmedData/ArticleIdList/ArticleId"):
+            if nodo.get("IdType") == "doi" and nodo.text:
+                doi = nodo.text.strip()
+                break
+    
+    return RegistroArticulo(
+        pmid=pmid,
+        titulo=texto_nodo(datos.find("ArticleTitle")),
+        abstract=" ".join(partes_abstract),
+        autores=tuple(autores),
+        journal=datos.findtext("Journal/Title", "").strip(),
+        anio=int(anio) if anio.isdigit() else None,
+        pubdate=f"{anio} {mes}".strip(),
+        doi=doi,
+        mesh=tuple(d.text.strip() for d in citacion.iterfind("MeshHeadingList/MeshHeading/DescriptorName") if d.text),
+        tipos=tuple(t.text.strip() for t in datos.iterfind("PublicationTypeList/PublicationType") if t.text),
+        idiomas=tuple(i.text.strip() for i in datos.iterfind("Language") if i.text)
+    )
+
+class LectorEfetch:
+    """Parser incremental de XML de efetch: recibe trozos de bytes según llegan y devuelve los artículos
+    ya completos; cada artículo se libera al procesarlo, así la memoria no crece con el tamaño del lote"""
+    
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._raiz = None
+    
+    def alimentar(self, trozo):
+        self._parser.feed(trozo)
+        registros = []
+        for evento, elem in self._parser.read_events():
+            if self._raiz is None:
+                self._raiz = elem
+            elif evento == "end" and elem.tag in ("PubmedArticle", "PubmedBookArticle"):
+                registro = extraer_registro_pubmed(elem) if elem.tag == "PubmedArticle" else None
+                self._raiz.clear()
+                if registro is not None:
+                    registros.append(registro)
+        return registros
+    
+    def cerrar(self):
+        self._parser.close()
+
+def iterar_registros_efetch(trozos):
+    """Parsea en streaming un XML de efetch (iterable de bytes) y produce un RegistroArticulo por artículo"""
+    lector = LectorEfetch()
+    for trozo in trozos:
+        yield from lector.alimentar(trozo)
+    lector.cerrar()
@@ -0,0 +1,76 @@
+"""
+Configuración de gunicorn para producción.
+
+Uso:
+    gunicorn -c gunicorn.conf.py app:app
+
+La app se importa una sola vez en el proceso maestro (preload_app) y se precalienta
+antes del fork: NLTK, detector de conceptos, índice MeSH y caché de artículos quedan
+compartidos copy-on-write entre workers. Cada worker recrea tras el fork su sesión
+HTTP, sus conexiones SQLite y sus hilos de la cola de trabajos.
+"""
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Métricas Prometheus agregadas entre workers: el directorio debe existir y estar vacío
+# antes de importar la app, y el entorno lo heredan todos los workers
+directorio_metricas = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "citas_apa_prometheus")
+)
+shutil.rmtree(directorio_metricas, ignore_errors=True)
+os.makedirs(directorio_metricas, exist_ok=True)
+
+# Los hilos de la cola de trabajos no deben arrancar en el maestro: cada worker los arranca en post_fork
+os.environ["JOBS_INICIAR_AL_IMPORTAR"] = "0"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Workers con hilos: el pipeline pasa casi todo el tiempo esperando a NCBI
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+preload_app = True
+
+# Las búsquedas con respaldo a la API pueden tardar; los documentos largos mucho más
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Reciclar workers periódicamente acota el crecimiento de memoria
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+accesslog = "-"
+errorlog = "-"
+
+def on_starting(server):
+    """En el maestro, con la app ya importada: precalentar y congelar el heap antes del fork"""
+    import app
+
+    app.precalentar()
+    # Los objetos ya creados no los recorre el GC en los workers, así no se copian sus páginas
+    gc.freeze()
+
+def post_fork(server, worker):
+    """En cada worker: arrancar los hilos de la cola de trabajos del proceso"""
+    import app
+
+    app.cola_trabajos.iniciar()
+
+def worker_exit(server, worker):
+    """Parada ordenada: dejar terminar los jobs en curso dentro del margen de graceful_timeout"""
+    import app
+
+    app.cola_trabajos.detener(timeout=max(1, graceful_timeout - 5))
+
+def child_exit(server, worker):
+    """Descartar los gauges del worker que ha terminado"""
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)